@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+""" Benchmark of the LocobotClient calls against a running server.
+
+Meant to be run against mock_server.py on a machine without a robot, the
+same calls work against server.py on the robot. Reports the per-call
+latency and calls/sec of every benchmarked call and of a full env-like
+step (base motion, arm motion and the observations), and optionally
+compares them with a saved baseline to catch regressions.
+
+Example:
+    rosrun locobot_interface mock_server.py --num-objects 10 &
+    rosrun locobot_interface benchmark_client.py --num-calls 50 --save results.json
+    rosrun locobot_interface benchmark_client.py --num-calls 50 --baseline results.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import rospy
+
+from locobot_interface.client import LocobotClient
+
+
+def get_benchmarks(client):
+    start_joints = client.get_joint_angles()
+    # the 15x15 grid of grasp candidates in front of the robot
+    grasp_xs, grasp_ys = np.meshgrid(np.linspace(0.3, 0.47, 15), np.linspace(-0.08, 0.08, 15))
+    grasp_xs, grasp_ys = grasp_xs.ravel(), grasp_ys.ravel()
+
+    def env_step():
+        client.set_base_vel(0.1, 0.0, 0.2)
+        client.set_joint_angles(start_joints)
+        client.get_image()
+        client.get_depth()
+        client.is_grasp_obstructed(0.4, 0.0)
+
+    def env_step_async():
+        base = client.set_base_vel_async(0.1, 0.0, 0.2)
+        arm = client.set_joint_angles_async(start_joints)
+        client.get_image()
+        client.get_depth()
+        client.is_grasp_obstructed(0.4, 0.0)
+        base.wait()
+        arm.wait()
+
+    return (
+        ('get_image', lambda: client.get_image(max_age=0.0)),
+        ('get_image_stream', client.get_image),
+        ('get_depth', lambda: client.get_depth(max_age=0.0)),
+        ('get_depth_stream', client.get_depth),
+        ('get_pointcloud', client.get_pointcloud),
+        ('is_grasp_obstructed', lambda: client.is_grasp_obstructed(0.4, 0.0)),
+        ('grasp_grid', lambda: [client.is_grasp_obstructed(x, y) for x, y in zip(grasp_xs, grasp_ys)]),
+        ('grasp_grid_batch', lambda: client.are_grasps_obstructed(grasp_xs, grasp_ys)),
+        ('ik_grid_batch', lambda: client.get_ik_positions(
+            np.stack([grasp_xs, grasp_ys, np.full_like(grasp_xs, 0.2)], axis=1), np.pi / 2, 0.0)),
+        ('set_pan_tilt', lambda: client.set_pan_tilt(0.0, 0.8)),
+        ('set_joint_angles', lambda: client.set_joint_angles(start_joints)),
+        ('set_base_vel', lambda: client.set_base_vel(0.0, 0.0, 0.1)),
+        ('env_step', env_step),
+        ('env_step_async', env_step_async),
+    )
+
+
+def benchmark(fn, num_calls):
+    fn()
+    times = []
+    for _ in range(num_calls):
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+    times = np.array(times)
+    return {
+        'calls_per_second': len(times) / np.sum(times),
+        'mean_ms': 1e3 * np.mean(times),
+        'p50_ms': 1e3 * np.percentile(times, 50),
+        'p95_ms': 1e3 * np.percentile(times, 95),
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """ :returns: names of the calls whose mean latency grew by more than tolerance over the baseline """
+    return [
+        name for name, result in results.items()
+        if name in baseline and result['mean_ms'] > (1.0 + tolerance) * baseline[name]['mean_ms']
+    ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-calls', type=int, default=20)
+    parser.add_argument('--only', nargs='*', default=None, help="names of the calls to benchmark")
+    parser.add_argument('--save', type=str, default=None, help="saves the results as json")
+    parser.add_argument('--baseline', type=str, default=None, help="json results to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative increase of the mean latency over the baseline that fails the run")
+    return parser.parse_args(rospy.myargv()[1:])
+
+
+def main():
+    args = parse_args()
+    client = LocobotClient()
+
+    results = {}
+    for name, fn in get_benchmarks(client):
+        if args.only and name not in args.only:
+            continue
+        results[name] = benchmark(fn, args.num_calls)
+        print("{:<20} {:10.2f} calls/sec {:10.2f} ms mean {:10.2f} ms p50 {:10.2f} ms p95".format(
+            name, results[name]['calls_per_second'], results[name]['mean_ms'],
+            results[name]['p50_ms'], results[name]['p95_ms']))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for name in regressions:
+            print("regression: {} {:.2f} ms mean, baseline {:.2f} ms".format(
+                name, results[name]['mean_ms'], baseline[name]['mean_ms']))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
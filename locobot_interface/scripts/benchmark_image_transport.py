@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+""" Local benchmark of the GetImage transports, no robot or ROS master needed.
+
+Compares raw color and depth frames with jpeg/png color and lossless png
+depth. Reports the bytes per frame, the encode and decode time, and the
+per-frame latency and frame rate over a link of the given bandwidth
+(encode + transfer + decode).
+
+Example:
+    python scripts/benchmark_image_transport.py --bandwidth-mbps 100 --num-frames 50
+    python scripts/benchmark_image_transport.py --color frame.npy --depth depth.npy
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from locobot_interface.compression import encode_image, decode_image
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-frames', type=int, default=20)
+    parser.add_argument('--bandwidth-mbps', type=float, default=100.0)
+    parser.add_argument('--jpeg-quality', type=int, default=90)
+    parser.add_argument('--color', type=str, default=None, help=".npy 480x640x3 uint8 color frame")
+    parser.add_argument('--depth', type=str, default=None, help=".npy 480x640 uint16 depth frame in mm")
+    return parser.parse_args()
+
+
+def synthetic_frames(height=480, width=640, seed=0):
+    """ A floor and a few boxes, smooth like a camera frame rather than noise that doesn't compress """
+    random = np.random.RandomState(seed)
+    v, u = np.mgrid[0:height, 0:width]
+
+    depth = 800.0 + 3000.0 * (1.0 - v / height) ** 2
+    color = np.stack([80 + 60 * v / height, 70 + 50 * u / width, 60 * np.ones_like(u)], axis=-1)
+    for _ in range(6):
+        top, left = random.randint(0, height - 80), random.randint(0, width - 80)
+        size = random.randint(30, 80)
+        depth[top:top + size, left:left + size] = random.uniform(500, 2500)
+        color[top:top + size, left:left + size] = random.randint(0, 255, size=3)
+
+    color = color + random.normal(0, 2, size=color.shape)
+    depth = depth + random.normal(0, 2, size=depth.shape)
+    return np.clip(color, 0, 255).astype(np.uint8), depth.astype(np.uint16)
+
+
+def benchmark(image, compression, num_frames, jpeg_quality):
+    """ :returns: (bytes per frame, encode seconds, decode seconds, decoded image) """
+    if not compression:
+        encode = lambda: image.tobytes()
+        decode = lambda data: np.frombuffer(data, dtype=image.dtype).reshape(image.shape)
+    else:
+        encode = lambda: encode_image(image, compression, jpeg_quality=jpeg_quality)
+        decode = lambda encoded: decode_image(*encoded)
+
+    start_time = time.perf_counter()
+    for _ in range(num_frames):
+        encoded = encode()
+    encode_time = (time.perf_counter() - start_time) / num_frames
+
+    start_time = time.perf_counter()
+    for _ in range(num_frames):
+        decoded = decode(encoded)
+    decode_time = (time.perf_counter() - start_time) / num_frames
+
+    num_bytes = len(encoded) if not compression else len(encoded[1])
+    return num_bytes, encode_time, decode_time, decoded
+
+
+def main():
+    args = parse_args()
+    color, depth = synthetic_frames()
+    if args.color is not None:
+        color = np.load(args.color)
+    if args.depth is not None:
+        depth = np.load(args.depth)
+    bytes_per_second = args.bandwidth_mbps * 1e6 / 8
+
+    print("{:<12} {:>10} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        'transport', 'KB/frame', 'ratio', 'encode ms', 'decode ms', 'link ms', 'total ms', 'frames/s'))
+    for name, image, compression in (('color raw', color, ''),
+                                     ('color jpeg', color, 'jpeg'),
+                                     ('color png', color, 'png'),
+                                     ('depth raw', depth, ''),
+                                     ('depth png', depth, 'png')):
+        num_bytes, encode_time, decode_time, decoded = benchmark(
+            image, compression, args.num_frames, args.jpeg_quality)
+        if image.dtype == np.uint16 or compression == 'png':
+            np.testing.assert_array_equal(decoded.reshape(image.shape), image)
+
+        link_time = num_bytes / bytes_per_second
+        total_time = encode_time + link_time + decode_time
+        print("{:<12} {:10.1f} {:8.1f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.1f}".format(
+            name, num_bytes / 1e3, image.nbytes / num_bytes, 1e3 * encode_time, 1e3 * decode_time,
+            1e3 * link_time, 1e3 * total_time, 1.0 / max(link_time, encode_time, decode_time)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+""" Local benchmark of the GetPointcloud transport, no robot or ROS master needed.
+
+Compares the previous float32[] list transport with the packed binary one,
+including the message (de)serialization when the generated services are
+importable, and reports calls/sec and MB/sec for each.
+
+Example:
+    python scripts/benchmark_pointcloud.py --num-points 307200 --num-calls 20
+"""
+
+import argparse
+import struct
+import time
+from io import BytesIO
+
+import numpy as np
+
+from locobot_interface.serialization import encode_array, decode_array
+
+try:
+    from locobot_interface.srv import GetPointcloudResponse
+except ImportError:
+    GetPointcloudResponse = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-points', type=int, default=480 * 640)
+    parser.add_argument('--num-calls', type=int, default=20)
+    return parser.parse_args()
+
+
+def roundtrip_message(resp):
+    buff = BytesIO()
+    resp.serialize(buff)
+    serialized = buff.getvalue()
+    decoded = GetPointcloudResponse()
+    decoded.deserialize(serialized)
+    return decoded, len(serialized)
+
+
+def list_transport(pts):
+    """ The previous transport: a float32[] field filled from a python list. """
+    flat_pts = pts.reshape(-1).tolist()
+    # what the generated serializer does for a float32[] field
+    serialized = struct.pack('<I%sf' % len(flat_pts), len(flat_pts), *flat_pts)
+    (length,) = struct.unpack('<I', serialized[:4])
+    decoded = struct.unpack('<%sf' % length, serialized[4:])
+    return np.array(decoded).reshape((-1, 3)), len(serialized)
+
+
+def binary_transport(pts):
+    data, shape, dtype = encode_array(pts)
+    if GetPointcloudResponse is not None:
+        resp, num_bytes = roundtrip_message(GetPointcloudResponse(data, shape, dtype))
+        data, shape, dtype = resp.data, resp.shape, resp.dtype
+    else:
+        num_bytes = len(data) + 4 * len(shape) + len(dtype) + 12
+    return decode_array(data, shape, dtype), num_bytes
+
+
+def benchmark(transport, pts, num_calls):
+    transport(pts)
+
+    num_bytes = 0
+    start_time = time.perf_counter()
+    for _ in range(num_calls):
+        decoded, call_bytes = transport(pts)
+        num_bytes += call_bytes
+    elapsed_time = time.perf_counter() - start_time
+
+    np.testing.assert_allclose(decoded, pts)
+    return num_calls / elapsed_time, num_bytes / elapsed_time
+
+
+def main():
+    args = parse_args()
+    pts = np.random.uniform(-2, 2, size=(args.num_points, 3)).astype(np.float32)
+
+    if GetPointcloudResponse is None:
+        print("locobot_interface.srv not built, benchmarking without message serialization")
+
+    for name, transport in (('list', list_transport), ('binary', binary_transport)):
+        calls_per_second, bytes_per_second = benchmark(transport, pts, args.num_calls)
+        print("{:<8} {:10.2f} calls/sec {:10.2f} MB/sec".format(
+            name, calls_per_second, bytes_per_second / 1e6))
+
+
+if __name__ == '__main__':
+    main()
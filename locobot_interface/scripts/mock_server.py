@@ -0,0 +1,533 @@
+#!/usr/bin/python
+
+""" Hardware-free stand-in for server.py, backed by the PyBullet LoCoBot simulation.
+
+Serves the same python3_server/* services and streams, and publishes the
+/joint_states, /gripper/state and /odom topics the client subscribes to,
+so that LocobotClient and everything above it runs without a robot or
+PyRobot. Every service call can be delayed to emulate the latency of the
+real robot, and motions run at simulation speed or, with --realtime, at
+the speed of the real robot.
+
+Needs the mobilemanipulation package on the PYTHONPATH for the simulation.
+
+Example:
+    rosrun locobot_interface mock_server.py --latency 0.02 --latency-jitter 0.01 \
+        --service-latency base_vel_command=0.5 --num-objects 10
+"""
+
+import argparse
+import random
+import threading
+import time
+import traceback
+
+import numpy as np
+import rospy
+from std_msgs.msg import Int8
+from sensor_msgs.msg import Image, CompressedImage, JointState
+from nav_msgs.msg import Odometry
+
+from locobot_interface.srv import *
+from locobot_interface.serialization import encode_array
+from locobot_interface.compression import encode_image
+
+from softlearning.environments.gym.locobot.locobot_interface import PybulletInterface
+from softlearning.environments.gym.locobot.utils import URDF
+
+
+IMAGE_HEIGHT = 480
+IMAGE_WIDTH = 640
+CAMERA_FOV = 42.5
+CAMERA_NEAR = 0.05
+CAMERA_FAR = 7.0
+
+WHEEL_RADIUS = 0.035
+WHEEL_SEPARATION = 0.23
+SIM_TIME_STEP = 1. / 240.
+ARM_MOTION_STEPS = 120
+GRIPPER_MOTION_STEPS = 60
+BASE_SETTLE_STEPS = 60
+
+# the order the real /joint_states lists the joints in, the client ignores messages without all 9
+JOINT_STATE_NAMES = ['head_pan_joint', 'head_tilt_joint', 'joint_1', 'joint_2', 'joint_3', 'joint_4', 'joint_5',
+                     'joint_6', 'joint_7']
+# the gripper states published on /gripper/state
+GRIPPER_OPEN = 0
+GRIPPER_CLOSED = 3
+
+# links checked for grasp obstruction, from the elbow to the fingers
+OBSTRUCTION_LINKS = list(range(14, 20))
+
+
+class MockLocobotServer:
+    """ Mock of LocobotServer on top of PybulletInterface.
+    All access to the simulation holds sim_lock, motions release it between
+    steps so that the streams and the other services keep running.
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, service_latency=None, stream_rate=30, state_rate=50,
+                 realtime=False, num_objects=0, seed=None):
+        """
+        :param latency: delay of every service call in seconds
+        :param latency_jitter: uniformly distributed extra delay of every service call in seconds
+        :param service_latency: delays of individual services by name (e.g. 'base_vel_command'),
+                                    replaces latency for those
+        :param stream_rate: rate of the color and depth streams in Hz
+        :param state_rate: rate of the joint, gripper and odometry topics in Hz
+        :param realtime: steps the simulation in real time, so that motions take as long as on the robot
+        :param num_objects: number of objects spawned around the robot
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.service_latency = service_latency or {}
+        self.realtime = realtime
+        self.random = random.Random(seed)
+
+        self.sim_lock = threading.RLock()
+        self.sim = PybulletInterface(renders=False, load_plane=True)
+        self.sim.reset_robot(steps=0)
+        self.sim.open_gripper(steps=0)
+        self.sim.do_steps(BASE_SETTLE_STEPS)
+        self.object_ids = [self.spawn_random_object() for _ in range(num_objects)]
+
+        self.projection_matrix = self.sim.p.computeProjectionMatrixFOV(
+            CAMERA_FOV, IMAGE_WIDTH / IMAGE_HEIGHT, CAMERA_NEAR, CAMERA_FAR)
+        self.pan_tilt = np.zeros(2)
+        self.gripper_state = GRIPPER_OPEN
+
+        self.add_service('arm_joint_command', ArmJointCommand, self.arm_joint_cmd_callback)
+        self.add_service('arm_ee_command', ArmEECommand, self.arm_ee_cmd_callback)
+        self.add_service('gripper_command', GripperCommand, self.gripper_cmd_callback)
+
+        self.add_service('base_pos_command', BasePositionCommand, self.base_pos_cmd_callback)
+        self.add_service('base_vel_command', BaseVelocityCommand, self.base_vel_cmd_callback)
+
+        self.add_service('get_pointcloud', GetPointcloud, self.pointcloud_callback)
+        self.add_service('get_fk', GetFK, self.get_fk_callback)
+        self.add_service('get_ik', GetIK, self.get_ik_callback)
+        self.add_service('pan_tilt', SetPanTilt, self.pan_tilt_callback)
+
+        self.add_service('color', GetImage, self.color_callback)
+        self.add_service('depth', GetImage, self.depth_callback)
+
+        self.add_service('get_grasp_obstructed', GetGraspObstructed, self.grasp_obstructed_callback)
+
+        self.add_service('get_fk_batch', GetFKBatch, self.get_fk_batch_callback)
+        self.add_service('get_ik_batch', GetIKBatch, self.get_ik_batch_callback)
+        self.add_service('get_grasps_obstructed', GetGraspsObstructed, self.grasps_obstructed_callback)
+
+        self.color_pub = rospy.Publisher('python3_server/color_stream', Image, queue_size=1)
+        self.depth_pub = rospy.Publisher('python3_server/depth_stream', Image, queue_size=1)
+        self.compressed_color_pub = rospy.Publisher('python3_server/color_stream/compressed', CompressedImage,
+                                                    queue_size=1)
+        self.compressed_depth_pub = rospy.Publisher('python3_server/depth_stream/compressed', CompressedImage,
+                                                    queue_size=1)
+        self.stream_timer = rospy.Timer(rospy.Duration(1.0 / stream_rate), self.stream_callback)
+
+        self.joints_pub = rospy.Publisher('/joint_states', JointState, queue_size=1)
+        self.gripper_pub = rospy.Publisher('/gripper/state', Int8, queue_size=1)
+        self.odom_pub = rospy.Publisher('/odom', Odometry, queue_size=1)
+        self.state_timer = rospy.Timer(rospy.Duration(1.0 / state_rate), self.state_callback)
+
+    def add_service(self, name, service_class, callback):
+        """ Serves callback as python3_server/name, delayed by the injected latency """
+        latency = self.service_latency.get(name, self.latency)
+
+        def delayed_callback(req):
+            delay = latency + self.random.uniform(0.0, self.latency_jitter)
+            if delay > 0:
+                time.sleep(delay)
+            return callback(req)
+
+        setattr(self, name + '_srv', rospy.Service('python3_server/' + name, service_class, delayed_callback))
+
+    def spawn_random_object(self):
+        name = self.random.choice(['greensquareball', 'bluesquareball', 'yellowsquareball', 'solid_box'])
+        radius = self.random.uniform(0.4, 2.0)
+        angle = self.random.uniform(-np.pi, np.pi)
+        with self.sim_lock:
+            return self.sim.spawn_object(URDF[name], pos=[radius * np.cos(angle), radius * np.sin(angle), 0.05])
+
+    def do_steps(self, num_steps):
+        """ Steps the simulation, releasing sim_lock between the steps """
+        for _ in range(num_steps):
+            start_time = time.time()
+            with self.sim_lock:
+                self.sim.step()
+            if self.realtime:
+                time.sleep(max(SIM_TIME_STEP - (time.time() - start_time), 0.0))
+
+    # ----- STATE -----
+
+    def get_joint_positions(self):
+        joints = self.sim.ARM_JOINTS + [self.sim.WRIST_JOINT, self.sim.RIGHT_GRIPPER, self.sim.LEFT_GRIPPER]
+        with self.sim_lock:
+            states = self.sim.p.getJointStates(self.sim.robot, joints)
+        return [state[0] for state in states]
+
+    def get_base_pose(self):
+        """ :returns: (position, orientation quaternion) of the base in the world """
+        with self.sim_lock:
+            return self.sim.p.getBasePositionAndOrientation(self.sim.robot)
+
+    def state_callback(self, event):
+        try:
+            stamp = rospy.Time.now()
+
+            joints_msg = JointState()
+            joints_msg.header.stamp = stamp
+            joints_msg.name = JOINT_STATE_NAMES
+            joints_msg.position = list(self.pan_tilt) + self.get_joint_positions()
+            self.joints_pub.publish(joints_msg)
+
+            self.gripper_pub.publish(Int8(self.gripper_state))
+
+            position, orientation = self.get_base_pose()
+            odom_msg = Odometry()
+            odom_msg.header.stamp = stamp
+            odom_msg.header.frame_id = 'odom'
+            odom_msg.child_frame_id = 'base_link'
+            pose = odom_msg.pose.pose
+            pose.position.x, pose.position.y, pose.position.z = position
+            pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w = orientation
+            self.odom_pub.publish(odom_msg)
+        except Exception as e:
+            traceback.print_exc()
+
+    # ----- CAMERA -----
+
+    def get_view_matrix(self):
+        with self.sim_lock:
+            camera_pos, _, _, _, _, _ = self.sim.p.getLinkState(self.sim.robot, self.sim.CAMERA_LINK)
+            base_pos, base_ori = self.sim.p.getBasePositionAndOrientation(self.sim.robot)
+            look_pos, _ = self.sim.p.multiplyTransforms(
+                base_pos, base_ori, self.sim.params["camera_look_pos"], self.sim.default_ori)
+            return self.sim.p.computeViewMatrix(camera_pos, look_pos, [0, 0, 1])
+
+    def render(self):
+        """ :returns: (480x640x3 uint8 color image, 480x640 z-buffer, view matrix) """
+        view_matrix = self.get_view_matrix()
+        with self.sim_lock:
+            _, _, rgba, zbuffer, _ = self.sim.p.getCameraImage(
+                IMAGE_WIDTH, IMAGE_HEIGHT, view_matrix, self.projection_matrix)
+        rgba = np.reshape(rgba, (IMAGE_HEIGHT, IMAGE_WIDTH, 4)).astype(np.uint8)
+        zbuffer = np.reshape(zbuffer, (IMAGE_HEIGHT, IMAGE_WIDTH))
+        return rgba[:, :, :3], zbuffer, view_matrix
+
+    @staticmethod
+    def zbuffer_to_depth(zbuffer):
+        return CAMERA_FAR * CAMERA_NEAR / (CAMERA_FAR - (CAMERA_FAR - CAMERA_NEAR) * zbuffer)
+
+    def get_color_image(self):
+        image, _, _ = self.render()
+        return image
+
+    def get_depth_image(self):
+        _, zbuffer, _ = self.render()
+        return (self.zbuffer_to_depth(zbuffer) * 1000).astype(np.uint16)
+
+    @staticmethod
+    def to_image_msg(image, encoding):
+        image_msg = Image()
+        image_msg.header.stamp = rospy.Time.now()
+        image_msg.height, image_msg.width = image.shape[:2]
+        image_msg.encoding = encoding
+        image_msg.step = image.strides[0]
+        image_msg.data = image.tobytes()
+        return image_msg
+
+    @staticmethod
+    def to_compressed_msg(image, compression):
+        image_msg = CompressedImage()
+        image_msg.header.stamp = rospy.Time.now()
+        image_msg.format, image_msg.data = encode_image(image, compression)
+        return image_msg
+
+    def get_image_response(self, image, encoding, compression):
+        if compression:
+            return GetImageResponse(compressed_image=self.to_compressed_msg(image, compression))
+        return GetImageResponse(image=self.to_image_msg(image, encoding))
+
+    def get_pointcloud(self, in_cam):
+        """ Deprojects the depth image
+
+        :param in_cam: in the camera optical frame (x right, y down, z forward) if True, else in the base frame
+
+        :returns: Nx3 float32 points
+        """
+        _, zbuffer, view_matrix = self.render()
+        view = np.reshape(view_matrix, (4, 4)).T
+        projection = np.reshape(self.projection_matrix, (4, 4)).T
+
+        v, u = np.nonzero(zbuffer < 1.0)
+        ndc = np.stack([
+            2.0 * (u + 0.5) / IMAGE_WIDTH - 1.0,
+            1.0 - 2.0 * (v + 0.5) / IMAGE_HEIGHT,
+            2.0 * zbuffer[v, u] - 1.0,
+            np.ones(u.shape[0]),
+        ])
+        pts = np.linalg.inv(projection).dot(ndc)
+        pts = pts / pts[3]
+
+        if in_cam:
+            return np.stack([pts[0], -pts[1], -pts[2]], axis=1).astype(np.float32)
+
+        position, orientation = self.get_base_pose()
+        world_from_camera = np.linalg.inv(view)
+        base_rotation = np.reshape(self.sim.p.getMatrixFromQuaternion(orientation), (3, 3))
+        pts = world_from_camera[:3].dot(pts)
+        pts = base_rotation.T.dot(pts - np.reshape(position, (3, 1)))
+        return pts.T.astype(np.float32)
+
+    def color_callback(self, req):
+        try:
+            return self.get_image_response(self.get_color_image(), 'rgb8', req.compression)
+        except Exception as e:
+            traceback.print_exc()
+            return None
+
+    def depth_callback(self, req):
+        try:
+            return self.get_image_response(self.get_depth_image(), '16UC1', req.compression)
+        except Exception as e:
+            traceback.print_exc()
+            return None
+
+    def stream_callback(self, event):
+        try:
+            if self.color_pub.get_num_connections() > 0 or self.compressed_color_pub.get_num_connections() > 0:
+                image = self.get_color_image()
+                if self.color_pub.get_num_connections() > 0:
+                    self.color_pub.publish(self.to_image_msg(image, 'rgb8'))
+                if self.compressed_color_pub.get_num_connections() > 0:
+                    self.compressed_color_pub.publish(self.to_compressed_msg(image, 'jpeg'))
+            if self.depth_pub.get_num_connections() > 0 or self.compressed_depth_pub.get_num_connections() > 0:
+                depth = self.get_depth_image()
+                if self.depth_pub.get_num_connections() > 0:
+                    self.depth_pub.publish(self.to_image_msg(depth, '16UC1'))
+                if self.compressed_depth_pub.get_num_connections() > 0:
+                    self.compressed_depth_pub.publish(self.to_compressed_msg(depth, 'png'))
+        except Exception as e:
+            traceback.print_exc()
+
+    def pointcloud_callback(self, req):
+        try:
+            pts = self.get_pointcloud(req.in_cam)
+            if not req.in_cam and req.filter_pts:
+                pts = pts[pts[:, 2] > .04]
+            return encode_array(pts)
+        except Exception as e:
+            traceback.print_exc()
+            return encode_array(np.zeros((0, 3), dtype=np.float32))
+
+    def pan_tilt_callback(self, req):
+        # the simulated camera is fixed, only the reported joint angles change
+        self.pan_tilt = np.array([req.pan, req.tilt])
+        return True
+
+    # ----- ARM -----
+
+    def compute_ik(self, position, pitch, roll):
+        """ IK for the wrist at position in the base frame
+
+        :returns: the 5 arm joint positions
+        """
+        yaw = np.arctan2(position[1], position[0])
+        with self.sim_lock:
+            base_pos, base_ori = self.sim.p.getBasePositionAndOrientation(self.sim.robot)
+            orientation = self.sim.p.getQuaternionFromEuler([roll, pitch, yaw])
+            position, orientation = self.sim.p.multiplyTransforms(base_pos, base_ori, position, orientation)
+            joint_positions = self.sim.p.calculateInverseKinematics(
+                self.sim.robot, self.sim.WRIST_JOINT, position, orientation, maxNumIterations=256)
+        return list(joint_positions[2:7])
+
+    def set_joint_positions(self, joint_positions, steps=ARM_MOTION_STEPS):
+        with self.sim_lock:
+            self.sim.move_arm(joint_positions[:4], wrist_rot=joint_positions[4], steps=0)
+        self.do_steps(steps)
+        return True
+
+    def is_joint_positions_obstructed(self, joint_positions):
+        """ Checks the arm at joint_positions for contact with the spawned objects, the arm is moved back after """
+        joints = self.sim.ARM_JOINTS + [self.sim.WRIST_JOINT]
+        with self.sim_lock:
+            current_positions = [state[0] for state in self.sim.p.getJointStates(self.sim.robot, joints)]
+            for joint, position in zip(joints, joint_positions):
+                self.sim.p.resetJointState(self.sim.robot, joint, position)
+            self.sim.p.performCollisionDetection()
+            obstructed = any(
+                self.sim.p.getClosestPoints(self.sim.robot, object_id, 0.0, linkIndexA=link)
+                for object_id in self.object_ids
+                for link in OBSTRUCTION_LINKS)
+            for joint, position in zip(joints, current_positions):
+                self.sim.p.resetJointState(self.sim.robot, joint, position)
+        return obstructed
+
+    def arm_joint_cmd_callback(self, req):
+        try:
+            positions = [req.joint_1, req.joint_2, req.joint_3, req.joint_4, req.joint_5]
+            if req.check_obstruction and self.is_joint_positions_obstructed(positions):
+                rospy.logerr("desired joint positions obstructed")
+                return False
+            return self.set_joint_positions(positions)
+        except Exception as e:
+            traceback.print_exc()
+            return False
+
+    def arm_ee_cmd_callback(self, req):
+        try:
+            roll = req.roll
+            if np.isnan(roll):
+                roll = -self.get_joint_positions()[4]
+            joint_positions = self.compute_ik([req.x, req.y, req.z], req.pitch, roll)
+            if req.check_obstruction and self.is_joint_positions_obstructed(joint_positions):
+                rospy.logerr("desired end effector positions obstructed")
+                return False
+            return self.set_joint_positions(joint_positions)
+        except Exception as e:
+            traceback.print_exc()
+            return False
+
+    def gripper_cmd_callback(self, req):
+        try:
+            if req.command == 'open':
+                close = False
+            elif req.command == 'close':
+                close = True
+            elif req.command == 'force_close_if_open':
+                close = self.gripper_state == GRIPPER_OPEN
+                if not close:
+                    return True
+            else:
+                raise ValueError('Unknown gripper command')
+            with self.sim_lock:
+                if close:
+                    self.sim.close_gripper(steps=0)
+                else:
+                    self.sim.open_gripper(steps=0)
+            self.do_steps(GRIPPER_MOTION_STEPS)
+            self.gripper_state = GRIPPER_CLOSED if close else GRIPPER_OPEN
+            return True
+        except Exception as e:
+            traceback.print_exc()
+            return False
+
+    def compute_fk(self, joint_positions):
+        """ :returns: the gripper position and the row-major 3x3 rotation matrix in the base frame """
+        joints = self.sim.ARM_JOINTS + [self.sim.WRIST_JOINT]
+        with self.sim_lock:
+            current_positions = [state[0] for state in self.sim.p.getJointStates(self.sim.robot, joints)]
+            for joint, value in zip(joints, joint_positions):
+                self.sim.p.resetJointState(self.sim.robot, joint, value)
+            position, orientation = self.sim.get_ee_local()
+            for joint, value in zip(joints, current_positions):
+                self.sim.p.resetJointState(self.sim.robot, joint, value)
+            rotation = self.sim.p.getMatrixFromQuaternion(orientation)
+        return list(position), list(rotation)
+
+    def get_fk_callback(self, req):
+        position, rotation = self.compute_fk(req.joint_positions)
+        return [position + rotation]
+
+    def get_ik_callback(self, req):
+        return [self.compute_ik(req.position, req.pitch, req.roll)]
+
+    def get_fk_batch_callback(self, req):
+        poses = [self.compute_fk(joint_positions) for joint_positions in np.reshape(req.joint_positions, (-1, 5))]
+        return GetFKBatchResponse(
+            [value for position, _ in poses for value in position],
+            [value for _, rotation in poses for value in rotation])
+
+    def get_ik_batch_callback(self, req):
+        joint_positions = [
+            self.compute_ik(position, pitch, roll)
+            for position, pitch, roll in zip(np.reshape(req.positions, (-1, 3)), req.pitches, req.rolls)
+        ]
+        return GetIKBatchResponse(np.ravel(joint_positions).tolist(), [True] * len(joint_positions))
+
+    def grasp_obstructed_callback(self, req):
+        try:
+            joint_positions = self.compute_ik([req.x, req.y, 0.20], np.pi / 2.0, 0.0)
+            return self.is_joint_positions_obstructed(joint_positions)
+        except Exception as e:
+            traceback.print_exc()
+            return True
+
+    def grasps_obstructed_callback(self, req):
+        try:
+            return [[
+                self.is_joint_positions_obstructed(self.compute_ik([x, y, 0.20], np.pi / 2.0, 0.0))
+                for x, y in zip(req.x, req.y)
+            ]]
+        except Exception as e:
+            traceback.print_exc()
+            return [[True] * len(req.x)]
+
+    # ----- BASE -----
+
+    def base_vel_cmd_callback(self, req):
+        try:
+            left = (req.fwd_speed - req.turn_speed * WHEEL_SEPARATION / 2.0) / WHEEL_RADIUS
+            right = (req.fwd_speed + req.turn_speed * WHEEL_SEPARATION / 2.0) / WHEEL_RADIUS
+            with self.sim_lock:
+                self.sim.set_wheels_velocity(left, right)
+            self.do_steps(int(round(req.exe_time / SIM_TIME_STEP)))
+            with self.sim_lock:
+                self.sim.set_wheels_velocity(0, 0)
+            self.do_steps(BASE_SETTLE_STEPS)
+            return True
+        except Exception as e:
+            traceback.print_exc()
+            return False
+
+    def base_pos_cmd_callback(self, req):
+        """ Teleports the base to the goal and lets the simulation settle """
+        try:
+            with self.sim_lock:
+                x, y, yaw = self.sim.get_base_pos_and_yaw()
+                if req.relative:
+                    goal = [x + req.x * np.cos(yaw) - req.y * np.sin(yaw),
+                            y + req.x * np.sin(yaw) + req.y * np.cos(yaw)]
+                    goal_yaw = yaw + req.t
+                else:
+                    goal, goal_yaw = [req.x, req.y], req.t
+                self.sim.set_base_pos_and_yaw(goal, goal_yaw)
+            self.do_steps(BASE_SETTLE_STEPS)
+            return True
+        except Exception as e:
+            traceback.print_exc()
+            return False
+
+
+def parse_service_latency(value):
+    name, latency = value.split('=')
+    return name, float(latency)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--service-latency', type=parse_service_latency, action='append', default=[],
+                        help="per-service latency as name=seconds, e.g. base_vel_command=0.5")
+    parser.add_argument('--stream-rate', type=float, default=30)
+    parser.add_argument('--realtime', type=lambda value: value.lower() == 'true', default=False)
+    parser.add_argument('--num-objects', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(rospy.myargv()[1:])
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rospy.init_node('python3_server')
+    s = MockLocobotServer(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        service_latency=dict(args.service_latency),
+        stream_rate=args.stream_rate,
+        realtime=args.realtime,
+        num_objects=args.num_objects,
+        seed=args.seed)
+    print('Ready for service')
+    rospy.spin()
@@ -3,9 +3,9 @@ import time
 
 import tf2_ros
 from locobot_interface.srv import GetObstaclePosition
+from locobot_interface.occupancy_grid import ObstacleGrid
 from sensor_msgs.msg import PointCloud2
 from sensor_msgs import point_cloud2
-from tf2_sensor_msgs.tf2_sensor_msgs import do_transform_cloud
 import numpy as np
 import rospy
 
@@ -14,36 +14,94 @@ Cylinder = namedtuple("Cylinder", "pt1 pt2 r")
 Sphere = namedtuple("Sphere", "center r")
 ClosestObstacle = namedtuple("ClosestObstacle", "distance angle")
 
+BASE_RADIUS = 0.18
+BASE_HEIGHT = 0.25
+MIN_OBSTACLE_Z = 0.05
+MAX_GRID_AGE = 0.5  # seconds, obstacle queries aren't answered from older clouds
+GRID_TIMEOUT = 2.0  # seconds to wait for a recent enough cloud
+TF_EXCEPTIONS = (tf2_ros.LookupException, tf2_ros.ConnectivityException, tf2_ros.ExtrapolationException)
+
+
+def pointcloud2_to_xyz(message):
+    """ Reads the x, y, z fields of a PointCloud2 into an Nx3 array without a per point loop """
+    offsets = dict((field.name, field.offset) for field in message.fields)
+    dtype = np.dtype({
+        'names': ['x', 'y', 'z'],
+        'formats': ['<f4', '<f4', '<f4'],
+        'offsets': [offsets['x'], offsets['y'], offsets['z']],
+        'itemsize': message.point_step,
+    })
+    points = np.frombuffer(message.data, dtype=dtype, count=message.width * message.height)
+    points = np.stack([points['x'], points['y'], points['z']], axis=1).astype(np.float64)
+    return points[np.all(np.isfinite(points), axis=1)]
+
+
+def transform_points(transform, points):
+    """ Applies a geometry_msgs/Transform to an Nx3 array """
+    x, y, z, w = transform.rotation.x, transform.rotation.y, transform.rotation.z, transform.rotation.w
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    translation = np.array([transform.translation.x, transform.translation.y, transform.translation.z])
+    return points.dot(rotation.T) + translation
+
+
+class TransformCache:
+    """ Looks up transforms from a tf2 buffer, keeping the ones that only go through static frames """
+    def __init__(self, tfBuffer):
+        self.tfBuffer = tfBuffer
+        self._static_transforms = {}
+        self._dynamic_frame_pairs = set()
+
+    def lookup(self, target_frame, source_frame, time):
+        frame_pair = (target_frame, source_frame)
+        if frame_pair in self._static_transforms:
+            return self._static_transforms[frame_pair]
+        if frame_pair not in self._dynamic_frame_pairs:
+            # tf2 stamps the latest transform of a chain of /tf_static frames with time zero
+            latest = self.tfBuffer.lookup_transform(target_frame, source_frame, rospy.Time(0))
+            if latest.header.stamp.is_zero():
+                self._static_transforms[frame_pair] = latest.transform
+                return latest.transform
+            self._dynamic_frame_pairs.add(frame_pair)
+        return self.tfBuffer.lookup_transform(target_frame, source_frame, time).transform
+
 
 class PointCloudMask:
-    def __init__(self, tfBuffer, tfListener, rate):
-        self.tfBuffer = tfBuffer
-        self.tfListener = tfListener
-        self.rate = rate
+    SPHERE_FRAME = 'forearm_link'
+    SPHERE_RADIUS = 0.1
+    CYLINDER_FRAME_PAIRS = (('elbow_link', 'forearm_link'), ('forearm_link', 'wrist_link'),
+                            ('wrist_link', 'gripper_link'), ('gripper_link', 'finger_r'),
+                            ('gripper_link', 'finger_l'))
+    CYLINDER_RADII = (0.1, 0.05, 0.05, 0.12, 0.12)
+
+    def __init__(self, transform_cache):
+        self.transform_cache = transform_cache
+        self.arm_frames = sorted(set(
+            frame for frame_pair in self.CYLINDER_FRAME_PAIRS for frame in frame_pair) | {self.SPHERE_FRAME})
 
     def get_obstacle_points(self, points_to_check, pcl_time):
-        cylinders = self._create_cylinders(pcl_time)
-        sphere = self._create_sphere(pcl_time)
-        discarded_indices = []
-        for cylinder in cylinders:
-            discarded_indices.append(self._points_in_cylinder(cylinder, points_to_check))
-        discarded_indices.append(self._points_in_sphere(sphere, points_to_check))
-        points_below = np.where(points_to_check[:, 2] < 0.05)
-        discarded_indices.append(points_below)
-        unique_discarded_indices = np.unique(np.concatenate(discarded_indices, axis=1))
-        # revert mask
-        mask = np.ones(points_to_check.shape[0], dtype=bool)
-        mask[unique_discarded_indices] = False
-        obstacle_points = points_to_check[mask, :]
-        return obstacle_points
-
-    def _create_sphere(self, time):
-        sphere_frame = 'forearm_link'
-        this_transform = self.tfBuffer.lookup_transform('base_link', sphere_frame, time).transform
-        sphere_center = np.array(
-            [this_transform.translation.x, this_transform.translation.y, this_transform.translation.z])
-        radius = 0.1
-        return Sphere(sphere_center, radius)
+        """ Drops the points on the arm. The base and the ground are left to the ObstacleGrid.
+        Raises the TF_EXCEPTIONS if tf can't place the arm at pcl_time. """
+        frame_positions = self._get_frame_positions(pcl_time)
+        cylinders = self._create_cylinders(frame_positions)
+        sphere = self._create_sphere(frame_positions)
+        on_arm = self._points_in_cylinders(cylinders, points_to_check)
+        on_arm |= self._points_in_sphere(sphere, points_to_check)
+        return points_to_check[~on_arm, :]
+
+    def _get_frame_positions(self, time):
+        """ Looks up every arm frame once per cloud """
+        frame_positions = dict()
+        for frame in self.arm_frames:
+            translation = self.transform_cache.lookup('base_link', frame, time).translation
+            frame_positions[frame] = np.array([translation.x, translation.y, translation.z])
+        return frame_positions
+
+    def _create_sphere(self, frame_positions):
+        return Sphere(frame_positions[self.SPHERE_FRAME], self.SPHERE_RADIUS)
 
     def  _points_in_sphere(self, sphere, points_to_check):
         # Calculate the difference between the reference and measuring point
@@ -53,40 +111,28 @@ class PointCloudMask:
         dist = np.sum(np.power(diff, 2), axis=1)
 
         # If dist is less than radius^2, return True, else return False
-        return np.where(dist < sphere.r ** 2)
+        return dist < sphere.r ** 2
 
-    def _create_cylinders(self, time):
-        frame_pairs = [['elbow_link', 'forearm_link'], ['forearm_link', 'wrist_link'], ['wrist_link', 'gripper_link'],
-                       ['gripper_link', 'finger_r'], ['gripper_link', 'finger_l']]
-        frame_positions = dict()
-        for frame_pair in frame_pairs:
-            for frame in frame_pair:
-                if frame not in frame_positions:
-                    try:
-                        this_transform = self.tfBuffer.lookup_transform('base_link', frame, time).transform
-                        this_point = np.array(
-                            [this_transform.translation.x, this_transform.translation.y, this_transform.translation.z])
-                        frame_positions[frame] = this_point
-                    except (tf2_ros.LookupException, tf2_ros.ConnectivityException, tf2_ros.ExtrapolationException):
-                        self.rate.sleep()
-        radii = [0.1, 0.05, 0.05, 0.12, 0.12]
+    def _create_cylinders(self, frame_positions):
         cylinders = []
-        for frame_pair, radius in zip(frame_pairs, radii):
+        for frame_pair, radius in zip(self.CYLINDER_FRAME_PAIRS, self.CYLINDER_RADII):
             first_frame_point = frame_positions[frame_pair[0]]
             second_frame_point = frame_positions[frame_pair[1]]
             cylinders.append(Cylinder(first_frame_point, second_frame_point, radius))
-        # add base cylinder
-        zero_point = np.zeros(3)
-        top_of_base = np.array([0., 0., 0.25])
-        base_radius = 0.18
-        cylinders.append(Cylinder(zero_point, top_of_base, base_radius))
+        # the base cylinder is static and precomputed in the ObstacleGrid
         return cylinders
 
-    def _points_in_cylinder(self, cylinder, points_to_check):
-        vec = cylinder.pt2 - cylinder.pt1
-        const = cylinder.r * np.linalg.norm(vec)
-        return np.where((np.dot(points_to_check - cylinder.pt1, vec) >= 0) & (np.dot(points_to_check - cylinder.pt2, vec) <= 0) \
-                        & (np.linalg.norm(np.cross(points_to_check - cylinder.pt1, vec), axis=1) <= const))
+    def _points_in_cylinders(self, cylinders, points_to_check):
+        """ Tests all points against all cylinders at once """
+        pt1 = np.array([cylinder.pt1 for cylinder in cylinders])[:, np.newaxis]
+        pt2 = np.array([cylinder.pt2 for cylinder in cylinders])[:, np.newaxis]
+        vec = pt2 - pt1
+        const = np.array([cylinder.r for cylinder in cylinders])[:, np.newaxis] * np.linalg.norm(vec, axis=2)
+        diff = points_to_check[np.newaxis] - pt1
+        projection = np.sum(diff * vec, axis=2)
+        in_cylinders = ((projection >= 0) & (projection <= np.sum(vec * vec, axis=2))
+                        & (np.linalg.norm(np.cross(diff, vec), axis=2) <= const))
+        return np.any(in_cylinders, axis=0)
 
 
 class SafeNavigation:
@@ -95,50 +141,48 @@ class SafeNavigation:
         self.obstacle_pointcloud_pub = rospy.Publisher('obstacle_pcl', PointCloud2, queue_size=10)
         self.tfBuffer = tf2_ros.Buffer()
         self.tfListener = tf2_ros.TransformListener(self.tfBuffer)
-        self.service = rospy.Service('safe_navigation/get_obstacle_position', GetObstaclePosition, self._service_request)
         self.rate = rospy.Rate(5)
-        self.position_requested = False
-        self.last_closest_obstacle = None
+        self.transform_cache = TransformCache(self.tfBuffer)
+        self.point_cloud_mask = PointCloudMask(self.transform_cache)
+        self.obstacle_grid = ObstacleGrid(
+            z_range=(MIN_OBSTACLE_Z, 2.0),
+            excluded_cylinders=((BASE_RADIUS, BASE_HEIGHT), ))
+        self.service = rospy.Service('safe_navigation/get_obstacle_position', GetObstaclePosition, self._service_request)
 
     def _pointcloud_callback(self, message):
-        if not self.position_requested:
+        # the grid is updated with every cloud, so that requests are answered from the latest one.
+        # A cloud whose frames tf can't place is skipped, the grid then ages until the next one.
+        try:
+            transform = self.transform_cache.lookup(
+                'base_link', 'camera_color_optical_frame', rospy.Time(0))
+            points = transform_points(transform, pointcloud2_to_xyz(message))
+            obstacle_points = self.point_cloud_mask.get_obstacle_points(points, message.header.stamp)
+        except TF_EXCEPTIONS:
             return
-        self.position_requested = False
-        self.last_closest_obstacle = self._calculate_distance(message)
-
-    def _filter_points_with_mask(self, transformed_pointcloud):
-        point_cloud_mask = PointCloudMask(self.tfBuffer, self.tfListener, self.rate)
-
-        points = np.array(list(point_cloud2.read_points(transformed_pointcloud)))[:, :3]
-        pcl_time = transformed_pointcloud.header.stamp
-        obstacle_points = point_cloud_mask.get_obstacle_points(points, pcl_time)
-        header = transformed_pointcloud.header
-        # create pcl from points
-        obstacle_pcl = point_cloud2.create_cloud_xyz32(header, obstacle_points)
-        # TODO: remove this published after testing is finished
-        self.obstacle_pointcloud_pub.publish(obstacle_pcl)
-        return obstacle_points
-
-    def _get_closest_obstacle_point_distance_angle(self, obstacle_points):
-        distances = np.sqrt(np.sum(np.power(obstacle_points[:, :2], 2), axis=1))
-        min_index = np.argmin(distances)
-        min_distance = distances[min_index]
-        angle = np.arctan2(obstacle_points[min_index][1], obstacle_points[min_index][0])
-        return min_distance, angle
-
-    def _calculate_distance(self, point_cloud_message):
-        transform = self.tfBuffer.lookup_transform('base_link', 'camera_color_optical_frame', rospy.Time(0))
-        transformed_pointcloud = do_transform_cloud(point_cloud_message, transform)
-        obstacle_points = self._filter_points_with_mask(transformed_pointcloud)
-        min_distance, angle = self._get_closest_obstacle_point_distance_angle(obstacle_points)
-        return ClosestObstacle(min_distance, angle)
+        self.obstacle_grid.update(obstacle_points, stamp=message.header.stamp)
+
+        if self.obstacle_pointcloud_pub.get_num_connections() > 0:
+            obstacle_points = self.obstacle_grid.filter_points(obstacle_points)
+            header = message.header
+            header.frame_id = 'base_link'
+            self.obstacle_pointcloud_pub.publish(point_cloud2.create_cloud_xyz32(header, obstacle_points))
+
+    def _grid_age(self):
+        if self.obstacle_grid.stamp is None:
+            return np.inf
+        return rospy.get_time() - self.obstacle_grid.stamp.to_sec()
 
     def _service_request(self, req):
-        self.last_closest_obstacle = None
-        self.position_requested = True
-        while self.last_closest_obstacle is None:
+        # a stalled camera or tf would otherwise keep reporting the obstacles of an old cloud
+        deadline = time.time() + GRID_TIMEOUT
+        while self._grid_age() > MAX_GRID_AGE:
+            if time.time() > deadline:
+                raise rospy.ServiceException(
+                    "no obstacle grid newer than {}s, the latest is {:.2f}s old".format(
+                        MAX_GRID_AGE, self._grid_age()))
             time.sleep(0.01)
-        return {'distance': self.last_closest_obstacle.distance, 'angle': self.last_closest_obstacle.angle}
+        distance, angle = self.obstacle_grid.closest_obstacle()
+        return {'distance': distance, 'angle': angle}
 
     def run(self):
         while not rospy.is_shutdown():
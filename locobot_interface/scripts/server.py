@@ -1,24 +1,57 @@
 #!/usr/bin/python
 
+import threading
 import traceback
 import rospy
+from collections import OrderedDict
 
 from pyrobot import Robot
 from locobot_interface.srv import *
+from locobot_interface.serialization import encode_array
+from locobot_interface.compression import encode_image
+from locobot_interface.spatial_index import PointCloudIndex
+from locobot_interface.occupancy_grid import ObstacleGrid
 from kobuki_msgs.msg import SensorState
 
-from sensor_msgs.msg import Image
+from sensor_msgs.msg import Image, CompressedImage
+from std_msgs.msg import Int8
 
 import time
 import numpy as np
 
 
+# (link name, radius) of the spheres checked for obstruction around the arm links
+OBSTRUCTION_LINK_SPHERES = (
+    ("elbow_link", 0.04),
+    ("forearm_link", 0.04),
+    ("wrist_link", 0.05),
+    ("gripper_link", 0.05),
+)
+OBSTRUCTION_MIN_Z = 0.08
+OBSTRUCTION_MIN_POINTS = 2
+
+# parts of the robot ignored when looking for obstacles around the base
+NAVIGATION_MIN_Z = 0.08
+BODY_RADIUS = 0.18
+WRIST_LINK_SPHERE = ((0.168, 0.0, 0.215), 0.13)
+GRIPPER_LINK_SPHERE = ((0.237, 0.0, 0.120), 0.13)
+
+# gripper states published on /gripper/state that end an open or close command
+GRIPPER_OPEN_STATES = (0, )
+GRIPPER_CLOSED_STATES = (2, 3)
+GRIPPER_TIMEOUT = 2.0
+
+# numerical IK starts from the current joint angles, so grasp solutions are
+# only reused from the same starting joint angles, rounded to GRASP_IK_SEED_DECIMALS
+GRASP_IK_SEED_DECIMALS = 2
+GRASP_IK_CACHE_SIZE = 1024
+
 class LocobotServer:
     """ Server for remote PyRobot usage.
     Wraps the PyRobot API for the LoCoBot base/arm/camera.
     """
 
-    def __init__(self):
+    def __init__(self, stream_rate=30, jpeg_quality=90):
         self.bot = Robot('locobot')
 
         self.bot.base.configs['BASE']['MAX_ABS_FWD_SPEED'] = 3.
@@ -43,9 +76,40 @@ class LocobotServer:
         self.color_srv = rospy.Service('python3_server/color', GetImage, self.color_callback)
         self.depth_srv = rospy.Service('python3_server/depth', GetImage, self.depth_callback)
 
+        # frames are served with the stamp of their capture by the camera driver, on the robot's clock
+        self.camera_msgs = {'color': None, 'depth': None}
+        self.streamed_stamps = {'color': None, 'depth': None}
+        self.color_sub = rospy.Subscriber(self.bot.camera.configs.CAMERA.ROSTOPIC_CAMERA_RGB_STREAM, Image,
+                                          self.camera_callback, callback_args='color', queue_size=1)
+        self.depth_sub = rospy.Subscriber(self.bot.camera.configs.CAMERA.ROSTOPIC_CAMERA_DEPTH_STREAM, Image,
+                                          self.camera_callback, callback_args='depth', queue_size=1)
+
+        # color and depth are also streamed continuously, clients keep the latest frame
+        self.color_pub = rospy.Publisher('python3_server/color_stream', Image, queue_size=1)
+        self.depth_pub = rospy.Publisher('python3_server/depth_stream', Image, queue_size=1)
+        # compressed streams for clients on another host, jpeg color and lossless png depth
+        self.compressed_color_pub = rospy.Publisher('python3_server/color_stream/compressed', CompressedImage,
+                                                    queue_size=1)
+        self.compressed_depth_pub = rospy.Publisher('python3_server/depth_stream/compressed', CompressedImage,
+                                                    queue_size=1)
+        self.jpeg_quality = jpeg_quality
+        self.stream_timer = rospy.Timer(rospy.Duration(1.0 / stream_rate), self.stream_callback)
+
         self.grasp_obstructed_srv = rospy.Service('python3_server/get_grasp_obstructed', GetGraspObstructed,
                                                   self.grasp_obstructed_callback)
 
+        # batched queries, N poses or grasps in one round-trip
+        self.fk_batch_srv = rospy.Service('python3_server/get_fk_batch', GetFKBatch, self.get_fk_batch_callback)
+        self.ik_batch_srv = rospy.Service('python3_server/get_ik_batch', GetIKBatch, self.get_ik_batch_callback)
+        self.grasps_obstructed_srv = rospy.Service('python3_server/get_grasps_obstructed', GetGraspsObstructed,
+                                                   self.grasps_obstructed_callback)
+
+        # gripper commands wait for the state reported by the driver rather than a fixed delay
+        self.gripper_state = None
+        self.gripper_state_seq = 0
+        self.gripper_state_cond = threading.Condition()
+        self.gripper_state_sub = rospy.Subscriber('/gripper/state', Int8, self.gripper_state_callback)
+
         # self.obstacle_srv = rospy.ServiceProxy('/safe_navigation/get_obstacle_position', GetObstaclePosition)
 
         # self.sensors_sub = rospy.Subscriber('mobile_base/sensors/core', SensorState, self.sensors_callback)
@@ -57,6 +121,19 @@ class LocobotServer:
         self.arm_link_names = ["arm_base_link", "shoulder_link", "elbow_link", "forearm_link", "wrist_link",
                                "gripper_link"]
 
+        # the current point cloud and the structures built from it, updated when a new depth frame arrives
+        self.pointcloud = None
+        self.pointcloud_frame = None
+        self.pointcloud_version = 0
+        self.obstruction_index = None
+        self.obstruction_index_version = -1
+        self.obstacle_grid = ObstacleGrid(
+            z_range=(NAVIGATION_MIN_Z, 2.0),
+            excluded_cylinders=((BODY_RADIUS, np.inf), ),
+            excluded_spheres=(WRIST_LINK_SPHERE, GRIPPER_LINK_SPHERE))
+        self.obstacle_grid_version = -1
+        self.grasp_ik_cache = OrderedDict()
+
     def print_joint_pos(self):
         print("print_joint_pos:")
         joint_positions = self.bot.arm.get_joint_angles()
@@ -64,27 +141,59 @@ class LocobotServer:
             pos, rot = self.bot.arm.compute_fk_position(joint_positions, name)
             print(name, pos.squeeze())
 
-    def is_joint_positions_obstructed_link(self, joint_positions, link_name, pts, radius):
-        link_pos, _ = self.bot.arm.compute_fk_position(joint_positions, link_name)
-        link_pos = link_pos.squeeze()
-
-        dists = np.sum(np.square(pts - link_pos), axis=1)
-
-        num_obstructed = np.sum(dists <= radius * radius)
-
-        return num_obstructed >= 2
+    def get_current_pointcloud(self):
+        """ Returns the point cloud of the current depth frame in the base frame, fetched once per frame. """
+        # pyrobot replaces the depth image object on every new frame
+        frame = getattr(self.bot.camera, "depth_img", None)
+        if self.pointcloud is None or frame is None or frame is not self.pointcloud_frame:
+            self.pointcloud, _ = self.bot.camera.get_current_pcd(in_cam=False)
+            self.pointcloud_frame = frame
+            self.pointcloud_version += 1
+        return self.pointcloud
+
+    def get_obstruction_index(self):
+        """ Returns the spatial index of the current point cloud.
+        The index is built once per depth frame and shared by all obstruction checks on it.
+        """
+        pts = self.get_current_pointcloud()
+        if self.obstruction_index_version != self.pointcloud_version:
+            self.obstruction_index = PointCloudIndex(pts, min_z=OBSTRUCTION_MIN_Z)
+            self.obstruction_index_version = self.pointcloud_version
+        return self.obstruction_index
+
+    def get_obstacle_grid(self):
+        """ Returns the obstacle grid, updated once per depth frame. """
+        pts = self.get_current_pointcloud()
+        if self.obstacle_grid_version != self.pointcloud_version:
+            self.obstacle_grid.update(pts, stamp=rospy.get_time())
+            self.obstacle_grid_version = self.pointcloud_version
+        return self.obstacle_grid
 
     def is_joint_positions_obstructed(self, positions):
-        pts, _ = self.bot.camera.get_current_pcd(in_cam=False)
-        z_mask = pts[:, 2] >= 0.08
-        pts = pts[z_mask]
-
-        return (
-                self.is_joint_positions_obstructed_link(positions, self.arm_link_names[2], pts, 0.04) or
-                self.is_joint_positions_obstructed_link(positions, self.arm_link_names[3], pts, 0.04) or
-                self.is_joint_positions_obstructed_link(positions, self.arm_link_names[4], pts, 0.05) or
-                self.is_joint_positions_obstructed_link(positions, self.arm_link_names[5], pts, 0.05)
-        )
+        return bool(self.are_joint_positions_obstructed([positions])[0])
+
+    def are_joint_positions_obstructed(self, positions_batch):
+        """ Checks N arm configurations against the current point cloud with a single index query.
+        Configurations that are None (no IK solution) count as obstructed.
+
+        :returns: N bools
+        """
+        valid = [positions is not None for positions in positions_batch]
+        obstructed = np.ones(len(positions_batch), dtype=bool)
+        if not any(valid):
+            return obstructed
+
+        index = self.get_obstruction_index()
+        link_positions = [
+            self.bot.arm.compute_fk_position(positions, link_name)[0].squeeze()
+            for positions in positions_batch if positions is not None
+            for link_name, _ in OBSTRUCTION_LINK_SPHERES
+        ]
+        radii = np.tile([radius for _, radius in OBSTRUCTION_LINK_SPHERES], sum(valid))
+
+        num_obstructed = index.count_within(link_positions, radii).reshape(-1, len(OBSTRUCTION_LINK_SPHERES))
+        obstructed[valid] = np.any(num_obstructed >= OBSTRUCTION_MIN_POINTS, axis=1)
+        return obstructed
 
     def arm_joint_cmd_callback(self, req):
         print("arm_joint_cmd_callback")
@@ -101,7 +210,7 @@ class LocobotServer:
             else:
                 return True
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def arm_ee_cmd_callback(self, req):
@@ -119,7 +228,7 @@ class LocobotServer:
             )
             yaw = np.arctan2(position[1] - base_offset[1], position[0] - base_offset[0])
 
-            if roll is None:
+            if np.isnan(roll):
                 # read the current roll angle
                 roll = -self.bot.arm.get_joint_angle("joint_5")
             euler = np.array([yaw, pitch, roll], dtype=np.float64)
@@ -141,29 +250,53 @@ class LocobotServer:
             else:
                 return True
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def gripper_cmd_callback(self, req):
         print("gripper_cmd_callback")
         try:
             bot_wait = False
+            with self.gripper_state_cond:
+                seq = self.gripper_state_seq
+                was_open = self.gripper_state in GRIPPER_OPEN_STATES
             if req.command == 'open':
                 self.bot.gripper.open(bot_wait)
+                target_states = GRIPPER_OPEN_STATES
             elif req.command == 'close':
                 self.bot.gripper.close(bot_wait)
+                target_states = GRIPPER_CLOSED_STATES
             elif req.command == 'force_close_if_open':
                 self.bot.gripper.force_close_if_open(bot_wait)
+                target_states = GRIPPER_CLOSED_STATES if was_open else None
             else:
                 raise ValueError('Unknown gripper command')
-            if req.wait:
-                time.sleep(1)
+            if req.wait and target_states is not None:
+                self.wait_for_gripper_state(target_states, seq)
             print("done")
             return True
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
+    def gripper_state_callback(self, msg):
+        with self.gripper_state_cond:
+            self.gripper_state = msg.data
+            self.gripper_state_seq += 1
+            self.gripper_state_cond.notify_all()
+
+    def wait_for_gripper_state(self, states, seq, timeout=GRIPPER_TIMEOUT):
+        """ Waits for one of the gripper states, reported after the seq-th state message.
+
+        :returns: False on timeout
+        """
+        with self.gripper_state_cond:
+            reached = self.gripper_state_cond.wait_for(
+                lambda: self.gripper_state_seq > seq and self.gripper_state in states, timeout=timeout)
+        if not reached:
+            rospy.logwarn("Gripper did not reach states {} within {}s".format(states, timeout))
+        return reached
+
     def base_pos_cmd_callback(self, req):
         try:
             position = [req.x, req.y, req.t]
@@ -171,7 +304,7 @@ class LocobotServer:
             success = method(position, close_loop=req.close_loop, smooth=req.smooth)
             return success
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def get_smallest_encoder_difference(self, previous_sensors_reading):
@@ -234,92 +367,163 @@ class LocobotServer:
             print("done")
             return True
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
+    def camera_callback(self, msg, key):
+        self.camera_msgs[key] = msg
+
+    def get_camera_msg(self, key):
+        msg = self.camera_msgs[key]
+        if msg is None:
+            raise RuntimeError("no {} frame received from the camera yet".format(key))
+        return msg
+
+    def get_color_frame(self):
+        """ :returns: (rgb image, capture stamp) of the newest camera frame """
+        msg = self.get_camera_msg('color')
+        return self.bot.camera.cv_bridge.imgmsg_to_cv2(msg, "rgb8"), msg.header.stamp
+
+    def get_depth_frame(self):
+        """ :returns: (depth image in millimeters, capture stamp) of the newest camera frame """
+        msg = self.get_camera_msg('depth')
+        image = self.bot.camera.cv_bridge.imgmsg_to_cv2(msg, "passthrough")
+        return image.astype(np.uint16), msg.header.stamp
+
+    def get_color_msg(self, image, stamp):
+        image_msg = self.bot.camera.cv_bridge.cv2_to_imgmsg(image)
+        image_msg.header.stamp = stamp
+        return image_msg
+
+    def get_depth_msg(self, image, stamp):
+        image_msg = self.bot.camera.cv_bridge.cv2_to_imgmsg(image, "16UC1")
+        image_msg.header.stamp = stamp
+        return image_msg
+
+    def get_compressed_msg(self, image, stamp, compression):
+        image_msg = CompressedImage()
+        image_msg.header.stamp = stamp
+        image_msg.format, image_msg.data = encode_image(image, compression, jpeg_quality=self.jpeg_quality)
+        return image_msg
+
     def color_callback(self, req):
         print("color_callback")
         try:
-            image = self.bot.camera.get_rgb()
-            image_msg = self.bot.camera.cv_bridge.cv2_to_imgmsg(image)
+            image, stamp = self.get_color_frame()
+            if req.compression:
+                response = GetImageResponse(
+                    compressed_image=self.get_compressed_msg(image, stamp, req.compression))
+            else:
+                response = GetImageResponse(image=self.get_color_msg(image, stamp))
             print("done")
-            return image_msg
+            return response
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return None
 
     def depth_callback(self, req):
-        print("color_callback")
+        print("depth_callback")
         try:
-            image = self.bot.camera.get_depth()*1000
-            image = image.astype(np.uint16)
-            image_msg = self.bot.camera.cv_bridge.cv2_to_imgmsg(image, "16UC1")
+            image, stamp = self.get_depth_frame()
+            if req.compression:
+                response = GetImageResponse(
+                    compressed_image=self.get_compressed_msg(image, stamp, req.compression))
+            else:
+                response = GetImageResponse(image=self.get_depth_msg(image, stamp))
             print("done")
-            return image_msg
+            return response
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return None
 
+    def stream_callback(self, event):
+        """ Publishes the camera frames that arrived since the last call """
+        try:
+            stream_color = self.color_pub.get_num_connections() > 0
+            stream_compressed_color = self.compressed_color_pub.get_num_connections() > 0
+            color_msg = self.camera_msgs['color']
+            if (stream_color or stream_compressed_color) and color_msg is not None \
+                    and color_msg.header.stamp != self.streamed_stamps['color']:
+                image, stamp = self.get_color_frame()
+                if stream_color:
+                    self.color_pub.publish(self.get_color_msg(image, stamp))
+                if stream_compressed_color:
+                    self.compressed_color_pub.publish(self.get_compressed_msg(image, stamp, 'jpeg'))
+                self.streamed_stamps['color'] = stamp
+
+            stream_depth = self.depth_pub.get_num_connections() > 0
+            stream_compressed_depth = self.compressed_depth_pub.get_num_connections() > 0
+            depth_msg = self.camera_msgs['depth']
+            if (stream_depth or stream_compressed_depth) and depth_msg is not None \
+                    and depth_msg.header.stamp != self.streamed_stamps['depth']:
+                depth, stamp = self.get_depth_frame()
+                if stream_depth:
+                    self.depth_pub.publish(self.get_depth_msg(depth, stamp))
+                if stream_compressed_depth:
+                    self.compressed_depth_pub.publish(self.get_compressed_msg(depth, stamp, 'png'))
+                self.streamed_stamps['depth'] = stamp
+        except Exception as e:
+            traceback.print_exc()
+
     def get_fk_callback(self, req):
         return self.bot.compute_fk_position(req.joint_positions, 'base_link')
 
-    def get_ik_callback(self, req):
-        position = np.array(req.position).flatten()
-        base_offset, _, _ = self.bot.arm.get_transform(
-            self.bot.arm.configs.ARM.ARM_BASE_FRAME, "arm_base_link"
-        )
-        yaw = np.arctan2(position[1] - base_offset[1], position[0] - base_offset[0])
-        euler = np.array([yaw, req.pitch, req.roll], dtype=np.float64)
-        joint_positions = self.bot.arm.compute_ik(position, euler, numerical=True)
-        return [joint_positions]
-
-    def get_turn_dir(self, more):
-        pts, _ = self.bot.camera.get_current_pcd(in_cam=False)
-
-        # remove ground
-        z_mask = (pts[:, 2] >= 0.08)
-        pts = pts[z_mask]
+    def compute_ik(self, position, pitch, roll, base_offset=None):
+        """ IK for the gripper at position, yawed towards it from the arm base
 
-        # remove robot body
-        r2 = pts[:, 0] ** 2 + pts[:, 1] ** 2
-        r_mask = (r2 >= 0.18 ** 2)
-        pts = pts[r_mask]
-        r2 = r2[r_mask]
+        :param base_offset: offset of the arm base, looked up if None
 
-        # remove grippper
-        wrist_link_pos = np.array([0.168, 0.0, 0.215])
-        gripper_link_pos = np.array([0.237, 0.0, 0.120])
-
-        wrist_mask = np.sum(np.square(pts - wrist_link_pos), axis=1) >= 0.13 ** 2
-        gripper_mask = np.sum(np.square(pts - gripper_link_pos), axis=1) >= 0.13 ** 2
-        wrist_gripper_mask = np.logical_and(wrist_mask, gripper_mask)
-
-        pts = pts[wrist_gripper_mask]
-        r2 = r2[wrist_gripper_mask]
+        :returns: the joint positions, None if there is no solution
+        """
+        position = np.array(position).flatten()
+        if base_offset is None:
+            base_offset, _, _ = self.bot.arm.get_transform(
+                self.bot.arm.configs.ARM.ARM_BASE_FRAME, "arm_base_link"
+            )
+        yaw = np.arctan2(position[1] - base_offset[1], position[0] - base_offset[0])
+        euler = np.array([yaw, pitch, roll], dtype=np.float64)
+        return self.bot.arm.compute_ik(position, euler, numerical=True)
 
-        # split into left and right
-        left_mask = pts[:, 1] >= 0.0
-        right_mask = pts[:, 1] < 0.0
+    def get_ik_callback(self, req):
+        joint_positions = self.compute_ik(req.position, req.pitch, req.roll)
+        return [joint_positions]
 
-        left_r2 = r2[left_mask]
-        right_r2 = r2[right_mask]
+    def get_fk_batch_callback(self, req):
+        try:
+            positions, rotations = [], []
+            for joint_positions in np.reshape(req.joint_positions, (-1, 5)):
+                position, rotation = self.bot.arm.compute_fk_position(joint_positions, 'gripper_link')
+                positions.append(np.ravel(position))
+                rotations.append(np.ravel(rotation))
+            return GetFKBatchResponse(np.ravel(positions).tolist(), np.ravel(rotations).tolist())
+        except Exception as e:
+            traceback.print_exc()
+            return GetFKBatchResponse([], [])
 
-        # compare min points
-        min_left_r2 = np.min(left_r2, initial=1000.0)
-        min_right_r2 = np.min(right_r2, initial=1000.0)
+    def get_ik_batch_callback(self, req):
+        try:
+            base_offset, _, _ = self.bot.arm.get_transform(
+                self.bot.arm.configs.ARM.ARM_BASE_FRAME, "arm_base_link"
+            )
+            positions = np.reshape(req.positions, (-1, 3))
+            joint_positions = np.full((positions.shape[0], 5), np.nan)
+            for i, (position, pitch, roll) in enumerate(zip(positions, req.pitches, req.rolls)):
+                solution = self.compute_ik(position, pitch, roll, base_offset=base_offset)
+                if solution is not None:
+                    joint_positions[i] = solution
+            success = ~np.any(np.isnan(joint_positions), axis=1)
+            return GetIKBatchResponse(joint_positions.ravel().tolist(), success.tolist())
+        except Exception as e:
+            traceback.print_exc()
+            return GetIKBatchResponse([], [])
 
+    def get_turn_dir(self, more):
         if more:
             thresh = 0.4
         else:
             thresh = 0.36
 
-        if min_left_r2 < min_right_r2:
-            if min_left_r2 <= thresh ** 2:
-                return "right"
-        else:
-            if min_right_r2 <= thresh ** 2:
-                return "left"
-        return None
+        return self.get_obstacle_grid().turn_dir(thresh)
 
     # def filter_pc_grasp(self, x, y, pts):
     #     if y >= 0:
@@ -340,6 +544,24 @@ class LocobotServer:
 
     #     return pts[np.logical_and(np.logical_and(x_mask, y_mask), z_mask)]
 
+    def get_grasp_joint_positions(self, x, y):
+        """ IK for a top-down grasp at x, y.
+        The grasp targets come from a fixed grid, so the solutions are cached per target and IK seed,
+        in a least recently used cache. Failed solves are not cached and are retried on the next request.
+        """
+        seed = np.round(self.bot.arm.get_joint_angles(), GRASP_IK_SEED_DECIMALS)
+        key = (round(x, 4), round(y, 4), tuple(seed.tolist()))
+        if key in self.grasp_ik_cache:
+            self.grasp_ik_cache.move_to_end(key)
+            return self.grasp_ik_cache[key]
+
+        joint_positions = self.compute_ik([x, y, 0.20], np.pi / 2.0, 0.0)
+        if joint_positions is not None:
+            self.grasp_ik_cache[key] = joint_positions
+            if len(self.grasp_ik_cache) > GRASP_IK_CACHE_SIZE:
+                self.grasp_ik_cache.popitem(last=False)
+        return joint_positions
+
     def grasp_obstructed_callback(self, req):
         print("grasp_obstructed_callback")
         # if self.old:
@@ -347,19 +569,7 @@ class LocobotServer:
 
         threshold = 10
         try:
-            position = [req.x, req.y, 0.20]
-            pitch = np.pi / 2.0
-            roll = 0.0
-
-            position = np.array(position).flatten()
-            base_offset, _, _ = self.bot.arm.get_transform(
-                self.bot.arm.configs.ARM.ARM_BASE_FRAME, "arm_base_link"
-            )
-            yaw = np.arctan2(position[1] - base_offset[1], position[0] - base_offset[0])
-
-            euler = np.array([yaw, pitch, roll], dtype=np.float64)
-
-            joint_positions = self.bot.arm.compute_ik(position, euler, numerical=True)
+            joint_positions = self.get_grasp_joint_positions(req.x, req.y)
 
             return self.is_joint_positions_obstructed(joint_positions)
 
@@ -368,9 +578,18 @@ class LocobotServer:
             # print("done")
             # return filtered_grasps.shape[0] >= threshold
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return True
 
+    def grasps_obstructed_callback(self, req):
+        print("grasps_obstructed_callback")
+        try:
+            joint_positions = [self.get_grasp_joint_positions(x, y) for x, y in zip(req.x, req.y)]
+            return [self.are_joint_positions_obstructed(joint_positions).tolist()]
+        except Exception as e:
+            traceback.print_exc()
+            return [[True] * len(req.x)]
+
     def pointcloud_callback(self, req):
         print("pointcloud_callback")
         try:
@@ -381,10 +600,10 @@ class LocobotServer:
                 if req.filter_pts:
                     mask = pts[:, 2] > .04
                     pts = pts[mask]
-            return [pts.reshape(-1).tolist()]
+            return encode_array(pts.astype(np.float32))
         except Exception as e:
-            traceback.print_exc(e)
-            return []
+            traceback.print_exc()
+            return encode_array(np.zeros((0, 3), dtype=np.float32))
 
     def pan_tilt_callback(self, req):
         print("pan_tilt_callback")
@@ -394,7 +613,7 @@ class LocobotServer:
             print("done")
             return True
         except Exception as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def sensors_callback(self, req):
@@ -1,13 +1,19 @@
 #!/usr/bin/python
 
+import threading
+import time
 import traceback
 import numpy as np
 import rospy
 from std_msgs.msg import Int8, Float64
-from sensor_msgs.msg import JointState, Image
+from sensor_msgs.msg import JointState, Image, CompressedImage
 from nav_msgs.msg import Odometry
 from kobuki_msgs.msg import BumperEvent, WheelDropEvent, PowerSystemEvent, Sound
 from locobot_interface.srv import *
+from locobot_interface.commands import CommandQueue
+from locobot_interface.compression import DecodeWorker, decode_image
+from locobot_interface.frame_buffer import FrameBuffer
+from locobot_interface.serialization import decode_array
 
 
 DEFAULT_PAN = 0.00153398083057
@@ -21,26 +27,52 @@ RESET_TILT = 0.0
 BB_SIZE = 5
 JOINT_NAMES = ['joint_1', 'joint_2', 'joint_3', 'joint_4', 'joint_5']
 GRIPPER_JOINT_NAME = 'joint_7'
+IMAGE_BUFF_SIZE = 2 ** 24
 
 class LocobotClient:
     """ Client interface for remote PyRobot server. 
     Wraps the PyRobot API for the LoCoBot base/arm/camera.
+
+    The arm, gripper, base and pan/tilt commands have *_async variants that
+    queue the command and return a CommandHandle right away. The commands of
+    each actuator run in order on their own thread, so that motion overlaps
+    with perception and inference. The blocking methods wait on the same
+    queues, so both can be mixed.
     """
-    def __init__(self, debug=False, pause_filepath=None):
+    def __init__(self, debug=False, pause_filepath=None, frame_buffer_size=4, max_frame_age=0.5,
+                 max_pending_commands=2, image_compression='', depth_compression='', compressed_streams=False,
+                 settle_timeout=1.0):
+        """
+        :param frame_buffer_size: number of streamed frames kept for color and depth
+        :param max_frame_age: streamed frames older than this (in seconds) are stale,
+                                get_image/get_depth then fall back to the services
+        :param settle_timeout: maximum time in seconds to wait for a streamed frame newer than a motion,
+                                or for the base to stop
+        :param max_pending_commands: maximum number of queued or running commands per actuator
+        :param image_compression: default compression of the color images fetched from the service,
+                                    '' (raw), 'jpeg' or 'png'
+        :param depth_compression: default compression of the depth images fetched from the service,
+                                    '' (raw) or 'png' (lossless)
+        :param compressed_streams: subscribe to the jpeg color and png depth streams instead of the raw ones,
+                                    the frames are decoded on worker threads
+        """
         rospy.init_node('locobot_interface')
 
         self.arm_joint_cmd_client = rospy.ServiceProxy('/python3_server/arm_joint_command', ArmJointCommand)
         self.arm_ee_cmd_client = rospy.ServiceProxy('/python3_server/arm_ee_command', ArmEECommand)
         self.gripper_cmd_client = rospy.ServiceProxy('/python3_server/gripper_command', GripperCommand)
 
+        self._joints = None
+        self._joints_cond = threading.Condition()
         self.joints_subscriber = rospy.Subscriber('/joint_states', JointState, self._joints_callback)
         self.gripper_subscriber = rospy.Subscriber('/gripper/state', Int8, self._gripper_callback)
 
         self.base_pos_cmd_client = rospy.ServiceProxy('/python3_server/base_pos_command', BasePositionCommand)
         self.base_vel_cmd_client = rospy.ServiceProxy('/python3_server/base_vel_command', BaseVelocityCommand)
 
-        self.odom_subscriber = rospy.Subscriber('/odom', Odometry, self._odom_callback)
         self._odom_state = None
+        self._odom_cond = threading.Condition()
+        self.odom_subscriber = rospy.Subscriber('/odom', Odometry, self._odom_callback)
 
         self.bumper_subscriber = rospy.Subscriber('/mobile_base/events/bumper', BumperEvent, self._bumper_callback)
         self.power_subscriber = rospy.Subscriber('/mobile_base/events/power_system', PowerSystemEvent, self._power_callback)
@@ -65,8 +97,39 @@ class LocobotClient:
 
         self.grasp_obstructed_client = rospy.ServiceProxy('/python3_server/get_grasp_obstructed', GetGraspObstructed)
 
-        # self.color_subscriber = rospy.Subscriber('/camera/color/image_raw', Image, self._image_callback, queue_size=1)
-        # self.depth_subscriber = rospy.Subscriber('/camera/depth/image_rect_raw', Image, self._depth_callback, queue_size=1)
+        self.fk_batch_client = rospy.ServiceProxy('/python3_server/get_fk_batch', GetFKBatch)
+        self.ik_batch_client = rospy.ServiceProxy('/python3_server/get_ik_batch', GetIKBatch)
+        self.grasps_obstructed_client = rospy.ServiceProxy('/python3_server/get_grasps_obstructed',
+                                                           GetGraspsObstructed)
+
+        self._max_frame_age = max_frame_age
+        self._settle_timeout = settle_timeout
+        self.color_buffer = FrameBuffer(frame_buffer_size)
+        self.depth_buffer = FrameBuffer(frame_buffer_size)
+        self._image_compression = image_compression
+        self._depth_compression = depth_compression
+        if compressed_streams:
+            self.color_decoder = DecodeWorker(self.color_buffer)
+            self.depth_decoder = DecodeWorker(self.depth_buffer)
+            self.color_subscriber = rospy.Subscriber(
+                '/python3_server/color_stream/compressed', CompressedImage, self._compressed_stream_callback,
+                callback_args=self.color_decoder, queue_size=1, buff_size=IMAGE_BUFF_SIZE)
+            self.depth_subscriber = rospy.Subscriber(
+                '/python3_server/depth_stream/compressed', CompressedImage, self._compressed_stream_callback,
+                callback_args=self.depth_decoder, queue_size=1, buff_size=IMAGE_BUFF_SIZE)
+        else:
+            self.color_subscriber = rospy.Subscriber('/python3_server/color_stream', Image,
+                                                     self._color_stream_callback,
+                                                     queue_size=1, buff_size=IMAGE_BUFF_SIZE)
+            self.depth_subscriber = rospy.Subscriber('/python3_server/depth_stream', Image,
+                                                     self._depth_stream_callback,
+                                                     queue_size=1, buff_size=IMAGE_BUFF_SIZE)
+
+        self.command_queues = {
+            name: CommandQueue(name, max_pending=max_pending_commands)
+            for name in ('arm', 'gripper', 'base', 'pan_tilt')
+        }
+        rospy.on_shutdown(self._shutdown_command_queues)
 
         rospy.sleep(1)
 
@@ -75,6 +138,10 @@ class LocobotClient:
             print(*args, **kwargs)
 
     def set_base_pos(self, x, y, t, relative=True, close_loop=False, smooth=False):
+        return self.set_base_pos_async(x, y, t, relative, close_loop, smooth).result()
+
+    def set_base_pos_async(self, x, y, t, relative=True, close_loop=False, smooth=False,
+                           block=True, timeout=None):
         """ Set position of the base relative to base frame or current position
 
         :param x,y: displacement/position along x-y axes
@@ -83,41 +150,66 @@ class LocobotClient:
                             else interpreted as absolute coordinates
         :param close_loop: uses odometry during execution
         :param smooth: tries to smooth motion to goal
+        :param block: wait for a free slot if the base queue is full
+        :param timeout: maximum time to wait for a free slot
 
-        :returns: True if successful; False otherwise
+        :returns: CommandHandle, its result is True if successful; False otherwise
         """
+        return self.command_queues['base'].submit(
+            self._set_base_pos, x, y, t, relative, close_loop, smooth, block=block, timeout=timeout)
+
+    def _set_base_pos(self, x, y, t, relative=True, close_loop=False, smooth=False):
         try:
             resp = self.base_pos_cmd_client(x, y, t, relative, close_loop, smooth)
             return resp.success
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def set_base_vel(self, fwd_speed, turn_speed, exe_time=1, more=False):
+        return self.set_base_vel_async(fwd_speed, turn_speed, exe_time, more).result()
+
+    def set_base_vel_async(self, fwd_speed, turn_speed, exe_time=1, more=False, block=True, timeout=None):
         """ Set velocity of the base
 
         :param left, right: desired velocity of the left/right wheel
+        :param block: wait for a free slot if the base queue is full
+        :param timeout: maximum time to wait for a free slot
 
-        :returns: True if successful; False otherwise
+        :returns: CommandHandle, its result is True if successful; False otherwise
         """
+        return self.command_queues['base'].submit(
+            self._set_base_vel, fwd_speed, turn_speed, exe_time, more, block=block, timeout=timeout)
+
+    def _set_base_vel(self, fwd_speed, turn_speed, exe_time=1, more=False):
         try:
             self.debug_print("set_base_vel")
             resp = self.base_vel_cmd_client(fwd_speed, turn_speed, exe_time, more)
             self.debug_print("done")
             return resp.success
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def set_joint_angles(self, joints, plan=False, wait=True, check_obstruction=False):
+        return self.set_joint_angles_async(joints, plan, wait, check_obstruction).result()
+
+    def set_joint_angles_async(self, joints, plan=False, wait=True, check_obstruction=False,
+                               block=True, timeout=None):
         """ Set desired joint angles
 
         :param joints: list of desired joint angles for the five arm joints
         :param plan: use MoveIt to plan to the desired joint angles
         :param wait: wait until execution is finished
+        :param block: wait for a free slot if the arm queue is full
+        :param timeout: maximum time to wait for a free slot
 
-        :returns: True if successful; False otherwise
+        :returns: CommandHandle, its result is True if successful; False otherwise
         """
+        return self.command_queues['arm'].submit(
+            self._set_joint_angles, joints, plan, wait, check_obstruction, block=block, timeout=timeout)
+
+    def _set_joint_angles(self, joints, plan=False, wait=True, check_obstruction=False):
         try:
             self.debug_print("set_joint_angles")
             joint_1, joint_2, joint_3, joint_4, joint_5 = joints
@@ -125,10 +217,14 @@ class LocobotClient:
             self.debug_print("done")
             return resp.result
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def set_end_effector_pose(self, xyz, pitch, roll=None, plan=False, wait=True, check_obstruction=False):
+        return self.set_end_effector_pose_async(xyz, pitch, roll, plan, wait, check_obstruction).result()
+
+    def set_end_effector_pose_async(self, xyz, pitch, roll=None, plan=False, wait=True, check_obstruction=False,
+                                    block=True, timeout=None):
         """ Set desired pose (position+orientation) of the arm end-effector
 
         :param xyz: xyz position
@@ -136,34 +232,50 @@ class LocobotClient:
         :param roll: roll angle
         :param plan: use MoveIt to plan to the desired pose
         :param: wait until execution is finished
+        :param block: wait for a free slot if the arm queue is full
+        :param timeout: maximum time to wait for a free slot
 
-        :returns: True if successful; False otherwise
+        :returns: CommandHandle, its result is True if successful; False otherwise
         """
+        return self.command_queues['arm'].submit(
+            self._set_end_effector_pose, xyz, pitch, roll, plan, wait, check_obstruction, block=block, timeout=timeout)
+
+    def _set_end_effector_pose(self, xyz, pitch, roll=None, plan=False, wait=True, check_obstruction=False):
         try:
             self.debug_print("set_end_effector_pose")
             x, y, z = xyz
+            roll = np.nan if roll is None else roll
             resp = self.arm_ee_cmd_client(x, y, z, pitch, roll, plan, wait, check_obstruction)
             self.debug_print("done")
             return resp.result
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def set_gripper_state(self, command, wait=True):
+        return self.set_gripper_state_async(command, wait).result()
+
+    def set_gripper_state_async(self, command, wait=True, block=True, timeout=None):
         """ Opens or closes the gripper
 
         :param command: passed as the command for the gripper
         :param wait: wait until execution is finished
+        :param block: wait for a free slot if the gripper queue is full
+        :param timeout: maximum time to wait for a free slot
 
-        :returns: True if successful; False otherwise
+        :returns: CommandHandle, its result is True if successful; False otherwise
         """
+        return self.command_queues['gripper'].submit(
+            self._set_gripper_state, command, wait, block=block, timeout=timeout)
+
+    def _set_gripper_state(self, command, wait=True):
         try:
             self.debug_print("set_gripper_state", command)
             resp = self.gripper_cmd_client(command, wait)
             self.debug_print("done")
             return resp.result
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def open_gripper(self, wait=True):
@@ -175,6 +287,43 @@ class LocobotClient:
     def force_close_if_gripper_open(self, wait=True):
         return self.set_gripper_state('force_close_if_open', wait=wait)
 
+    def open_gripper_async(self, wait=True):
+        return self.set_gripper_state_async('open', wait=wait)
+
+    def close_gripper_async(self, wait=True):
+        return self.set_gripper_state_async('close', wait=wait)
+
+    def cancel_pending_commands(self, *names):
+        """ Cancels the queued commands that didn't start yet
+
+        :param names: actuators to cancel the commands of ('arm', 'gripper', 'base', 'pan_tilt'),
+                        all of them if none are given
+
+        :returns: number of cancelled commands
+        """
+        names = names or self.command_queues.keys()
+        return sum(self.command_queues[name].cancel_pending() for name in names)
+
+    def wait_for_commands(self, *names, timeout=None):
+        """ Waits for the queued commands to finish
+
+        :param names: actuators to wait for, all of them if none are given
+        :param timeout: in seconds, shared by all the actuators
+
+        :returns: True if all the commands finished, False on timeout
+        """
+        names = names or self.command_queues.keys()
+        deadline = None if timeout is None else time.time() + timeout
+        for name in names:
+            remaining = None if deadline is None else max(deadline - time.time(), 0.0)
+            if not self.command_queues[name].wait(remaining):
+                return False
+        return True
+
+    def _shutdown_command_queues(self):
+        for command_queue in self.command_queues.values():
+            command_queue.shutdown()
+
     def get_gripper_state(self):
         """ Fetches gripper state
 
@@ -187,21 +336,30 @@ class LocobotClient:
         return self._gripper_state.data
 
     def set_pan_tilt(self, pan, tilt, wait=True):
+        return self.set_pan_tilt_async(pan, tilt, wait).result()
+
+    def set_pan_tilt_async(self, pan, tilt, wait=True, block=True, timeout=None):
         """ Set pan-tilt angle of the camera
 
         :param pan: pan angle
         :param tilt: tilt angle
         :param wait: wait until execution is finished
+        :param block: wait for a free slot if the pan_tilt queue is full
+        :param timeout: maximum time to wait for a free slot
 
-        :returns: True if successful; False otherwise
+        :returns: CommandHandle, its result is True if successful; False otherwise
         """
+        return self.command_queues['pan_tilt'].submit(
+            self._set_pan_tilt, pan, tilt, wait, block=block, timeout=timeout)
+
+    def _set_pan_tilt(self, pan, tilt, wait=True):
         try:
             self.debug_print("set_pan_tilt")
             resp = self.pan_tilt_client(pan, tilt, wait)
             self.debug_print("done")
             return resp.success
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def get_pan_tilt(self):
@@ -211,13 +369,31 @@ class LocobotClient:
         return np.array([joint_msg.position[pan_id], joint_msg.position[tilt_id]])
 
     def get_joint_angles(self):
-        joint_msg = self._joints
+        return self._arm_angles(self._joints)
+
+    @staticmethod
+    def _arm_angles(joint_msg):
         angles = []
         for joint_name in JOINT_NAMES:
             joint_id = joint_msg.name.index(joint_name)
             angles += [joint_msg.position[joint_id]]
         return np.array(angles)
 
+    def wait_for_joint_angles(self, joints, tol=0.05, timeout=5.0):
+        """ Waits until the joint states report the arm at the given angles,
+        e.g. after a set_joint_angles(..., wait=False)
+
+        :param joints: the five arm joint angles
+        :param tol: maximum difference in radians of every joint
+        :param timeout: in seconds
+
+        :returns: True if the arm reached the angles, False on timeout
+        """
+        joints = np.asarray(joints)
+        reached = lambda: self._joints is not None and np.all(np.abs(self._arm_angles(self._joints) - joints) < tol)
+        with self._joints_cond:
+            return self._joints_cond.wait_for(reached, timeout=timeout)
+
     def get_gripper_angle(self):
         joint_msg = self._joints
         joint_id = joint_msg.name.index(GRIPPER_JOINT_NAME)
@@ -229,7 +405,7 @@ class LocobotClient:
         try:
             resp = self.fk_client(joint_positions)
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             rospy.logerr("FK Service call failed")
             return None
         return resp.translation_rotation
@@ -238,30 +414,181 @@ class LocobotClient:
         try:
             resp = self.ik_client(position, pitch, roll)
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             rospy.logerr("IK Service call failed")
             return None
         return resp.joint_positions
 
-    def get_image(self):
+    def get_fk_positions(self, joint_positions):
+        """ FK for N arm configurations in one call
+
+        :param joint_positions: Nx5 joint positions
+
+        :returns: (Nx3 gripper positions, Nx3x3 rotations), (None, None) if the call failed
+        """
+        joint_positions = np.asarray(joint_positions, dtype=np.float32).reshape(-1, 5)
         try:
-            self.debug_print("get_image")
-            resp = self.color_client()
-            self.debug_print("done")
-            return np.frombuffer(resp.image.data, dtype=np.uint8).reshape(480,640,-1)
+            resp = self.fk_batch_client(joint_positions.ravel().tolist())
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
-            return False
+            traceback.print_exc()
+            rospy.logerr("FK batch service call failed")
+            return None, None
+        return np.reshape(resp.positions, (-1, 3)), np.reshape(resp.rotations, (-1, 3, 3))
 
-    def get_depth(self):
+    def get_ik_positions(self, positions, pitches, rolls):
+        """ IK for N gripper poses in one call
+
+        :param positions: Nx3 positions
+        :param pitches, rolls: N angles, or one angle for all poses
+
+        :returns: Nx5 joint positions with NaN rows for poses without a solution, None if the call failed
+        """
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        pitches = np.broadcast_to(np.asarray(pitches, dtype=np.float32), positions.shape[:1])
+        rolls = np.broadcast_to(np.asarray(rolls, dtype=np.float32), positions.shape[:1])
+        try:
+            resp = self.ik_batch_client(positions.ravel().tolist(), pitches.tolist(), rolls.tolist())
+        except rospy.ServiceException as e:
+            traceback.print_exc()
+            rospy.logerr("IK batch service call failed")
+            return None
+        return np.reshape(resp.joint_positions, (-1, 5))
+
+    def _get_fresh_frame(self, frame_buffer, max_age):
+        """ Fetches the newest streamed frame if it is at most max_age seconds old
+
+        :returns: (frame, stamp), (None, None) if there is no fresh frame
+        """
+        max_age = self._max_frame_age if max_age is None else max_age
+        frame, stamp = frame_buffer.latest()
+        if frame is None or self._latest_robot_time() - stamp > max_age:
+            return None, None
+        return frame, stamp
+
+    def _fetch_image(self, image_client, compression, dtype):
+        """ Fetches an image from a GetImage service
+
+        :returns: (image, stamp)
+        """
+        resp = image_client(compression)
+        if compression:
+            image_msg = resp.compressed_image
+            image = decode_image(image_msg.format, image_msg.data)
+        else:
+            image_msg = resp.image
+            image = np.frombuffer(image_msg.data, dtype=dtype).reshape(480,640,-1)
+        return image, image_msg.header.stamp.to_sec()
+
+    def _get_frame_after(self, frame_buffer, after):
+        """ Waits for a streamed frame captured after the given time
+
+        :returns: (frame, stamp), (None, None) if none arrived within settle_timeout
+        """
+        frame, stamp = frame_buffer.wait_for_frame(after, timeout=self._settle_timeout)
+        if frame is None:
+            rospy.logwarn("no streamed frame newer than %.3f, fetching the newest one", after)
+        return frame, stamp
+
+    def get_image_and_stamp(self, max_age=None, compression=None, after=None):
+        """ Fetches the newest color image and its timestamp
+
+        :param max_age: maximum age of a streamed frame in seconds, defaults to max_frame_age
+        :param compression: compression of an image fetched from the service, defaults to image_compression
+        :param after: time in seconds (e.g. get_time() once a motion finished), waits for a frame
+                        captured after it instead of taking the newest one
+
+        :returns: (480x640x3 uint8 image, stamp), (False, None) if unavailable
+        """
+        if after is None:
+            image, stamp = self._get_fresh_frame(self.color_buffer, max_age)
+        else:
+            image, stamp = self._get_frame_after(self.color_buffer, after)
+        if image is not None:
+            return image, stamp
+        compression = self._image_compression if compression is None else compression
         try:
             self.debug_print("get_image")
-            resp = self.depth_client()
+            image, stamp = self._fetch_image(self.color_client, compression, np.uint8)
             self.debug_print("done")
-            return np.frombuffer(resp.image.data, dtype=np.uint16).reshape(480,640,-1).astype(np.float32) / 1000
+            return image, stamp
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
-            return False
+            traceback.print_exc()
+            return False, None
+
+    def get_depth_and_stamp(self, max_age=None, compression=None, after=None):
+        """ Fetches the newest depth image (in meters) and its timestamp
+
+        :param max_age: maximum age of a streamed frame in seconds, defaults to max_frame_age
+        :param compression: compression of an image fetched from the service, defaults to depth_compression
+        :param after: time in seconds (e.g. get_time() once a motion finished), waits for a frame
+                        captured after it instead of taking the newest one
+
+        :returns: (480x640x1 float32 image, stamp), (False, None) if unavailable
+        """
+        if after is None:
+            depth, stamp = self._get_fresh_frame(self.depth_buffer, max_age)
+        else:
+            depth, stamp = self._get_frame_after(self.depth_buffer, after)
+        if depth is None:
+            compression = self._depth_compression if compression is None else compression
+            try:
+                self.debug_print("get_depth")
+                depth, stamp = self._fetch_image(self.depth_client, compression, np.uint16)
+                self.debug_print("done")
+            except rospy.ServiceException as e:
+                traceback.print_exc()
+                return False, None
+        return depth.astype(np.float32) / 1000, stamp
+
+    def get_image(self, max_age=None, compression=None, after=None):
+        image, _ = self.get_image_and_stamp(max_age, compression, after)
+        return image
+
+    def get_depth(self, max_age=None, compression=None, after=None):
+        depth, _ = self.get_depth_and_stamp(max_age, compression, after)
+        return depth
+
+    def get_time(self):
+        """ Fetches the current time on the robot's clock, which stamps the camera frames,
+        so that it can be passed as `after` from a client on another host
+
+        :returns: the stamp in seconds of the next joint states message, published on the robot,
+                    or the local ROS time if none arrives within settle_timeout
+        """
+        with self._joints_cond:
+            previous = self._joints
+            if self._joints_cond.wait_for(lambda: self._joints is not previous, timeout=self._settle_timeout):
+                stamp = self._joints.header.stamp.to_sec()
+                if stamp > 0:
+                    return stamp
+        return rospy.get_time()
+
+    def _latest_robot_time(self):
+        """ :returns: the stamp of the newest joint states message, or the local ROS time """
+        joint_msg = self._joints
+        if joint_msg is None or joint_msg.header.stamp.is_zero():
+            return rospy.get_time()
+        return joint_msg.header.stamp.to_sec()
+
+    def wait_for_base_stopped(self, timeout=None, max_fwd_speed=0.01, max_turn_speed=0.02):
+        """ Waits until odometry reports that the base came to rest
+
+        :param timeout: in seconds, defaults to settle_timeout
+        :param max_fwd_speed: forward speed in m/s below which the base is at rest
+        :param max_turn_speed: turn speed in rad/s below which the base is at rest
+
+        :returns: True if the base stopped, False on timeout
+        """
+        timeout = self._settle_timeout if timeout is None else timeout
+
+        def stopped():
+            if self._odom_state is None:
+                return False
+            twist = self._odom_state.twist.twist
+            return abs(twist.linear.x) < max_fwd_speed and abs(twist.angular.z) < max_turn_speed
+
+        with self._odom_cond:
+            return self._odom_cond.wait_for(stopped, timeout=timeout)
 
     def get_odom(self):
         pose = self._odom_state.pose.pose
@@ -273,10 +600,9 @@ class LocobotClient:
     def get_pointcloud(self):
         try:
             resp = self.pointcloud_client(in_cam=False, filter_pts=False)
-            print(len(resp.pts))
-            return np.array(resp.pts).reshape((-1, 3))
+            return decode_array(resp.data, resp.shape, resp.dtype)
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return False
 
     def is_grasp_obstructed(self, x, y):
@@ -284,9 +610,23 @@ class LocobotClient:
             resp = self.grasp_obstructed_client(x=x, y=y)
             return resp.is_obstructed
         except rospy.ServiceException as e:
-            traceback.print_exc(e)
+            traceback.print_exc()
             return True
 
+    def are_grasps_obstructed(self, xs, ys):
+        """ Checks N grasps against the same point cloud in one call
+
+        :returns: N bools, all True if the call failed
+        """
+        xs = np.asarray(xs, dtype=np.float32).ravel()
+        ys = np.asarray(ys, dtype=np.float32).ravel()
+        try:
+            resp = self.grasps_obstructed_client(x=xs.tolist(), y=ys.tolist())
+            return np.array(resp.is_obstructed, dtype=bool)
+        except rospy.ServiceException as e:
+            traceback.print_exc()
+            return np.ones(xs.shape[0], dtype=bool)
+
     def get_bumper_state(self):
         return self._bumper_state
 
@@ -302,14 +642,29 @@ class LocobotClient:
         self.sound_publisher.publish(msg)
 
     def _odom_callback(self, msg):
-        self._odom_state = msg
+        with self._odom_cond:
+            self._odom_state = msg
+            self._odom_cond.notify_all()
+
+    def _color_stream_callback(self, msg):
+        image = np.frombuffer(msg.data, dtype=np.uint8).reshape(msg.height, msg.width, -1)
+        self.color_buffer.push(image, msg.header.stamp.to_sec())
+
+    def _depth_stream_callback(self, msg):
+        depth = np.frombuffer(msg.data, dtype=np.uint16).reshape(msg.height, msg.width, -1)
+        self.depth_buffer.push(depth, msg.header.stamp.to_sec())
+
+    def _compressed_stream_callback(self, msg, decoder):
+        decoder.submit(msg.format, msg.data, msg.header.stamp.to_sec())
 
     def _gripper_callback(self, msg):
         self._gripper_state = msg
 
     def _joints_callback(self, msg):
         if len(msg.name) == 9:
-            self._joints = msg
+            with self._joints_cond:
+                self._joints = msg
+                self._joints_cond.notify_all()
 
     def _bumper_callback(self, msg):
         self._bumper_state = msg.state
@@ -0,0 +1,118 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+from concurrent.futures import wait as wait_futures
+from queue import Full
+
+
+class CommandHandle:
+    """ Handle of a command that runs in the background.
+    Wraps the concurrent.futures.Future of the command.
+    """
+    def __init__(self, future):
+        self._future = future
+
+    def done(self):
+        """ :returns: True if the command finished or was cancelled """
+        return self._future.done()
+
+    def cancelled(self):
+        return self._future.cancelled()
+
+    def cancel(self):
+        """ Cancels the command if it didn't start yet.
+        Commands that are already running can't be interrupted.
+
+        :returns: True if the command was cancelled
+        """
+        return self._future.cancel()
+
+    def wait(self, timeout=None):
+        """ Waits for the command to finish
+
+        :param timeout: in seconds, waits indefinitely if None
+
+        :returns: True if the command finished or was cancelled, False on timeout
+        """
+        done, _ = wait_futures([self._future], timeout=timeout)
+        return bool(done)
+
+    def result(self, timeout=None):
+        """ Waits for the command to finish and fetches its result
+
+        :param timeout: in seconds, waits indefinitely if None
+
+        :returns: the result of the command, None if it was cancelled
+        :raises TimeoutError: if the command didn't finish within timeout
+        """
+        try:
+            return self._future.result(timeout=timeout)
+        except CancelledError:
+            return None
+
+
+class CommandQueue:
+    """ Runs the commands of one actuator in order, on a background thread.
+    At most max_pending commands are queued or running at a time, so that the
+    caller can't build up a backlog of stale motions.
+    """
+    def __init__(self, name, max_pending=2):
+        """
+        :param name: name of the actuator, used for the worker thread
+        :param max_pending: maximum number of commands that are queued or running
+        """
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, block=True, timeout=None, **kwargs):
+        """ Queues fn(*args, **kwargs)
+
+        :param block: wait for a free slot if the queue is full
+        :param timeout: maximum time to wait for a free slot in seconds, waits indefinitely if None
+
+        :returns: CommandHandle of the command
+        :raises queue.Full: if there was no free slot
+        """
+        acquired = self._slots.acquire(timeout=timeout) if block else self._slots.acquire(False)
+        if not acquired:
+            raise Full("{} command queue is full".format(self.name))
+
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._release)
+        return CommandHandle(future)
+
+    def _release(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        self._slots.release()
+
+    def num_pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def cancel_pending(self):
+        """ Cancels the commands that didn't start yet
+
+        :returns: number of cancelled commands
+        """
+        with self._lock:
+            futures = list(self._futures)
+        return sum(future.cancel() for future in futures)
+
+    def wait(self, timeout=None):
+        """ Waits for all queued commands to finish
+
+        :returns: True if all commands finished, False on timeout
+        """
+        with self._lock:
+            futures = list(self._futures)
+        _, not_done = wait_futures(futures, timeout=timeout)
+        return not not_done
+
+    def shutdown(self):
+        self.cancel_pending()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,78 @@
+import threading
+import traceback
+
+import cv2
+import numpy as np
+
+
+COLOR_COMPRESSIONS = ('jpeg', 'png')
+DEPTH_COMPRESSIONS = ('png', )
+
+
+def encode_image(image, compression, jpeg_quality=90):
+    """ Compresses an image for a sensor_msgs/CompressedImage
+
+    :param image: HxWx3 uint8 RGB image, or HxW(x1) uint16 depth image
+    :param compression: 'jpeg' or 'png', 16-bit images are always stored losslessly as png
+
+    :returns: (format, data)
+    """
+    if image.dtype == np.uint16:
+        if compression != 'png':
+            raise ValueError("Depth images are only compressed as png, got {}".format(compression))
+        ok, data = cv2.imencode('.png', image.reshape(image.shape[:2]))
+        image_format = '16UC1; png'
+    elif compression == 'jpeg':
+        ok, data = cv2.imencode('.jpg', cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+                                [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        image_format = 'rgb8; jpeg'
+    elif compression == 'png':
+        ok, data = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        image_format = 'rgb8; png'
+    else:
+        raise ValueError("Unknown compression {}".format(compression))
+    if not ok:
+        raise RuntimeError("Failed to encode image as {}".format(compression))
+    return image_format, data.tobytes()
+
+
+def decode_image(image_format, data):
+    """ Decompresses an image compressed by encode_image
+
+    :returns: HxWx3 uint8 RGB image, or HxWx1 uint16 depth image
+    """
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise RuntimeError("Failed to decode {} image".format(image_format))
+    if image_format.startswith('16UC1'):
+        return image.reshape(image.shape[0], image.shape[1], 1)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class DecodeWorker:
+    """ Decodes compressed frames on a background thread and pushes them into a FrameBuffer.
+    Only the newest undecoded frame is kept, frames that arrive while the
+    worker is busy replace it instead of building up a backlog.
+    """
+    def __init__(self, frame_buffer):
+        self._frame_buffer = frame_buffer
+        self._pending = None
+        self._new_frame = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image_format, data, stamp):
+        with self._new_frame:
+            self._pending = (image_format, data, stamp)
+            self._new_frame.notify()
+
+    def _run(self):
+        while True:
+            with self._new_frame:
+                self._new_frame.wait_for(lambda: self._pending is not None)
+                image_format, data, stamp = self._pending
+                self._pending = None
+            try:
+                self._frame_buffer.push(decode_image(image_format, data), stamp)
+            except Exception:
+                traceback.print_exc()
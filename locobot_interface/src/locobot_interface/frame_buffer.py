@@ -0,0 +1,63 @@
+import threading
+
+import numpy as np
+
+
+class FrameBuffer:
+    """ Fixed-size ring buffer of the latest camera frames.
+    Frames are written by a topic callback and read by the client, which gets
+    the newest frame and its timestamp without waiting on the server.
+    """
+    def __init__(self, capacity=4):
+        self._capacity = capacity
+        self._frames = None
+        self._stamps = np.full(capacity, -np.inf)
+        self._index = -1
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+
+    @property
+    def has_frame(self):
+        return self._index >= 0
+
+    def push(self, frame, stamp):
+        """ Copies frame into the next slot, overwriting the oldest frame
+
+        :param frame: array of the frame, shape and dtype fixed after the first push
+        :param stamp: frame time in seconds
+        """
+        with self._lock:
+            if self._frames is None:
+                self._frames = np.empty((self._capacity, *frame.shape), dtype=frame.dtype)
+            index = (self._index + 1) % self._capacity
+            self._frames[index] = frame
+            self._stamps[index] = stamp
+            self._index = index
+            self._new_frame.notify_all()
+
+    def latest(self):
+        """ Fetches a copy of the newest frame
+
+        :returns: (frame, stamp), (None, None) if no frame was received yet
+        """
+        with self._lock:
+            if self._index < 0:
+                return None, None
+            return self._frames[self._index].copy(), self._stamps[self._index]
+
+    def latest_stamp(self):
+        with self._lock:
+            if self._index < 0:
+                return None
+            return self._stamps[self._index]
+
+    def wait_for_frame(self, after_stamp, timeout=None):
+        """ Waits for a frame newer than after_stamp
+
+        :returns: (frame, stamp), (None, None) on timeout
+        """
+        with self._lock:
+            is_new = lambda: self._index >= 0 and self._stamps[self._index] > after_stamp
+            if not self._new_frame.wait_for(is_new, timeout=timeout):
+                return None, None
+            return self._frames[self._index].copy(), self._stamps[self._index]
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class ObstacleGrid:
+    """ Robot-frame voxel grid for finding the obstacles around the base.
+
+    Which voxels belong to the robot itself (the base and the stowed arm) is
+    precomputed once, only the points in voxels on the robot's surface are
+    tested exactly. Every depth frame is then filtered through the grid with
+    a few vectorized array ops, and the closest obstacle on each side is kept,
+    so that the queries made for every base command are constant-time lookups.
+    """
+    def __init__(self,
+                 resolution=0.02,
+                 xy_extent=2.0,
+                 z_range=(0.08, 2.0),
+                 excluded_cylinders=((0.18, np.inf), ),
+                 excluded_spheres=()):
+        """
+        :param resolution: voxel size in meters
+        :param xy_extent: the grid spans [-xy_extent, xy_extent] along x and y
+        :param z_range: the grid spans z_range, points below it are dropped (the ground) and points
+                            outside of the grid are obstacles that aren't checked against the exclusions
+        :param excluded_cylinders: (radius, height) of vertical cylinders around the base origin
+                                    that are part of the robot
+        :param excluded_spheres: (center, radius) of spheres that are part of the robot
+        """
+        self.resolution = resolution
+        self.z_range = z_range
+        self.lower = np.array([-xy_extent, -xy_extent, z_range[0]])
+        upper = np.array([xy_extent, xy_extent, z_range[1]])
+        self.shape = tuple(np.ceil((upper - self.lower) / resolution).astype(np.int64))
+
+        self.excluded_cylinders = tuple(excluded_cylinders)
+        self.excluded_spheres = tuple((np.asarray(center), radius) for center, radius in excluded_spheres)
+
+        # voxels whose center is within half a diagonal of a surface are only partially on
+        # the robot, their points are tested exactly
+        centers = [
+            self.lower[i] + (np.arange(self.shape[i]) + 0.5) * resolution
+            for i in range(3)
+        ]
+        x, y, z = np.meshgrid(*centers, indexing='ij')
+        margin = np.sqrt(3) / 2 * resolution
+        excluded = np.zeros(self.shape, dtype=bool)
+        boundary = np.zeros(self.shape, dtype=bool)
+        rho = np.sqrt(x ** 2 + y ** 2)
+        for radius, height in self.excluded_cylinders:
+            excluded |= (rho < radius - margin) & (z < height - margin)
+            boundary |= (np.abs(rho - radius) <= margin) & (z <= height + margin)
+            boundary |= (np.abs(z - height) <= margin) & (rho <= radius + margin)
+        for center, radius in self.excluded_spheres:
+            dist = np.sqrt((x - center[0]) ** 2 + (y - center[1]) ** 2 + (z - center[2]) ** 2)
+            excluded |= dist < radius - margin
+            boundary |= np.abs(dist - radius) <= margin
+        self._excluded = excluded.ravel()
+        self._boundary = (boundary & ~excluded).ravel()
+
+        self.stamp = None
+        self.min_left_r2 = np.inf
+        self.min_right_r2 = np.inf
+        self.closest_point = None
+
+    def is_on_robot(self, pts):
+        """ Exact test of the points against the excluded cylinders and spheres """
+        on_robot = np.zeros(pts.shape[0], dtype=bool)
+        rho2 = pts[:, 0] ** 2 + pts[:, 1] ** 2
+        for radius, height in self.excluded_cylinders:
+            on_robot |= (rho2 < radius ** 2) & (pts[:, 2] <= height)
+        for center, radius in self.excluded_spheres:
+            on_robot |= np.sum(np.square(pts - center), axis=1) < radius ** 2
+        return on_robot
+
+    def filter_points(self, pts):
+        """ Drops the points below z_range and the points on the robot
+
+        :returns: the obstacle points
+        """
+        pts = pts[pts[:, 2] >= self.z_range[0]]
+
+        index = np.floor((pts - self.lower) / self.resolution).astype(np.int64)
+        inside = np.all((index >= 0) & (index < self.shape), axis=1)
+
+        voxels = np.ravel_multi_index(index[inside].T, self.shape)
+        keep = np.ones(pts.shape[0], dtype=bool)
+        keep[inside] = ~self._excluded[voxels]
+
+        boundary = np.zeros(pts.shape[0], dtype=bool)
+        boundary[inside] = self._boundary[voxels]
+        keep[boundary] = ~self.is_on_robot(pts[boundary])
+
+        return pts[keep]
+
+    def update(self, pts, stamp=None):
+        """ Replaces the grid contents with the obstacles in a new point cloud
+
+        :param pts: Nx3 points in the robot base frame
+        :param stamp: time of the depth frame
+        """
+        pts = self.filter_points(pts)
+
+        r2 = pts[:, 0] ** 2 + pts[:, 1] ** 2
+        left_mask = pts[:, 1] >= 0.0
+        self.min_left_r2 = np.min(r2[left_mask], initial=np.inf)
+        self.min_right_r2 = np.min(r2[~left_mask], initial=np.inf)
+        self.closest_point = pts[np.argmin(r2)] if pts.shape[0] > 0 else None
+        self.stamp = stamp
+
+    def closest_obstacle(self):
+        """ :returns: (distance, angle) of the closest obstacle in the xy-plane, (inf, 0) if there is none """
+        if self.closest_point is None:
+            return np.inf, 0.0
+        x, y = self.closest_point[:2]
+        return np.sqrt(x ** 2 + y ** 2), np.arctan2(y, x)
+
+    def turn_dir(self, thresh):
+        """ Direction to turn away from an obstacle closer than thresh, None if there is none """
+        if self.min_left_r2 < self.min_right_r2:
+            if self.min_left_r2 <= thresh ** 2:
+                return "right"
+        else:
+            if self.min_right_r2 <= thresh ** 2:
+                return "left"
+        return None
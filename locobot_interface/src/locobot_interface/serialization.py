@@ -0,0 +1,17 @@
+import numpy as np
+
+
+def encode_array(array):
+    """ Packs an array for a uint8[] data / uint32[] shape / string dtype message
+
+    :returns: (data, shape, dtype)
+    """
+    array = np.ascontiguousarray(array)
+    return array.tobytes(), list(array.shape), array.dtype.str
+
+
+def decode_array(data, shape, dtype):
+    """ Unpacks an array packed by encode_array without copying the data.
+    The returned array is read-only.
+    """
+    return np.frombuffer(data, dtype=np.dtype(dtype)).reshape(shape)
@@ -0,0 +1,29 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class PointCloudIndex:
+    """ KD-tree over one point cloud, built once and queried for many spheres. """
+    def __init__(self, pts, min_z=None):
+        """
+        :param pts: Nx3 points
+        :param min_z: points below this height are dropped (e.g. the ground)
+        """
+        if min_z is not None:
+            pts = pts[pts[:, 2] >= min_z]
+        self.num_points = pts.shape[0]
+        self._tree = cKDTree(pts) if self.num_points > 0 else None
+
+    def count_within(self, centers, radii):
+        """ Counts the points inside each sphere
+
+        :param centers: Mx3 sphere centers
+        :param radii: M radii
+
+        :returns: M point counts
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        if self._tree is None:
+            return np.zeros(centers.shape[0], dtype=np.int64)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), centers.shape[:1])
+        return np.asarray(self._tree.query_ball_point(centers, radii, return_length=True))
@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+from queue import Full
+
+from locobot_interface.commands import CommandQueue
+
+
+class TestCommandQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = CommandQueue('test', max_pending=8)
+
+    def tearDown(self):
+        self.queue.shutdown()
+
+    def test_runs_commands_in_order(self):
+        executed = []
+
+        def command(i):
+            time.sleep(0.001 * (5 - i))
+            executed.append((i, threading.current_thread().name))
+            return i
+
+        handles = [self.queue.submit(command, i) for i in range(5)]
+        self.assertEqual([handle.result(timeout=5.0) for handle in handles], list(range(5)))
+        self.assertEqual([i for i, _ in executed], list(range(5)))
+        # all on the actuator's worker thread
+        self.assertTrue(all(name.startswith('test') for _, name in executed))
+        self.assertTrue(self.queue.wait(timeout=5.0))
+        self.assertEqual(self.queue.num_pending(), 0)
+
+    def test_propagates_exceptions(self):
+        def fail():
+            raise ValueError("obstructed")
+
+        failed = self.queue.submit(fail)
+        after = self.queue.submit(lambda: 'done')
+        with self.assertRaisesRegex(ValueError, "obstructed"):
+            failed.result(timeout=5.0)
+        # a failed command doesn't stop the queue
+        self.assertEqual(after.result(timeout=5.0), 'done')
+        self.assertTrue(failed.done())
+        self.assertEqual(self.queue.num_pending(), 0)
+
+    def test_bounds_pending_commands(self):
+        queue = CommandQueue('bounded', max_pending=1)
+        release = threading.Event()
+        try:
+            running = queue.submit(release.wait)
+            with self.assertRaises(Full):
+                queue.submit(lambda: None, block=False)
+            with self.assertRaises(Full):
+                queue.submit(lambda: None, timeout=0.01)
+            release.set()
+            self.assertTrue(running.wait(timeout=5.0))
+            self.assertEqual(queue.submit(lambda: 1, timeout=5.0).result(timeout=5.0), 1)
+        finally:
+            release.set()
+            queue.shutdown()
+
+    def test_cancels_pending_commands(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+            return 'ran'
+
+        running = self.queue.submit(block)
+        self.assertTrue(started.wait(timeout=5.0))
+        queued = [self.queue.submit(lambda: 'ran') for _ in range(3)]
+        self.assertEqual(self.queue.cancel_pending(), 3)
+        release.set()
+
+        self.assertEqual(running.result(timeout=5.0), 'ran')
+        for handle in queued:
+            self.assertTrue(handle.cancelled())
+            self.assertIsNone(handle.result())
+        self.assertTrue(self.queue.wait(timeout=5.0))
+        self.assertEqual(self.queue.num_pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
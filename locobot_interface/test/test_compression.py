@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from locobot_interface.compression import DecodeWorker, decode_image, encode_image
+from locobot_interface.frame_buffer import FrameBuffer
+
+
+def make_color_image():
+    # smooth, so that jpeg stays close to the original
+    x, y = np.meshgrid(np.arange(64), np.arange(48))
+    return np.stack([x * 4, y * 5, (x + y) * 2], axis=-1).astype(np.uint8)
+
+
+def make_depth_image():
+    return np.random.RandomState(0).randint(0, 2 ** 16, size=(48, 64, 1)).astype(np.uint16)
+
+
+class TestCompression(unittest.TestCase):
+    def test_png_round_trip(self):
+        image = make_color_image()
+        image_format, data = encode_image(image, 'png')
+        self.assertEqual(image_format, 'rgb8; png')
+        np.testing.assert_array_equal(decode_image(image_format, data), image)
+
+    def test_jpeg_round_trip(self):
+        image = make_color_image()
+        image_format, data = encode_image(image, 'jpeg', jpeg_quality=95)
+        self.assertEqual(image_format, 'rgb8; jpeg')
+        decoded = decode_image(image_format, data)
+        self.assertEqual(decoded.shape, image.shape)
+        self.assertEqual(decoded.dtype, np.uint8)
+        self.assertLess(np.mean(np.abs(decoded.astype(np.int64) - image)), 3.0)
+
+    def test_depth_round_trip(self):
+        image = make_depth_image()
+        for depth_image in (image, image[..., 0]):
+            image_format, data = encode_image(depth_image, 'png')
+            self.assertEqual(image_format, '16UC1; png')
+            decoded = decode_image(image_format, data)
+            self.assertEqual(decoded.dtype, np.uint16)
+            np.testing.assert_array_equal(decoded, image)
+
+    def test_invalid_compressions(self):
+        with self.assertRaises(ValueError):
+            encode_image(make_depth_image(), 'jpeg')
+        with self.assertRaises(ValueError):
+            encode_image(make_color_image(), 'bmp')
+        with self.assertRaises(RuntimeError):
+            decode_image('rgb8; png', b'not an image')
+
+    def test_decode_worker_pushes_frames(self):
+        frame_buffer = FrameBuffer(capacity=2)
+        worker = DecodeWorker(frame_buffer)
+        image = make_color_image()
+        worker.submit(*encode_image(image, 'png'), stamp=3.0)
+        frame, stamp = frame_buffer.wait_for_frame(-np.inf, timeout=5.0)
+        self.assertEqual(stamp, 3.0)
+        np.testing.assert_array_equal(frame, image)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import unittest
+
+import numpy as np
+
+from locobot_interface.frame_buffer import FrameBuffer
+
+
+def make_frame(value):
+    return np.full((2, 3, 3), value, dtype=np.uint8)
+
+
+class TestFrameBuffer(unittest.TestCase):
+    def test_empty(self):
+        frame_buffer = FrameBuffer(capacity=4)
+        self.assertFalse(frame_buffer.has_frame)
+        self.assertEqual(frame_buffer.latest(), (None, None))
+        self.assertIsNone(frame_buffer.latest_stamp())
+        self.assertEqual(frame_buffer.wait_for_frame(-np.inf, timeout=0.01), (None, None))
+
+    def test_latest_is_newest_frame(self):
+        frame_buffer = FrameBuffer(capacity=4)
+        for i in range(3):
+            frame_buffer.push(make_frame(i), stamp=10.0 + i)
+        frame, stamp = frame_buffer.latest()
+        self.assertTrue(frame_buffer.has_frame)
+        self.assertEqual(stamp, 12.0)
+        self.assertEqual(frame_buffer.latest_stamp(), 12.0)
+        np.testing.assert_array_equal(frame, make_frame(2))
+
+    def test_evicts_oldest_frames(self):
+        frame_buffer = FrameBuffer(capacity=4)
+        for i in range(6):
+            frame_buffer.push(make_frame(i), stamp=float(i))
+        # the first two frames were overwritten in place
+        self.assertEqual(sorted(frame_buffer._stamps), [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(sorted(frame_buffer._frames[:, 0, 0, 0]), [2, 3, 4, 5])
+        frame, stamp = frame_buffer.latest()
+        self.assertEqual(stamp, 5.0)
+        np.testing.assert_array_equal(frame, make_frame(5))
+
+    def test_latest_is_a_copy(self):
+        frame_buffer = FrameBuffer(capacity=2)
+        frame_buffer.push(make_frame(1), stamp=1.0)
+        frame, _ = frame_buffer.latest()
+        frame[:] = 0
+        np.testing.assert_array_equal(frame_buffer.latest()[0], make_frame(1))
+
+    def test_wait_for_frame_skips_old_frames(self):
+        frame_buffer = FrameBuffer(capacity=4)
+        frame_buffer.push(make_frame(1), stamp=1.0)
+        self.assertEqual(frame_buffer.latest_stamp(), 1.0)
+
+        _, stamp = frame_buffer.wait_for_frame(0.5, timeout=0.01)
+        self.assertEqual(stamp, 1.0)
+        self.assertEqual(frame_buffer.wait_for_frame(1.0, timeout=0.01), (None, None))
+
+        pusher = threading.Timer(0.05, frame_buffer.push, args=(make_frame(2), 2.0))
+        pusher.start()
+        frame, stamp = frame_buffer.wait_for_frame(1.0, timeout=5.0)
+        pusher.join()
+        self.assertEqual(stamp, 2.0)
+        np.testing.assert_array_equal(frame, make_frame(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
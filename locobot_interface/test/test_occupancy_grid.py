@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+
+from locobot_interface.occupancy_grid import ObstacleGrid
+
+
+class TestObstacleGrid(unittest.TestCase):
+    def setUp(self):
+        self.grid = ObstacleGrid(
+            z_range=(0.05, 2.0),
+            excluded_cylinders=((0.18, 0.25), ),
+            excluded_spheres=(((0.3, 0.0, 0.5), 0.1), ))
+
+    def test_filters_ground_and_robot(self):
+        pts = np.array([
+            [1.0, 0.0, 0.01],  # ground
+            [0.1, 0.0, 0.1],  # base
+            [0.179, 0.0, 0.1],  # base, in a boundary voxel
+            [0.181, 0.0, 0.1],  # obstacle, in a boundary voxel
+            [0.1, 0.0, 0.3],  # above the base
+            [0.3, 0.0, 0.55],  # arm
+            [3.0, 0.0, 0.5],  # outside of the grid
+        ])
+        np.testing.assert_array_equal(self.grid.filter_points(pts), pts[[3, 4, 6]])
+
+    def test_update_replaces_stale_obstacles(self):
+        self.assertIsNone(self.grid.stamp)
+        self.assertEqual(self.grid.closest_obstacle(), (np.inf, 0.0))
+
+        self.grid.update(np.array([[0.0, 0.5, 0.3], [1.0, -1.0, 0.3]]), stamp=1.0)
+        self.assertEqual(self.grid.stamp, 1.0)
+        distance, angle = self.grid.closest_obstacle()
+        self.assertAlmostEqual(distance, 0.5)
+        self.assertAlmostEqual(angle, np.pi / 2)
+        self.assertEqual(self.grid.turn_dir(0.6), "right")
+
+        # nothing of the previous cloud is kept
+        self.grid.update(np.array([[0.0, -0.8, 0.3]]), stamp=2.0)
+        self.assertEqual(self.grid.stamp, 2.0)
+        distance, angle = self.grid.closest_obstacle()
+        self.assertAlmostEqual(distance, 0.8)
+        self.assertAlmostEqual(angle, -np.pi / 2)
+        self.assertIsNone(self.grid.turn_dir(0.6))
+        self.assertEqual(self.grid.turn_dir(1.0), "left")
+
+        self.grid.update(np.zeros((0, 3)), stamp=3.0)
+        self.assertEqual(self.grid.stamp, 3.0)
+        self.assertEqual(self.grid.closest_obstacle(), (np.inf, 0.0))
+        self.assertIsNone(self.grid.turn_dir(10.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
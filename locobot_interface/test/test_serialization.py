@@ -0,0 +1,31 @@
+import unittest
+
+import numpy as np
+
+from locobot_interface.serialization import decode_array, encode_array
+
+
+class TestSerialization(unittest.TestCase):
+    def test_round_trip(self):
+        for array in (np.random.RandomState(0).uniform(size=(5, 3)).astype(np.float32),
+                      np.arange(24, dtype=np.int64).reshape(2, 3, 4),
+                      np.zeros((0, 3), dtype=np.float32)):
+            data, shape, dtype = encode_array(array)
+            self.assertIsInstance(data, bytes)
+            decoded = decode_array(data, shape, dtype)
+            self.assertEqual(decoded.dtype, array.dtype)
+            np.testing.assert_array_equal(decoded, array)
+
+    def test_non_contiguous_round_trip(self):
+        array = np.arange(12, dtype=np.float64).reshape(3, 4).T
+        decoded = decode_array(*encode_array(array))
+        np.testing.assert_array_equal(decoded, array)
+
+    def test_decoded_array_is_read_only(self):
+        decoded = decode_array(*encode_array(np.ones(3)))
+        with self.assertRaises(ValueError):
+            decoded[0] = 0.0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from locobot_interface.spatial_index import PointCloudIndex
+
+
+class TestPointCloudIndex(unittest.TestCase):
+    def setUp(self):
+        self.pts = np.array([
+            [0.5, 0.0, 0.3],
+            [0.52, 0.0, 0.3],
+            [0.0, 0.5, 0.3],
+            [1.0, 1.0, 0.01],  # on the ground
+        ])
+
+    def test_count_within(self):
+        index = PointCloudIndex(self.pts)
+        self.assertEqual(index.num_points, 4)
+        centers = [[0.5, 0.0, 0.3], [0.0, 0.5, 0.3], [1.0, 1.0, 0.0], [-1.0, -1.0, 0.3]]
+        np.testing.assert_array_equal(index.count_within(centers, 0.05), [2, 1, 1, 0])
+        # one radius per sphere
+        np.testing.assert_array_equal(
+            index.count_within(centers[:2], [0.01, 0.8]), [1, 3])
+
+    def test_obstructed_spheres(self):
+        # the same query the server makes for a batch of link spheres
+        index = PointCloudIndex(self.pts, min_z=0.05)
+        self.assertEqual(index.num_points, 3)
+        link_positions = np.array([
+            [[0.5, 0.0, 0.35], [0.3, 0.0, 0.3]],
+            [[1.0, 1.0, 0.02], [0.0, 0.0, 0.3]],
+        ])
+        radii = np.tile([0.1, 0.05], 2)
+        num_obstructed = index.count_within(link_positions, radii).reshape(-1, 2)
+        np.testing.assert_array_equal(num_obstructed, [[2, 0], [0, 0]])
+        np.testing.assert_array_equal(np.any(num_obstructed > 0, axis=1), [True, False])
+
+    def test_empty_cloud(self):
+        index = PointCloudIndex(self.pts, min_z=2.0)
+        self.assertEqual(index.num_points, 0)
+        np.testing.assert_array_equal(index.count_within(np.zeros((3, 3)), 1.0), [0, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
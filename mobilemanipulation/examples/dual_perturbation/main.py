@@ -18,12 +18,14 @@ from softlearning import value_functions
 from softlearning import replay_pools
 from softlearning import samplers
 from softlearning import rnd
+from softlearning import preprocessors
 
 from softlearning.policies.utils import get_additional_policy_params
 
 from softlearning.utils.misc import set_seed
 from softlearning.utils.times import datetimestamp
-from softlearning.utils.tensorflow import set_gpu_memory_growth
+from softlearning.utils.tensorflow import (
+    set_gpu_memory_growth, set_compute_policy)
 from examples.instrument import run_example_local
 
 import traceback
@@ -42,6 +44,8 @@ class ExperimentRunner(tune.Trainable):
         if variant['run_params'].get('run_eagerly', False):
             tf.config.experimental_run_functions_eagerly(True)
 
+        set_compute_policy(**variant['run_params'].get('compute_policy', {}))
+
         self._variant = variant
 
         # device = 2
@@ -100,13 +104,18 @@ class ExperimentRunner(tune.Trainable):
         else:
             evaluation_environment = self.evaluation_environment = None
 
+        # with `share_pixel_encoder`, the Q functions of each algorithm share one
+        # pixel encoder, trained on the sum of their losses
+        share_pixel_encoder = variant.get('share_pixel_encoder', False)
+
         # Q functions
         Q_params = copy.deepcopy(variant['Q_params'])
         Q_params['config'].update({
             'input_shapes': training_environment.Q_input_shapes,
             'output_size': training_environment.Q_output_size,
         })
-        Qs = self.Qs = value_functions.get(Q_params)
+        with preprocessors.shared_preprocessors(enabled=share_pixel_encoder):
+            Qs = self.Qs = value_functions.get(Q_params)
 
         # policy
         variant['policy_params']['config'].update({
@@ -120,6 +129,10 @@ class ExperimentRunner(tune.Trainable):
         variant['replay_pool_params']['config'].update({
             'environment': training_environment,
         })
+        if hasattr(training_environment, 'replay_pool_extra_fields'):
+            variant['replay_pool_params']['config'].update({
+                'extra_fields': training_environment.replay_pool_extra_fields,
+            })
         replay_pool = self.replay_pool = replay_pools.get(
             variant['replay_pool_params'])
 
@@ -129,6 +142,12 @@ class ExperimentRunner(tune.Trainable):
             'policy': policy,
             'pool': replay_pool,
         })
+        if variant['sampler_params']['class_name'] == 'RemoteSampler':
+            # the environment trains its grasping and perturbation learners while
+            # stepping, which the sampler's workers would do on unsynced copies
+            raise ValueError(
+                "The dual perturbation environments train their own learners"
+                " and can't be sampled with RemoteSampler, use SimpleSampler.")
         sampler = self.sampler = samplers.get(variant['sampler_params'])
 
         # algorithm
@@ -141,6 +160,10 @@ class ExperimentRunner(tune.Trainable):
             'sampler': sampler,
             'sample_training_batch_fn': training_environment.sample_training_batch
         })
+        if variant['algorithm_params']['config'].get('num_evaluation_workers', 0) > 0:
+            variant['algorithm_params']['config'].update({
+                'evaluation_environment_fn': self._create_evaluation_environment,
+            })
         self.algorithm = algorithms.get(variant['algorithm_params'])
 
         # grasp_perturbation stuff
@@ -160,7 +183,8 @@ class ExperimentRunner(tune.Trainable):
                 'input_shapes': training_environment.grasp_perturbation_env.Q_input_shapes,
                 'output_size': training_environment.grasp_perturbation_env.Q_output_size,
             })
-            self.grasp_perturbation_Qs = value_functions.get(grasp_perturbation_Q_params)
+            with preprocessors.shared_preprocessors(enabled=share_pixel_encoder):
+                self.grasp_perturbation_Qs = value_functions.get(grasp_perturbation_Q_params)
             self.grasp_perturbation_Qs[0].model.summary()
 
             # grasp_perturbation algorithm
@@ -195,7 +219,8 @@ class ExperimentRunner(tune.Trainable):
                 'input_shapes': training_environment.nav_perturbation_env.Q_input_shapes,
                 'output_size': training_environment.nav_perturbation_env.Q_output_size,
             })
-            self.nav_perturbation_Qs = value_functions.get(nav_perturbation_Q_params)
+            with preprocessors.shared_preprocessors(enabled=share_pixel_encoder):
+                self.nav_perturbation_Qs = value_functions.get(nav_perturbation_Q_params)
             self.nav_perturbation_Qs[0].model.summary()
 
             # nav_perturbation algorithm
@@ -267,6 +292,23 @@ class ExperimentRunner(tune.Trainable):
 
         self._built = True
 
+    def _create_evaluation_environment(self):
+        """ Builds an extra evaluation environment for a parallel evaluation worker. """
+        environment_params = self._variant['environment_params']
+        evaluation_environment = get_environment_from_params(
+            environment_params.get('evaluation', environment_params['training']))
+        evaluation_environment.finish_init(
+            algorithm=self.algorithm,
+            replay_pool=None,
+            grasp_rnd_trainer=None,
+            grasp_perturbation_algorithm=None,
+            grasp_perturbation_policy=None,
+            nav_rnd_trainer=None,
+            nav_perturbation_algorithm=None,
+            nav_perturbation_policy=None,
+        )
+        return evaluation_environment
+
     def _train(self):
         if not self._built:
             self._build()
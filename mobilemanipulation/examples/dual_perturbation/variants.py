@@ -19,6 +19,8 @@ REAL_EXP = True
 DEBUG_SAVE = False
 DEBUG_LOAD = False
 SIM_REAL_EXP = False
+# train the perturbation learners between env steps, see PerturbationTrainer
+DEFER_PERTURBATION_TRAINING = False
 
 ALGORITHM_PARAMS_BASE = {
     'config': {
@@ -53,6 +55,8 @@ ALGORITHM_PARAMS_ADDITIONAL = {
 
             'discount': 0.99,
             'reward_scale': 1.0,
+
+            'fused_critic': True,
         },
     },
     'SACMixed': {
@@ -163,6 +167,12 @@ ENVIRONMENT_PARAMS_PER_UNIVERSE_DOMAIN_TASK = {
         'Locobot': {
             'NavigationGraspingDualPerturbation-v0': {
                 'reset_free': False,
+                'grasp_perturbation_params': {
+                    'defer_training': DEFER_PERTURBATION_TRAINING,
+                },
+                'nav_perturbation_params': {
+                    'defer_training': DEFER_PERTURBATION_TRAINING,
+                },
                 'observation_keys': ('pixels',),
                 'room_name': 'single',
                 'room_params': {
@@ -182,6 +192,12 @@ ENVIRONMENT_PARAMS_PER_UNIVERSE_DOMAIN_TASK = {
 
             'NavigationGraspingDualPerturbationFrameStack-v0': {
                 'reset_free': False,
+                'grasp_perturbation_params': {
+                    'defer_training': DEFER_PERTURBATION_TRAINING,
+                },
+                'nav_perturbation_params': {
+                    'defer_training': DEFER_PERTURBATION_TRAINING,
+                },
                 'observation_keys': ('pixels',),
                 'room_name': 'single',
                 'room_params': {
@@ -193,6 +209,12 @@ ENVIRONMENT_PARAMS_PER_UNIVERSE_DOMAIN_TASK = {
             },
             'NavigationGraspingDualPerturbationOracle-v0': {
                 'reset_free': False,
+                'grasp_perturbation_params': {
+                    'defer_training': DEFER_PERTURBATION_TRAINING,
+                },
+                'nav_perturbation_params': {
+                    'defer_training': DEFER_PERTURBATION_TRAINING,
+                },
                 'room_name': 'single',
                 'room_params': {
                     'num_objects': 20, 
@@ -281,12 +303,15 @@ def get_algorithm_params(universe, domain, task):
     epoch_length = get_epoch_length(universe, domain, task)
     n_epochs = total_timesteps / epoch_length
     assert n_epochs == int(n_epochs)
+    batch_size = 128 if not DEBUG_BUFFER_SIZE_LOCAL else 2
     algorithm_params = {
         'config': {
             'n_epochs': int(n_epochs),
             'epoch_length': epoch_length,
             'min_pool_size': get_max_path_length(universe, domain, task),
-            'batch_size': 128 if not DEBUG_BUFFER_SIZE_LOCAL else 2,
+            'batch_size': batch_size,
+            # the shared data batches are padded to one fixed shape
+            'batch_bucket_sizes': (batch_size, ),
         }
     }
 
@@ -362,6 +387,8 @@ def get_variant_spec_base(universe, domain, task, policy, algorithm, env_kwargs,
                 'preprocessors': None,
             },
         },
+        # share one pixel encoder between the Q functions of each algorithm
+        'share_pixel_encoder': False,
         'rnd_params': {
             'class_name': 'RNDTrainer',
             'config': {
@@ -393,6 +420,10 @@ def get_variant_spec_base(universe, domain, task, policy, algorithm, env_kwargs,
             'checkpoint_at_end': True,
             'checkpoint_frequency': tune.sample_from(get_checkpoint_frequency),
             'checkpoint_replay_pool': True if REAL_EXP else False,
+            'compute_policy': {
+                'jit_compile': False,
+                'mixed_precision': False,
+            },
         },
     }
 
@@ -548,6 +579,8 @@ def get_variant_spec_image(universe,
         for key in pixel_keys:
             params = deepcopy(preprocessor_params)
             params['config']['name'] = 'convnet_preprocessor_' + key
+            # only used with `share_pixel_encoder`, see main.py
+            params['config']['shared_name'] = 'pixels_encoder_' + key
             preprocessors[key] = params
 
         # policy
@@ -22,7 +22,8 @@ from softlearning import rnd
 from softlearning.policies.utils import get_additional_policy_params
 
 from softlearning.utils.misc import set_seed
-from softlearning.utils.tensorflow import set_gpu_memory_growth
+from softlearning.utils.tensorflow import (
+    set_gpu_memory_growth, set_compute_policy)
 from examples.instrument import run_example_local
 
 
@@ -39,6 +40,8 @@ class ExperimentRunner(tune.Trainable):
         if variant['run_params'].get('run_eagerly', False):
             tf.config.experimental_run_functions_eagerly(True)
 
+        set_compute_policy(**variant['run_params'].get('compute_policy', {}))
+
         self._variant = variant
         set_gpu_memory_growth(True)
 
@@ -1,5 +1,7 @@
 import numpy as np
 
+from softlearning.utils.numpy import pad_batch
+
 import os
 
 class ReplayBuffer:
@@ -52,16 +54,15 @@ class ReplayBuffer:
         return data
 
     def get_all_samples_in_batch(self, batch_size):
+        """ Every batch has exactly batch_size samples and a validity mask; the last one is padded. """
         datas = []
-        for i in range(0, (self._num // batch_size) * batch_size, batch_size):
+        for i in range(0, self._num, batch_size):
             data = {
                 'observations': self._observations[i:i+batch_size],
                 'actions': self._actions[i:i+batch_size],
                 'rewards': self._rewards[i:i+batch_size],
             }
-            datas.append(data)
-        if self._num % batch_size != 0:
-            datas.append(self.sample_batch(batch_size))
+            datas.append(pad_batch(data, (batch_size,)))
         return datas
     
     def get_all_samples_in_batch_random(self, batch_size):
@@ -143,6 +144,6 @@ class ReplayBuffer:
         self._rewards[:self._num] = data['rewards']
         self._raw_actions[:self._num] = data['raw_actions']
 
-        for i in range(self._num):
-            self._actions[i] = discretizer.flatten(discretizer.discretize(self._raw_actions[i]))
+        actions = discretizer.flatten(discretizer.discretize(self._raw_actions[:self._num]))
+        self._actions[:self._num] = np.reshape(actions, (self._num, -1))
         
\ No newline at end of file
@@ -4,6 +4,8 @@ import tree
 
 from scipy.special import expit
 
+from softlearning.utils.tensorflow import compiled_function
+
 def create_grasping_env_discrete_sampler(
         env=None,
         discretizer=None,
@@ -341,8 +343,8 @@ def create_grasping_env_soft_q_sampler(
     
         return obs, action_discrete, reward, {"sample_random": 1, "action": action_undiscretized}
 
-    @tf.function(experimental_relax_shapes=True)
-    def calc_probs(obs):
+    @compiled_function
+    def sample_action(obs):
         obs = obs[tf.newaxis, ...]
 
         all_logits = [logits_model(obs) for logits_model in logits_models]
@@ -370,39 +372,44 @@ def create_grasping_env_soft_q_sampler(
             uncertainty = max_Q_values - min_Q_values
         else:
             raise NotImplementedError()
-        
-        probs = tf.nn.softmax(alpha * agg_Q_values + beta * uncertainty, axis=-1)
 
-        diagnostics = {
-            "min_Q_values": tf.squeeze(min_Q_values),
-            "mean_Q_values": tf.squeeze(mean_Q_values),
-            "max_Q_values": tf.squeeze(max_Q_values),
-        }
-
-        return tf.squeeze(probs), tf.squeeze(agg_Q_values), diagnostics
+        if deterministic:
+            action_discrete = tf.argmax(agg_Q_values, axis=-1, output_type=tf.int32)
+        else:
+            # same distribution as softmax(alpha * agg_Q_values + beta * uncertainty)
+            logits = tf.cast(alpha * agg_Q_values + beta * uncertainty, tf.float32)
+            action_discrete = tf.random.categorical(logits, 1, dtype=tf.int32)[:, 0]
+
+        action_undiscretized = discretizer.tf_undiscretize_flat(action_discrete)
+        Q_values = tf.stack([
+            tf.gather(max_Q_values, action_discrete, axis=-1, batch_dims=1),
+            tf.gather(mean_Q_values, action_discrete, axis=-1, batch_dims=1),
+            tf.gather(min_Q_values, action_discrete, axis=-1, batch_dims=1),
+        ], axis=-1)
+
+        # packed into one vector so the whole sample needs a single host transfer
+        return tf.concat([
+            tf.cast(action_discrete, tf.float32)[:, tf.newaxis],
+            action_undiscretized,
+            tf.cast(Q_values, tf.float32),
+        ], axis=-1)[0]
 
     def sample_policy():
         obs = env.get_observation()
 
-        probs, agg_Q_values, diagnostics = calc_probs(obs)
-        probs = probs.numpy()
-        agg_Q_values = agg_Q_values.numpy()
-        diagnostics = tree.map_structure(lambda x: x.numpy(), diagnostics)
-        
-        if deterministic:
-            action_discrete = np.argmax(agg_Q_values)
-        else:
-            action_discrete = np.random.choice(total_dimensions, p=probs)
+        sample = sample_action(obs).numpy()
+        action_discrete = int(sample[0])
+        action_undiscretized = sample[1:-3]
+        max_Q_value, mean_Q_value, min_Q_value = sample[-3:]
 
-        action_undiscretized = discretizer.undiscretize(discretizer.unflatten(action_discrete))
         reward = env.do_grasp(action_undiscretized)
 
         infos =  {
             "sample_policy": 1, 
             "action": action_undiscretized,
-            "max_Q_value": diagnostics["max_Q_values"][action_discrete],
-            "mean_Q_value":  diagnostics["mean_Q_values"][action_discrete],
-            "min_Q_value": diagnostics["min_Q_values"][action_discrete],
+            "max_Q_value": max_Q_value,
+            "mean_Q_value": mean_Q_value,
+            "min_Q_value": min_Q_value,
         }
 
         return obs, action_discrete, reward, infos
@@ -1,6 +1,7 @@
 import tensorflow as tf 
 
 from losses import autoregressive_binary_cross_entropy_loss, autoregressive_softmax_cross_entropy_loss
+from softlearning.utils.tensorflow import compiled_function, compute_gradients, masked_average_loss
 
 @tf.function(experimental_relax_shapes=True)
 def train_autoregressive_discrete_sigmoid(logits_model, data, optimizer, discrete_dimensions):
@@ -31,7 +32,7 @@ def validation_autoregressive_discrete_sigmoid(logits_model, data, discrete_dime
 
 
 
-@tf.function(experimental_relax_shapes=True)
+@compiled_function
 def train_discrete_sigmoid(logits_model, data, optimizer, discrete_dimension, return_acc=False):
     observations = data['observations']
     rewards = tf.cast(data['rewards'], tf.float32)
@@ -43,14 +44,14 @@ def train_discrete_sigmoid(logits_model, data, optimizer, discrete_dimension, re
         taken_logits = tf.reduce_sum(logits * actions_onehot, axis=-1, keepdims=True)
         
         losses = tf.nn.sigmoid_cross_entropy_with_logits(labels=rewards, logits=taken_logits)
-        loss = tf.nn.compute_average_loss(losses)
+        loss = masked_average_loss(losses, data.get('mask'))
     
-    grads = tape.gradient(loss, logits_model.trainable_variables)
+    grads = compute_gradients(tape, loss, logits_model.trainable_variables, optimizer)
     optimizer.apply_gradients(zip(grads, logits_model.trainable_variables))
     if return_acc:
         pred = taken_logits > 0.5
         pred = tf.cast(pred, tf.float32)
-        acc = tf.reduce_mean(tf.cast(pred == rewards, tf.float32))
+        acc = masked_average_loss(tf.cast(pred == rewards, tf.float32), data.get('mask'))
         return loss, acc
     return loss
 
@@ -63,11 +64,11 @@ def validation_discrete_sigmoid(logits_model, data, discrete_dimension, return_a
     logits = logits_model(observations)
     taken_logits = tf.reduce_sum(logits * actions_onehot, axis=-1, keepdims=True)
     losses = tf.nn.sigmoid_cross_entropy_with_logits(labels=rewards, logits=taken_logits)
-    loss = tf.nn.compute_average_loss(losses)
+    loss = masked_average_loss(losses, data.get('mask'))
     if return_acc:
         pred = taken_logits > 0.5
         pred = tf.cast(pred, tf.float32)
-        acc = tf.reduce_mean(tf.cast(pred == rewards, tf.float32))
+        acc = masked_average_loss(tf.cast(pred == rewards, tf.float32), data.get('mask'))
         return loss, acc
     return loss
 
@@ -144,7 +145,7 @@ def train_ddpg_policy(policy_model, Q_model, observations, optimizer):
     return loss
 
 def create_train_discrete_Q_sigmoid(logits_model, optimizer, discrete_dimension):
-    @tf.function(experimental_relax_shapes=True)
+    @compiled_function
     def train(data):
         observations = data['observations']
         rewards = tf.cast(data['rewards'], tf.float32)
@@ -155,9 +156,9 @@ def create_train_discrete_Q_sigmoid(logits_model, optimizer, discrete_dimension)
             logits = logits_model(observations)
             taken_logits = tf.reduce_sum(logits * actions_onehot, axis=-1, keepdims=True)
             losses = tf.nn.sigmoid_cross_entropy_with_logits(labels=rewards, logits=taken_logits)
-            loss = tf.nn.compute_average_loss(losses)
+            loss = masked_average_loss(losses, data.get('mask'))
 
-        grads = tape.gradient(loss, logits_model.trainable_variables)
+        grads = compute_gradients(tape, loss, logits_model.trainable_variables, optimizer)
         optimizer.apply_gradients(zip(grads, logits_model.trainable_variables))
 
         return loss
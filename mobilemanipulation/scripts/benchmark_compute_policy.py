@@ -0,0 +1,275 @@
+#!/usr/bin/python
+
+"""CPU benchmark of training updates/sec under each compute policy.
+
+Builds the grasp Q ensemble, SAC, SACDiscrete and RND learners on random
+pixel batches for every combination of XLA compilation and mixed precision,
+and reports the number of updates per second for each.
+
+Example:
+    python -m scripts.benchmark_compute_policy --num-updates 50
+"""
+
+import argparse
+import itertools
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import numpy as np
+import tensorflow as tf
+from gym import spaces
+
+from softlearning.algorithms.sac import SAC
+from softlearning.algorithms.sac_discrete import SACDiscrete
+from softlearning.environments.gym.locobot.utils import (
+    build_discrete_Q_model,
+    create_train_discrete_Q_sigmoid,
+    create_train_discrete_Q_sigmoid_bootstrap)
+from softlearning.policies.discrete_policy import FeedforwardDiscretePolicy
+from softlearning.policies.gaussian_policy import FeedforwardGaussianPolicy
+from softlearning.rnd import RNDTrainer
+from softlearning.utils.tensorflow import (
+    set_compute_policy, loss_scale_optimizer)
+from softlearning.value_functions.vanilla import feedforward_Q_function
+
+
+IMAGE_SIZE = 100
+GRASP_IMAGE_SIZE = 60
+NUM_GRASP_MODELS = 6
+GRASP_DISCRETE_DIMENSION = 15 * 15
+NUM_DISCRETE_ACTIONS = 5
+
+CONVNET_PREPROCESSOR = {
+    'class_name': 'convnet_preprocessor',
+    'config': {
+        'conv_filters': (64, 64, 64),
+        'conv_kernel_sizes': (3, 3, 3),
+        'conv_strides': (2, 2, 2),
+        'activation': 'relu',
+    },
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--num-updates', type=int, default=20)
+    parser.add_argument('--num-warmup-updates', type=int, default=3)
+    parser.add_argument(
+        '--algorithms', type=str, nargs='+',
+        default=('grasp', 'grasp_bootstrap', 'sac', 'sac_discrete', 'rnd'))
+    args = parser.parse_args()
+
+    return args
+
+
+def random_pixels(batch_size, image_size=IMAGE_SIZE):
+    return np.random.randint(
+        0, 256, size=(batch_size, image_size, image_size, 3), dtype=np.uint8)
+
+
+def sac_batch(batch_size, actions):
+    return {
+        'observations': {'pixels': random_pixels(batch_size)},
+        'next_observations': {'pixels': random_pixels(batch_size)},
+        'actions': actions,
+        'rewards': np.random.uniform(size=(batch_size, 1)).astype(np.float32),
+        'terminals': np.zeros((batch_size, 1), dtype=bool),
+    }
+
+
+def grasp_batch(batch_size):
+    return {
+        'observations': random_pixels(batch_size, GRASP_IMAGE_SIZE),
+        'actions': np.random.randint(
+            0, GRASP_DISCRETE_DIMENSION, size=(batch_size, 1)).astype(np.int32),
+        'rewards': np.random.randint(
+            0, 2, size=(batch_size, 1)).astype(np.float32),
+    }
+
+
+def build_grasp_update(batch_size, bootstrap):
+    logits_models = tuple(
+        build_discrete_Q_model(
+            image_size=GRASP_IMAGE_SIZE,
+            discrete_dimension=GRASP_DISCRETE_DIMENSION,
+            discrete_hidden_layers=[512, 512])
+        for _ in range(NUM_GRASP_MODELS))
+    optimizers = tuple(
+        loss_scale_optimizer(tf.optimizers.Adam(learning_rate=3e-4))
+        for _ in range(NUM_GRASP_MODELS))
+
+    if bootstrap:
+        train_functions = [create_train_discrete_Q_sigmoid_bootstrap(
+            logits_models, optimizers, GRASP_DISCRETE_DIMENSION)]
+    else:
+        train_functions = [
+            create_train_discrete_Q_sigmoid(
+                logits_model, optimizer, GRASP_DISCRETE_DIMENSION)
+            for logits_model, optimizer in zip(logits_models, optimizers)
+        ]
+
+    batch = grasp_batch(batch_size)
+
+    def update():
+        return [train(batch).numpy() for train in train_functions]
+
+    return update
+
+
+def build_sac_update(batch_size):
+    observation_shapes = OrderedDict((
+        ('pixels', tf.TensorShape((IMAGE_SIZE, IMAGE_SIZE, 3))), ))
+    action_shape = tf.TensorShape((2, ))
+
+    policy = FeedforwardGaussianPolicy(
+        input_shapes=observation_shapes,
+        output_shape=action_shape,
+        action_range=(-np.ones(2), np.ones(2)),
+        hidden_layer_sizes=(256, 256),
+        preprocessors={'pixels': CONVNET_PREPROCESSOR})
+    Qs = tuple(
+        feedforward_Q_function(
+            input_shapes=(observation_shapes, action_shape),
+            output_size=1,
+            hidden_layer_sizes=(256, 256),
+            preprocessors=({'pixels': CONVNET_PREPROCESSOR}, None))
+        for _ in range(2))
+
+    algorithm = SAC(
+        training_environment=None,
+        evaluation_environment=None,
+        policy=policy,
+        Qs=Qs,
+        target_entropy=-2.0,
+        pool=None,
+        sampler=None)
+
+    batch = sac_batch(
+        batch_size,
+        np.random.uniform(-1, 1, size=(batch_size, 2)).astype(np.float32))
+
+    def update():
+        return algorithm._do_updates(batch)['Q_loss-mean'].numpy()
+
+    return update
+
+
+def build_sac_discrete_update(batch_size):
+    observation_shapes = OrderedDict((
+        ('pixels', tf.TensorShape((IMAGE_SIZE, IMAGE_SIZE, 3))), ))
+
+    policy = FeedforwardDiscretePolicy(
+        num_discrete=NUM_DISCRETE_ACTIONS,
+        input_shapes=observation_shapes,
+        output_shape=(NUM_DISCRETE_ACTIONS, ),
+        hidden_layer_sizes=(256, 256),
+        preprocessors={'pixels': CONVNET_PREPROCESSOR})
+    Qs = tuple(
+        feedforward_Q_function(
+            input_shapes=observation_shapes,
+            output_size=NUM_DISCRETE_ACTIONS,
+            hidden_layer_sizes=(256, 256),
+            preprocessors={'pixels': CONVNET_PREPROCESSOR})
+        for _ in range(2))
+
+    environment = SimpleNamespace(
+        action_space=spaces.Discrete(NUM_DISCRETE_ACTIONS))
+    algorithm = SACDiscrete(
+        training_environment=environment,
+        evaluation_environment=None,
+        policy=policy,
+        Qs=Qs,
+        pool=None,
+        sampler=None)
+
+    batch = sac_batch(
+        batch_size,
+        np.random.randint(
+            0, NUM_DISCRETE_ACTIONS, size=(batch_size, 1)).astype(np.int32))
+    target_entropy = tf.constant(algorithm._target_entropy, dtype=tf.float32)
+
+    def update():
+        return algorithm._do_updates(
+            batch, target_entropy)['Q_loss-mean'].numpy()
+
+    return update
+
+
+def build_rnd_update(batch_size):
+    rnd_trainer = RNDTrainer(
+        input_shapes=OrderedDict((
+            ('pixels', tf.TensorShape((IMAGE_SIZE, IMAGE_SIZE, 3))), )),
+        output_shape=(512, ),
+        hidden_layer_sizes=(256, 256),
+        preprocessors={'pixels': CONVNET_PREPROCESSOR})
+
+    observations = OrderedDict((('pixels', random_pixels(batch_size)), ))
+
+    def update():
+        return rnd_trainer.update_predictor(observations).numpy()
+
+    return update
+
+
+UPDATE_BUILDERS = {
+    'grasp': lambda batch_size: build_grasp_update(batch_size, False),
+    'grasp_bootstrap': lambda batch_size: build_grasp_update(batch_size, True),
+    'sac': build_sac_update,
+    'sac_discrete': build_sac_discrete_update,
+    'rnd': build_rnd_update,
+}
+
+
+def benchmark_updates(update, num_updates, num_warmup_updates):
+    # The warmup updates absorb tracing and XLA compilation.
+    for _ in range(num_warmup_updates):
+        update()
+
+    start_time = time.perf_counter()
+    for _ in range(num_updates):
+        update()
+    elapsed_time = time.perf_counter() - start_time
+
+    return num_updates / elapsed_time
+
+
+def main():
+    args = parse_args()
+
+    tf.config.set_visible_devices([], 'GPU')
+
+    results = OrderedDict()
+    for jit_compile, mixed_precision in itertools.product(
+            (False, True), (False, True)):
+        set_compute_policy(
+            jit_compile=jit_compile, mixed_precision=mixed_precision)
+        setting = (
+            f"jit_compile={jit_compile}, mixed_precision={mixed_precision}")
+
+        for algorithm in args.algorithms:
+            update = UPDATE_BUILDERS[algorithm](args.batch_size)
+            try:
+                updates_per_second = benchmark_updates(
+                    update, args.num_updates, args.num_warmup_updates)
+            except (tf.errors.InvalidArgumentError,
+                    tf.errors.UnimplementedError) as e:
+                print(f"{algorithm} [{setting}] failed: {e.message}")
+                updates_per_second = np.nan
+
+            results[(algorithm, setting)] = updates_per_second
+            print(f"{algorithm} [{setting}]: "
+                  f"{updates_per_second:.2f} updates/sec")
+
+    set_compute_policy()
+
+    print()
+    print(f"{'algorithm':<16} {'setting':<42} updates/sec")
+    for (algorithm, setting), updates_per_second in results.items():
+        print(f"{algorithm:<16} {setting:<42} {updates_per_second:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,24 @@
 import abc
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from distutils.version import LooseVersion
 from itertools import count
 import gtimer as gt
 import math
 import os
+import threading
+import time
 
 import numpy as np
 import tensorflow as tf
 import tree
 
+from softlearning import policies
 from softlearning.samplers import rollouts
 from softlearning.utils.video import save_video
+from softlearning.utils.numpy import pad_batch
+from softlearning.utils.tensorflow import get_trace_counts
 from softlearning.policies import utils as policy_utils
 
 
@@ -44,7 +51,13 @@ class RLAlgorithm(Checkpointable):
             eval_render_kwargs=None,
             video_save_frequency=0,
             num_warmup_samples=0,
-            sample_training_batch_fn=None
+            sample_training_batch_fn=None,
+            batch_bucket_sizes=None,
+            batched_train_repeats=False,
+            decoupled_sampling=False,
+            max_update_to_data_ratio=None,
+            num_evaluation_workers=0,
+            evaluation_environment_fn=None,
     ):
         """
         Args:
@@ -58,6 +71,32 @@ class RLAlgorithm(Checkpointable):
                 rendering evaluation rollouts. `None` to disable rendering.
             num_warmup_samples ('int'): Number of random samples to warmup the
                 replay pool with.
+            batch_bucket_sizes (`None`, `tuple`): If given, training batches
+                are padded to the smallest fitting bucket size and carry a
+                validity 'mask', so that the update functions are only traced
+                once per bucket.
+            batched_train_repeats (`bool`): If True, the `n_train_repeat`
+                batches of a training step are sampled at once and trained on
+                in one compiled call, see `_do_batched_training`.
+            decoupled_sampling (`bool`): If True, sampling runs on a background
+                thread concurrently with training instead of alternating with
+                it. Pool access is serialized with a lock. The learner trains
+                in the same rounds of `n_train_repeat` updates (batched with
+                `batched_train_repeats`), and the epoch ends once it has done
+                the rounds owed for every `train_every_n_steps` samples.
+            max_update_to_data_ratio (`None`, `float`): Maximum number of
+                gradient updates per collected sample in the decoupled mode,
+                also bounded by `max_train_repeat_per_timestep`. Defaults to
+                `n_train_repeat / train_every_n_steps`.
+            num_evaluation_workers (`int`): If positive, evaluation rollouts
+                are split across this many worker threads, each with its own
+                environment and a frozen snapshot of the evaluation policy
+                and of the environment's learned models. Training continues
+                while they run, so the diagnostics of each epoch are yielded
+                at the end of the next epoch, together with the evaluation
+                that the epoch requested. Videos are not saved in this mode.
+            evaluation_environment_fn (`None`, `callable`): Creates the
+                additional evaluation environments for the workers.
         """
         self.sampler = sampler
         self.pool = pool
@@ -76,6 +115,22 @@ class RLAlgorithm(Checkpointable):
         self._num_warmup_samples = num_warmup_samples
 
         self._sample_training_batch_fn = sample_training_batch_fn
+        self._batch_bucket_sizes = batch_bucket_sizes
+        self._batched_train_repeats = batched_train_repeats
+
+        self._decoupled_sampling = decoupled_sampling
+        self._max_update_to_data_ratio = (
+            max_update_to_data_ratio
+            if max_update_to_data_ratio is not None
+            else n_train_repeat / train_every_n_steps)
+        self._pool_lock = threading.Lock()
+
+        self._num_evaluation_workers = num_evaluation_workers
+        self._evaluation_environment_fn = evaluation_environment_fn
+        self._evaluation_workers = None
+        self._evaluation_executor = None
+        self._pending_evaluation = None
+        self._unreported_diagnostics = None
 
         self._eval_render_kwargs = eval_render_kwargs or {}
 
@@ -130,9 +185,33 @@ class RLAlgorithm(Checkpointable):
     def _training_batch(self, batch_size=None, **kwargs):
         batch_size = batch_size or self._batch_size
         if self._sample_training_batch_fn:
-            return self._sample_training_batch_fn(batch_size, **kwargs)
+            batch = self._sample_training_batch_fn(batch_size, **kwargs)
         else:
-            return self.pool.random_batch(batch_size, **kwargs)
+            batch = self.pool.random_batch(batch_size, **kwargs)
+
+        return self._pad_training_batch(batch)
+
+    def _pad_training_batch(self, batch):
+        """Pads `batch` to its bucket size, if `batch_bucket_sizes` is set.
+
+        Also used by the learners that sample their own training batches.
+        """
+        if self._batch_bucket_sizes:
+            batch = pad_batch(batch, self._batch_bucket_sizes)
+
+        return batch
+
+    def _stacked_training_batch(self, num_batches, batch_size=None):
+        """Samples `num_batches` training batches with one pool access.
+
+        The batch is returned flat, with `num_batches * batch_size` rows, so
+        that it can be processed as one before being split into the batches.
+        It is never padded, since its size doesn't vary.
+        """
+        batch_size = batch_size or self._batch_size
+        if self._sample_training_batch_fn:
+            return self._sample_training_batch_fn(num_batches * batch_size)
+        return self.pool.random_batch(num_batches * batch_size)
 
     def _evaluation_batch(self, *args, **kwargs):
         return self._training_batch(*args, **kwargs)
@@ -177,29 +256,43 @@ class RLAlgorithm(Checkpointable):
             update_diagnostics = []
 
             start_samples = self.sampler._total_samples
-            for i in count():
-                samples_now = self.sampler._total_samples
-                self._timestep = samples_now - start_samples
+            start_time = time.perf_counter()
+            if self._decoupled_sampling:
+                update_diagnostics = self._do_decoupled_sampling_and_training(
+                    start_samples)
+                gt.stamp('sample_and_train')
+            else:
+                for i in count():
+                    samples_now = self.sampler._total_samples
+                    self._timestep = samples_now - start_samples
 
-                if (samples_now >= start_samples + self._epoch_length
-                    and self.ready_to_train and len(update_diagnostics) > 0):
-                    break
+                    if (samples_now >= start_samples + self._epoch_length
+                        and self.ready_to_train and len(update_diagnostics) > 0):
+                        break
+
+                    self._timestep_before_hook()
+                    gt.stamp('timestep_before_hook')
 
-                self._timestep_before_hook()
-                gt.stamp('timestep_before_hook')
+                    self._do_sampling(timestep=self._total_timestep)
+                    gt.stamp('sample')
 
-                self._do_sampling(timestep=self._total_timestep)
-                gt.stamp('sample')
+                    if self.ready_to_train:
+                        repeat_diagnostics = self._do_training_repeats(timestep=self._total_timestep)
+                        if repeat_diagnostics is not None:
+                            update_diagnostics.append(repeat_diagnostics)
 
-                if self.ready_to_train:
-                    repeat_diagnostics = self._do_training_repeats(timestep=self._total_timestep)
-                    if repeat_diagnostics is not None:
-                        update_diagnostics.append(repeat_diagnostics)
+                    gt.stamp('train')
 
-                gt.stamp('train')
+                    self._do_perturbation_training()
+                    gt.stamp('perturbation_train')
 
-                self._timestep_after_hook()
-                gt.stamp('timestep_after_hook')
+                    self._timestep_after_hook()
+                    gt.stamp('timestep_after_hook')
+
+            elapsed_time = time.perf_counter() - start_time
+            samples_per_second = (
+                self.sampler._total_samples - start_samples) / elapsed_time
+            updates_per_second = self._train_steps_this_epoch / elapsed_time
 
             update_diagnostics = tree.map_structure(
                 lambda *d: np.mean(d), *update_diagnostics)
@@ -208,8 +301,14 @@ class RLAlgorithm(Checkpointable):
             training_paths = self.sampler.get_last_n_paths()
             self.sampler.clear_last_n_paths()
             gt.stamp('training_paths')
-            evaluation_paths = self._evaluation_paths(
-                self._evaluation_policy, evaluation_environment)
+            if self._num_evaluation_workers > 0:
+                # The workers evaluate while the next epoch trains.
+                _, previous_evaluation_metrics = self._collect_evaluation()
+                self._request_evaluation()
+                evaluation_paths = ()
+            else:
+                evaluation_paths = self._evaluation_paths(
+                    self._evaluation_policy, evaluation_environment)
             gt.stamp('evaluation_paths')
 
             training_metrics = self._evaluate_rollouts(
@@ -243,6 +342,10 @@ class RLAlgorithm(Checkpointable):
                 key: times[-1]
                 for key, times in gt.get_times().stamps.itrs.items()
             }
+            time_diagnostics.update((
+                ('samples_per_second', samples_per_second),
+                ('updates_per_second', updates_per_second),
+            ))
 
             # TODO(hartikainen/tf2): Fix the naming of training/update
             # diagnostics/metric
@@ -256,6 +359,7 @@ class RLAlgorithm(Checkpointable):
                 ('timestep', self._timestep),
                 ('total_timestep', self._total_timestep),
                 ('num_train_steps', self._num_train_steps),
+                ('num_traces', get_trace_counts()),
             ))
 
             if self._eval_render_kwargs and hasattr(
@@ -264,14 +368,115 @@ class RLAlgorithm(Checkpointable):
                 # need for the hasattr check.
                 training_environment.render_rollouts(evaluation_paths)
 
+            if self._num_evaluation_workers > 0:
+                # Each epoch is reported one epoch late, together with the
+                # evaluation it requested.
+                previous_diagnostics = self._unreported_diagnostics
+                self._unreported_diagnostics = diagnostics
+                if previous_diagnostics is None:
+                    continue
+                previous_diagnostics['evaluation'] = (
+                    previous_evaluation_metrics)
+                diagnostics = previous_diagnostics
+
             yield diagnostics
 
+        if self._num_evaluation_workers > 0:
+            if self._unreported_diagnostics is not None:
+                diagnostics = self._unreported_diagnostics
+                self._unreported_diagnostics = None
+                _, diagnostics['evaluation'] = self._collect_evaluation()
+                yield diagnostics
+            if self._evaluation_executor is not None:
+                self._evaluation_executor.shutdown()
+
         self.sampler.terminate()
 
         self._training_after_hook()
 
         yield {'done': True, **diagnostics}
 
+    def _do_decoupled_sampling_and_training(self, start_samples):
+        """Samples on a background thread while training on this one.
+
+        The learner trains in rounds of `_n_train_repeat` updates, as
+        `_do_training_repeats` does. It waits whenever another round would
+        get it more than `_max_update_to_data_ratio` (or
+        `_max_train_repeat_per_timestep`) updates per sample ahead of the
+        samples collected this epoch. The epoch ends once the sampler has
+        collected `_epoch_length` samples and the learner has done the rounds
+        owed for every `_train_every_n_steps` of them, within that maximum.
+        """
+        update_diagnostics = []
+        sampling_errors = []
+        sampling_done = threading.Event()
+
+        def sample_epoch():
+            try:
+                while (self.sampler._total_samples
+                       < start_samples + self._epoch_length):
+                    with self._pool_lock:
+                        self._timestep = (
+                            self.sampler._total_samples - start_samples)
+                        self._timestep_before_hook()
+                        self._do_sampling(timestep=self._total_timestep)
+                        self._timestep_after_hook()
+            except Exception as e:
+                sampling_errors.append(e)
+            finally:
+                sampling_done.set()
+
+        sampling_thread = threading.Thread(
+            target=sample_epoch, name='sampler', daemon=True)
+        sampling_thread.start()
+
+        max_updates_per_sample = min(
+            self._max_update_to_data_ratio,
+            self._max_train_repeat_per_timestep)
+
+        while not sampling_errors:
+            samples_this_epoch = self.sampler._total_samples - start_samples
+            if not self.ready_to_train:
+                if sampling_done.is_set():
+                    # Same as the coupled loop: keep sampling until the pool
+                    # is large enough to do at least one update.
+                    with self._pool_lock:
+                        self._do_sampling(timestep=self._total_timestep)
+                else:
+                    sampling_done.wait(timeout=1e-3)
+                continue
+
+            max_updates = max_updates_per_sample * samples_this_epoch
+            if sampling_done.is_set():
+                min_updates = min(
+                    max_updates,
+                    samples_this_epoch // self._train_every_n_steps
+                    * self._n_train_repeat)
+                if (self._train_steps_this_epoch >= min_updates
+                    and len(update_diagnostics) > 0):
+                    break
+            elif (self._train_steps_this_epoch + self._n_train_repeat
+                  > max_updates):
+                sampling_done.wait(timeout=1e-3)
+                continue
+
+            update_diagnostics.append(self._do_training_round(
+                timestep=self._total_timestep, pool_lock=self._pool_lock))
+
+            if self._has_perturbation_training:
+                gt.stamp('sample_and_train')
+                with self._pool_lock:
+                    self._do_perturbation_training()
+                gt.stamp('perturbation_train')
+
+        sampling_thread.join()
+        if sampling_errors:
+            raise sampling_errors[0]
+
+        self._timestep = self.sampler._total_samples - start_samples
+
+        return update_diagnostics
+
     def _evaluation_paths(self, policy, evaluation_env):
         if self._eval_n_episodes < 1: return ()
 
@@ -298,11 +503,107 @@ class RLAlgorithm(Checkpointable):
 
         return paths
 
+    def _get_evaluation_workers(self):
+        if self._evaluation_workers is not None:
+            return self._evaluation_workers
+
+        environments = []
+        if self._evaluation_environment is not self._training_environment:
+            environments.append(self._evaluation_environment)
+        if self._evaluation_environment_fn is not None:
+            environments += [
+                self._evaluation_environment_fn()
+                for _ in range(self._num_evaluation_workers - len(environments))
+            ]
+        if not environments:
+            raise ValueError(
+                "Parallel evaluation needs an evaluation environment separate"
+                " from the training environment or an"
+                " evaluation_environment_fn.")
+
+        # Every worker rolls out its own copy of the policy so that the
+        # weights it evaluates stay fixed while training continues.
+        policy_config = policies.serialize(self._evaluation_policy)
+        self._evaluation_workers = [
+            (environment, policies.get(policy_config))
+            for environment in environments
+        ]
+        self._evaluation_executor = ThreadPoolExecutor(
+            max_workers=len(self._evaluation_workers),
+            thread_name_prefix='evaluation')
+
+        return self._evaluation_workers
+
+    def _evaluate_on_worker(self, environment, policy, n_episodes):
+        return rollouts(
+            n_episodes,
+            environment,
+            policy,
+            self.sampler._max_path_length)
+
+    def _request_evaluation(self):
+        """Starts evaluating a snapshot of the current evaluation policy.
+
+        Environments that evaluate with learned models of their own, e.g. a
+        grasp model, snapshot them through `snapshot_models`, so that the
+        workers don't read them while they're trained.
+        """
+        if self._eval_n_episodes < 1: return
+
+        workers = self._get_evaluation_workers()
+        policy_weights = self._evaluation_policy.get_weights()
+
+        futures = []
+        for i, (environment, policy) in enumerate(workers):
+            n_episodes = len(range(i, self._eval_n_episodes, len(workers)))
+            if n_episodes < 1: continue
+            policy.set_weights(policy_weights)
+            if hasattr(environment, 'snapshot_models'):
+                environment.snapshot_models()
+            futures.append(self._evaluation_executor.submit(
+                self._evaluate_on_worker,
+                environment,
+                policy,
+                n_episodes))
+
+        self._pending_evaluation = (
+            self._epoch, self._total_timestep, workers[0], futures)
+
+    def _collect_evaluation(self):
+        """Waits for the last requested evaluation and returns its results."""
+        if self._pending_evaluation is None:
+            return (), {}
+
+        epoch, timestep, (environment, policy), futures = (
+            self._pending_evaluation)
+        self._pending_evaluation = None
+
+        paths = [
+            path for future in futures for path in future.result()
+        ]
+
+        # The infos are summarized once over the paths of all workers, so
+        # that sums, extrema and per-episode means stay exact.
+        environment_infos = environment.get_path_infos(
+            paths, timestep, evaluation_type='evaluation', policy=policy)
+
+        evaluation_metrics = self._evaluate_rollouts(
+            paths,
+            None,
+            timestep,
+            evaluation_type='evaluation',
+            environment_infos=environment_infos)
+        evaluation_metrics['epoch'] = epoch
+        evaluation_metrics['total_timestep'] = timestep
+
+        return paths, evaluation_metrics
+
     def _evaluate_rollouts(self,
                            episodes,
                            environment,
                            timestep,
-                           evaluation_type=None):
+                           evaluation_type=None,
+                           environment_infos=None):
         """Compute evaluation metrics for the given rollouts."""
 
         episodes_rewards = [episode['rewards'] for episode in episodes]
@@ -322,8 +623,9 @@ class RLAlgorithm(Checkpointable):
             ('episode-length-std', np.std(episodes_length)),
         ))
 
-        environment_infos = environment.get_path_infos(
-            episodes, timestep, evaluation_type=evaluation_type)
+        if environment_infos is None:
+            environment_infos = environment.get_path_infos(
+                episodes, timestep, evaluation_type=evaluation_type)
         diagnostics['environment_infos'] = environment_infos
 
         return diagnostics
@@ -343,6 +645,19 @@ class RLAlgorithm(Checkpointable):
     def _do_sampling(self, timestep):
         self.sampler.sample()
 
+    @property
+    def _has_perturbation_training(self):
+        return hasattr(
+            getattr(self, '_training_environment', None),
+            'train_perturbations')
+
+    def _do_perturbation_training(self):
+        """Runs the train steps owed to the training environment's
+        perturbation learners, outside of the environment step."""
+        if not self._has_perturbation_training:
+            return 0
+        return self._training_environment.train_perturbations()
+
     def _do_training_repeats(self, timestep):
         """Repeat training _n_train_repeat times every _train_every_n_steps"""
         if timestep % self._train_every_n_steps > 0: return
@@ -351,13 +666,35 @@ class RLAlgorithm(Checkpointable):
             > self._max_train_repeat_per_timestep * self._timestep)
         if trained_enough: return
 
-        diagnostics = [
-            self._do_training(iteration=timestep, batch=self._training_batch())
-            for i in range(self._n_train_repeat)
-        ]
+        return self._do_training_round(timestep)
 
-        diagnostics = tree.map_structure(
-            lambda *d: tf.reduce_mean(d).numpy(), *diagnostics)
+    def _do_training_round(self, timestep, pool_lock=None):
+        """Runs the `_n_train_repeat` updates of one training step.
+
+        Args:
+            pool_lock: If given, held while the training batches are sampled.
+        """
+        pool_lock = pool_lock or contextlib.nullcontext()
+
+        if self._batched_train_repeats:
+            with pool_lock:
+                batch = self._stacked_training_batch(self._n_train_repeat)
+            diagnostics = self._do_batched_training(
+                iteration=timestep,
+                batch=batch,
+                num_batches=self._n_train_repeat)
+            diagnostics = tree.map_structure(
+                lambda d: np.mean(d), diagnostics)
+        else:
+            diagnostics = []
+            for i in range(self._n_train_repeat):
+                with pool_lock:
+                    batch = self._training_batch()
+                diagnostics.append(
+                    self._do_training(iteration=timestep, batch=batch))
+
+            diagnostics = tree.map_structure(
+                lambda *d: tf.reduce_mean(d).numpy(), *diagnostics)
 
         self._num_train_steps += self._n_train_repeat
         self._train_steps_this_epoch += self._n_train_repeat
@@ -368,6 +705,12 @@ class RLAlgorithm(Checkpointable):
     def _do_training(self, iteration, batch):
         raise NotImplementedError
 
+    def _do_batched_training(self, iteration, batch, num_batches):
+        """Trains on `num_batches` equally sized batches, concatenated in
+        `batch`, as `num_batches` consecutive `_do_training` calls would."""
+        raise NotImplementedError(
+            f"{type(self).__name__} doesn't support batched_train_repeats.")
+
     def _init_training(self):
         pass
 
@@ -0,0 +1,260 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from softlearning.algorithms.rl_algorithm import RLAlgorithm
+
+
+class StubPolicy:
+    def __init__(self):
+        self.version = 0
+
+    def get_weights(self):
+        return [self.version]
+
+    def set_weights(self, weights):
+        self.version, = weights
+
+
+class StubEnvironment:
+    """Grasps with the training environment's model, or with a snapshot."""
+    def __init__(self, training_environment=None):
+        self.training_environment = training_environment
+        self.model_version = 0
+        self.snapshot_model_version = None
+
+    @property
+    def evaluation_model_version(self):
+        if self.snapshot_model_version is not None:
+            return self.snapshot_model_version
+        return self.training_environment.model_version
+
+    def snapshot_models(self):
+        self.snapshot_model_version = (
+            self.training_environment.model_version)
+
+    def get_path_infos(self, paths, timestep, evaluation_type=None,
+                       policy=None):
+        return OrderedDict((('num_paths', len(paths)), ))
+
+
+class OwnedLock:
+    """A lock that knows which thread holds it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owner = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._owner = threading.get_ident()
+
+    def __exit__(self, *args):
+        self._owner = None
+        self._lock.release()
+
+    def held(self):
+        return self._owner == threading.get_ident()
+
+
+class StubSampler:
+    _max_path_length = 2
+
+    def __init__(self, sample_time=0.0, fail_at=None):
+        self._total_samples = 0
+        self.sample_time = sample_time
+        self.fail_at = fail_at
+        self.pool_lock = None
+        self.sampled_without_lock = False
+
+    def sample(self):
+        if self.pool_lock is not None and not self.pool_lock.held():
+            self.sampled_without_lock = True
+        if self._total_samples == self.fail_at:
+            raise RuntimeError("sampling failed")
+        time.sleep(self.sample_time)
+        self._total_samples += 1
+
+    def get_last_n_paths(self):
+        return [{'rewards': np.ones(2)}]
+
+    def clear_last_n_paths(self):
+        pass
+
+    def get_diagnostics(self):
+        return OrderedDict()
+
+    def terminate(self):
+        pass
+
+
+class StubPool:
+    size = 100
+
+    def __init__(self):
+        self.pool_lock = None
+        self.read_without_lock = False
+
+    def random_batch(self, batch_size):
+        if self.pool_lock is not None and not self.pool_lock.held():
+            self.read_without_lock = True
+        return {'observations': np.zeros((batch_size, 1), np.float32)}
+
+
+class StubAlgorithm(RLAlgorithm):
+    """Every update advances the policy and the environment's model."""
+    def __init__(self, sampler=None, **kwargs):
+        self._training_environment = StubEnvironment()
+        self._evaluation_environment = StubEnvironment(
+            self._training_environment)
+        self._policy = StubPolicy()
+        self.epoch_end_versions = []
+        self.update_to_data_ratios = []
+
+        super(StubAlgorithm, self).__init__(
+            pool=StubPool(), sampler=sampler or StubSampler(), **kwargs)
+
+    def _do_training(self, iteration, batch):
+        self.update_to_data_ratios.append(
+            (self._num_train_steps + 1) / self.sampler._total_samples)
+        self._policy.version += 1
+        self._training_environment.model_version += 1
+        return OrderedDict((('loss', 0.0), ))
+
+    def _epoch_after_hook(self, *args, **kwargs):
+        self.epoch_end_versions.append(self._policy.version)
+
+    def _get_evaluation_workers(self):
+        if self._evaluation_workers is None:
+            self._evaluation_workers = [
+                (self._evaluation_environment, StubPolicy())]
+            self._evaluation_executor = ThreadPoolExecutor(max_workers=1)
+        return self._evaluation_workers
+
+    def _evaluate_on_worker(self, environment, policy, n_episodes):
+        # Gives training the time to move on while the worker evaluates.
+        time.sleep(0.05)
+        return [
+            {
+                'rewards': np.full(
+                    2, float(policy.version), dtype=np.float32),
+                'model_version': environment.evaluation_model_version,
+            }
+            for _ in range(n_episodes)
+        ]
+
+    def get_diagnostics(self, *args, **kwargs):
+        return OrderedDict()
+
+
+class ParallelEvaluationTest(unittest.TestCase):
+    def setUp(self):
+        self.algorithm = StubAlgorithm(
+            n_epochs=3,
+            epoch_length=5,
+            eval_n_episodes=2,
+            num_evaluation_workers=1)
+
+    def test_each_epoch_reports_its_own_evaluation(self):
+        results = list(self.algorithm.train())
+
+        self.assertTrue(results[-1]['done'])
+        epoch_results = results[:-1]
+        self.assertEqual(
+            [result['epoch'] for result in epoch_results], [0, 1, 2])
+        for result, version in zip(
+                epoch_results, self.algorithm.epoch_end_versions):
+            evaluation = result['evaluation']
+            self.assertEqual(evaluation['epoch'], result['epoch'])
+            self.assertEqual(
+                evaluation['total_timestep'], result['total_timestep'])
+            # Two steps of reward `version` per episode.
+            self.assertEqual(evaluation['episode-reward-mean'], 2 * version)
+            self.assertEqual(
+                evaluation['environment_infos']['num_paths'], 2)
+
+        self.assertEqual(
+            results[-1]['evaluation'], epoch_results[-1]['evaluation'])
+
+    def test_workers_evaluate_snapshots(self):
+        self.algorithm._epoch = 0
+        self.algorithm._timestep = 0
+        self.algorithm._policy.version = 3
+        self.algorithm._training_environment.model_version = 3
+        self.algorithm._request_evaluation()
+
+        # Training continues while the worker evaluates.
+        self.algorithm._policy.version = 4
+        self.algorithm._training_environment.model_version = 4
+
+        paths, metrics = self.algorithm._collect_evaluation()
+        self.assertEqual(metrics['episode-reward-mean'], 6)
+        self.assertEqual([path['model_version'] for path in paths], [3, 3])
+        self.algorithm._evaluation_executor.shutdown()
+
+
+class DecoupledSamplingTest(unittest.TestCase):
+    def _create_algorithm(self, sampler, **kwargs):
+        algorithm = StubAlgorithm(
+            sampler=sampler,
+            n_epochs=2,
+            epoch_length=20,
+            n_train_repeat=2,
+            decoupled_sampling=True,
+            **kwargs)
+        algorithm._pool_lock = OwnedLock()
+        algorithm.sampler.pool_lock = algorithm._pool_lock
+        algorithm.pool.pool_lock = algorithm._pool_lock
+        return algorithm
+
+    def _sampler_threads(self):
+        return [
+            thread for thread in threading.enumerate()
+            if thread.name == 'sampler'
+        ]
+
+    def test_trains_at_the_update_to_data_ratio(self):
+        algorithm = self._create_algorithm(StubSampler(sample_time=1e-3))
+        results = list(algorithm.train())
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(algorithm.sampler._total_samples, 40)
+        # 2 updates per sample, none of them ahead of the samples.
+        self.assertEqual(algorithm._num_train_steps, 80)
+        self.assertLessEqual(max(algorithm.update_to_data_ratios), 2)
+
+    def test_holds_pool_lock(self):
+        algorithm = self._create_algorithm(StubSampler(sample_time=1e-3))
+        list(algorithm.train())
+
+        self.assertFalse(algorithm.sampler.sampled_without_lock)
+        self.assertFalse(algorithm.pool.read_without_lock)
+
+    def test_holds_pool_lock_with_batched_train_repeats(self):
+        algorithm = self._create_algorithm(
+            StubSampler(sample_time=1e-3), batched_train_repeats=True)
+        algorithm._do_batched_training = (
+            lambda iteration, batch, num_batches: OrderedDict((
+                ('loss', 0.0), )))
+        list(algorithm.train())
+
+        self.assertFalse(algorithm.pool.read_without_lock)
+
+    def test_sampler_thread_exits(self):
+        algorithm = self._create_algorithm(StubSampler(sample_time=1e-3))
+        list(algorithm.train())
+        self.assertFalse(self._sampler_threads())
+
+    def test_sampling_error_is_raised(self):
+        algorithm = self._create_algorithm(
+            StubSampler(sample_time=1e-3, fail_at=5))
+        with self.assertRaisesRegex(RuntimeError, "sampling failed"):
+            list(algorithm.train())
+        self.assertFalse(self._sampler_threads())
+
+
+if __name__ == '__main__':
+    unittest.main()
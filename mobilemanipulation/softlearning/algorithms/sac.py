@@ -7,9 +7,19 @@ import pprint
 import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
+import tree
 
 from softlearning.environments.gym.spaces import *
+from softlearning.utils.tensorflow import (
+    compiled_function,
+    compute_gradients,
+    loss_scale_optimizer,
+    masked_average_loss,
+    repeat_updates)
 from softlearning.utils.gym import is_continuous_space, is_discrete_space
+from softlearning.preprocessors import (
+    exclude_shared_variables, shared_features, shared_variables)
+from softlearning.value_functions import ValueFunctionEnsemble
 from .rl_algorithm import RLAlgorithm
 
 
@@ -76,6 +86,7 @@ class SAC(RLAlgorithm):
             discount=0.99,
             tau=5e-3,
             target_update_interval=1,
+            fused_critic=False,
 
             save_full_state=False,
             **kwargs,
@@ -94,6 +105,9 @@ class SAC(RLAlgorithm):
             tau (`float`): Soft value function target update weight.
             target_update_interval ('int'): Frequency at which target network
                 updates occur in iterations.
+            fused_critic (`bool`): If True, all Q-functions are evaluated as
+                one `ValueFunctionEnsemble`, whose dense heads run as one
+                batched matmul per layer.
         """
 
         super(SAC, self).__init__(**kwargs)
@@ -116,6 +130,7 @@ class SAC(RLAlgorithm):
             discount=discount,
             tau=tau,
             target_update_interval=target_update_interval,
+            fused_critic=fused_critic,
 
             save_full_state=save_full_state,
             kwargs=kwargs,
@@ -125,11 +140,27 @@ class SAC(RLAlgorithm):
         self._training_environment = training_environment
         self._evaluation_environment = evaluation_environment
         self._policy = policy
+        # A shared image encoder is trained by the first Q-function's
+        # optimizer on the sum of the critic losses, the other heads only
+        # see its features.
+        self._policy_trainable_variables = exclude_shared_variables(
+            self._policy.trainable_variables)
 
         self._Qs = Qs
+        self._Qs_trainable_variables = tuple(
+            exclude_shared_variables(Q.trainable_variables) for Q in self._Qs)
+        self._Q_shared_variables = shared_variables(
+            self._Qs[0].trainable_variables)
         self._Q_targets = tuple(deepcopy(Q) for Q in Qs)
         self._update_target(tau=tf.constant(1.0))
 
+        self._fused_critic = fused_critic
+        if self._fused_critic:
+            self._Q_ensemble = ValueFunctionEnsemble(
+                self._Qs, name='Q_ensemble')
+            self._Q_target_ensemble = ValueFunctionEnsemble(
+                self._Q_targets, name='Q_target_ensemble')
+
         self._plotter = plotter
 
         self._policy_lr = policy_lr
@@ -149,14 +180,14 @@ class SAC(RLAlgorithm):
         self._save_full_state = save_full_state
 
         self._Q_optimizers = tuple(
-            tf.optimizers.Adam(
+            loss_scale_optimizer(tf.optimizers.Adam(
                 learning_rate=self._Q_lr,
                 name=f'Q_{i}_optimizer'
-            ) for i, Q in enumerate(self._Qs))
+            )) for i, Q in enumerate(self._Qs))
 
-        self._policy_optimizer = tf.optimizers.Adam(
+        self._policy_optimizer = loss_scale_optimizer(tf.optimizers.Adam(
             learning_rate=self._policy_lr,
-            name="policy_optimizer")
+            name="policy_optimizer"))
 
         self._log_alpha = tf.Variable(0.0, name='log_alpha')
         self._alpha = tfp.util.DeferredTensor(self._log_alpha, tf.exp)
@@ -178,8 +209,13 @@ class SAC(RLAlgorithm):
 
         next_actions, next_log_pis = self._policy.actions_and_log_probs(
             next_observations)
-        next_Qs_values = tuple(
-            Q.values(next_observations, next_actions) for Q in self._Q_targets)
+        if self._fused_critic:
+            next_Qs_values = self._Q_target_ensemble.values(
+                next_observations, next_actions)
+        else:
+            next_Qs_values = tuple(
+                Q.values(next_observations, next_actions)
+                for Q in self._Q_targets)
         next_Q_values = tf.reduce_min(next_Qs_values, axis=0)
 
         Q_targets = compute_Q_targets(
@@ -212,18 +248,63 @@ class SAC(RLAlgorithm):
 
         tf.debugging.assert_shapes(((Q_targets, ('B', 1)), (rewards, ('B', 1))))
 
+        if self._fused_critic:
+            with shared_features():
+                return self._update_critic_ensemble(
+                    observations, actions, Q_targets, batch.get('mask'))
+
         Qs_values = []
         Qs_losses = []
-        for Q, optimizer in zip(self._Qs, self._Q_optimizers):
-            with tf.GradientTape() as tape:
+        Q_loss_means = []
+        # One tape for all the Q-functions, so that a shared encoder runs
+        # once and is trained on the sum of their losses.
+        with tf.GradientTape(persistent=True) as tape, shared_features():
+            for Q in self._Qs:
                 Q_values = Q.values(observations, actions)
                 Q_losses = 0.5 * tf.losses.MSE(y_true=Q_targets, y_pred=Q_values)
-                Q_loss = tf.nn.compute_average_loss(Q_losses)
+                Q_loss_means.append(masked_average_loss(
+                    Q_losses, batch.get('mask')))
+                Qs_losses.append(Q_losses)
+                Qs_values.append(Q_values)
+
+        for i, (Q_loss, variables, optimizer) in enumerate(zip(
+                Q_loss_means, self._Qs_trainable_variables, self._Q_optimizers)):
+            gradients = compute_gradients(tape, Q_loss, variables, optimizer)
+            if i == 0 and self._Q_shared_variables:
+                variables = variables + self._Q_shared_variables
+                gradients = gradients + compute_gradients(
+                    tape, tf.add_n(Q_loss_means), self._Q_shared_variables,
+                    optimizer)
+            optimizer.apply_gradients(zip(gradients, variables))
+        del tape
 
-            gradients = tape.gradient(Q_loss, Q.trainable_variables)
-            optimizer.apply_gradients(zip(gradients, Q.trainable_variables))
-            Qs_losses.append(Q_losses)
-            Qs_values.append(Q_values)
+        return Qs_values, Qs_losses
+
+    def _update_critic_ensemble(self, observations, actions, Q_targets, mask):
+        """Update all Q-functions from one batched ensemble evaluation.
+
+        Each Q-function is still updated by its own optimizer on its own
+        loss, as in the unfused update.
+        """
+        with tf.GradientTape(persistent=True) as tape:
+            Qs_values = self._Q_ensemble.values(observations, actions)
+            Qs_losses = 0.5 * tf.losses.MSE(
+                y_true=Q_targets[tf.newaxis], y_pred=Qs_values)
+            Q_loss_means = [
+                masked_average_loss(Q_losses, mask)
+                for Q_losses in tf.unstack(Qs_losses, num=len(self._Qs))
+            ]
+
+        for i, (Q_loss, variables, optimizer) in enumerate(zip(
+                Q_loss_means, self._Qs_trainable_variables, self._Q_optimizers)):
+            gradients = compute_gradients(tape, Q_loss, variables, optimizer)
+            if i == 0 and self._Q_shared_variables:
+                variables = variables + self._Q_shared_variables
+                gradients = gradients + compute_gradients(
+                    tape, tf.add_n(Q_loss_means), self._Q_shared_variables,
+                    optimizer)
+            optimizer.apply_gradients(zip(gradients, variables))
+        del tape
 
         return Qs_values, Qs_losses
 
@@ -240,15 +321,19 @@ class SAC(RLAlgorithm):
         """
         observations = batch['observations']
 
-        with tf.GradientTape() as tape:
+        with tf.GradientTape() as tape, shared_features():
             actions, log_pis = self._policy.actions_and_log_probs(observations)
 
-            Qs_log_targets = tuple(
-                Q.values(observations, actions) for Q in self._Qs)
+            if self._fused_critic:
+                Qs_log_targets = self._Q_ensemble.values(observations, actions)
+            else:
+                Qs_log_targets = tuple(
+                    Q.values(observations, actions) for Q in self._Qs)
             Q_log_targets = tf.reduce_min(Qs_log_targets, axis=0)
 
             policy_losses = self._alpha * log_pis - Q_log_targets
-            policy_loss = tf.nn.compute_average_loss(policy_losses)
+            policy_loss = masked_average_loss(
+                policy_losses, batch.get('mask'))
 
         tf.debugging.assert_shapes((
             (actions, ('B', 'nA')),
@@ -256,9 +341,11 @@ class SAC(RLAlgorithm):
             (policy_losses, ('B', 1)),
         ))
 
-        policy_gradients = tape.gradient(policy_loss, self._policy.trainable_variables)
+        policy_gradients = compute_gradients(
+            tape, policy_loss, self._policy_trainable_variables,
+            self._policy_optimizer)
 
-        self._policy_optimizer.apply_gradients(zip(policy_gradients, self._policy.trainable_variables))
+        self._policy_optimizer.apply_gradients(zip(policy_gradients, self._policy_trainable_variables))
 
         return policy_losses
 
@@ -277,7 +364,8 @@ class SAC(RLAlgorithm):
             # NOTE(hartikainen): It's important that we take the average here,
             # otherwise we end up effectively having `batch_size` times too
             # large learning rate.
-            alpha_loss = tf.nn.compute_average_loss(alpha_losses)
+            alpha_loss = masked_average_loss(
+                alpha_losses, batch.get('mask'))
 
         alpha_gradients = tape.gradient(alpha_loss, [self._log_alpha])
         self._alpha_optimizer.apply_gradients(zip(alpha_gradients, [self._log_alpha]))
@@ -292,9 +380,33 @@ class SAC(RLAlgorithm):
                 target_weight.assign(
                     tau * source_weight + (1.0 - tau) * target_weight)
 
-    @tf.function(experimental_relax_shapes=True)
+    @compiled_function
     def _do_updates(self, batch):
         """Runs the update operations for policy, Q, and alpha."""
+        return self._updates(batch)
+
+    @compiled_function
+    def _do_repeated_updates(self, batches, update_target):
+        """Runs `_updates` on each of the stacked `batches` in one loop."""
+        def update_fn(batch):
+            diagnostics = self._updates(batch)
+            if update_target:
+                self._update_target(tau=tf.constant(self._tau))
+            return diagnostics
+
+        return repeat_updates(
+            update_fn, batches, self._update_diagnostic_keys)
+
+    # The keys of the diagnostics returned by `_updates`.
+    _update_diagnostic_keys = (
+        'Q_value-mean',
+        'Q_loss-mean',
+        'policy_loss-mean',
+        'alpha',
+        'alpha_loss-mean',
+    )
+
+    def _updates(self, batch):
         Qs_values, Qs_losses = self._update_critic(batch)
         policy_losses = self._update_actor(batch)
         alpha_losses = self._update_alpha(batch)
@@ -325,6 +437,21 @@ class SAC(RLAlgorithm):
 
         return diagnostics
 
+    def _do_batched_training(self, iteration, batch, num_batches):
+        diagnostics = OrderedDict()
+
+        if self._should_process_batch:
+            process_batch_diagnostics = self._training_environment.process_batch(batch)
+            diagnostics.update(process_batch_diagnostics)
+
+        batches = tree.map_structure(
+            lambda x: np.reshape(x, (num_batches, -1, *x.shape[1:])), batch)
+        training_diagnostics = self._do_repeated_updates(
+            batches, update_target=iteration % self._target_update_interval == 0)
+        diagnostics.update(training_diagnostics)
+
+        return diagnostics
+
     def get_diagnostics(self,
                         iteration,
                         batch,
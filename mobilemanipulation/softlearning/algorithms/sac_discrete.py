@@ -7,8 +7,17 @@ import pprint
 import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
+import tree
 
 from softlearning.environments.gym.spaces import *
+from softlearning.utils.tensorflow import (
+    compiled_function,
+    compute_gradients,
+    loss_scale_optimizer,
+    masked_average_loss,
+    repeat_updates)
+from softlearning.preprocessors import (
+    exclude_shared_variables, shared_features, shared_variables)
 from .rl_algorithm import RLAlgorithm
 
 
@@ -99,8 +108,17 @@ class SACDiscrete(RLAlgorithm):
         self._training_environment = training_environment
         self._evaluation_environment = evaluation_environment
         self._policy = policy
+        # A shared image encoder is trained by the first Q-function's
+        # optimizer on the sum of the critic losses, the other heads only
+        # see its features.
+        self._policy_trainable_variables = exclude_shared_variables(
+            self._policy.trainable_variables)
 
         self._Qs = Qs
+        self._Qs_trainable_variables = tuple(
+            exclude_shared_variables(Q.trainable_variables) for Q in self._Qs)
+        self._Q_shared_variables = shared_variables(
+            self._Qs[0].trainable_variables)
         self._Q_targets = tuple(deepcopy(Q) for Q in Qs)
         self._update_target(tau=tf.constant(1.0))
 
@@ -139,14 +157,14 @@ class SACDiscrete(RLAlgorithm):
         self._save_full_state = save_full_state
 
         self._Q_optimizers = tuple(
-            tf.optimizers.Adam(
+            loss_scale_optimizer(tf.optimizers.Adam(
                 learning_rate=self._Q_lr,
                 name=f'Q_{i}_optimizer'
-            ) for i, Q in enumerate(self._Qs))
+            )) for i, Q in enumerate(self._Qs))
 
-        self._policy_optimizer = tf.optimizers.Adam(
+        self._policy_optimizer = loss_scale_optimizer(tf.optimizers.Adam(
             learning_rate=self._policy_lr,
-            name="policy_optimizer")
+            name="policy_optimizer"))
 
         self._log_alpha = tf.Variable(0.0, name='log_alpha')
         self._alpha = tfp.util.DeferredTensor(self._log_alpha, tf.exp)
@@ -207,8 +225,11 @@ class SACDiscrete(RLAlgorithm):
 
         Qs_values = []
         Qs_losses = []
-        for Q, optimizer in zip(self._Qs, self._Q_optimizers):
-            with tf.GradientTape() as tape:
+        Q_loss_means = []
+        # One tape for all the Q-functions, so that a shared encoder runs
+        # once and is trained on the sum of their losses.
+        with tf.GradientTape(persistent=True) as tape, shared_features():
+            for Q in self._Qs:
                 all_Q_values = Q.values(observations)
                 print(all_Q_values)
                 # Q_values = tf.gather_nd(all_Q_values, index_row_col)[..., tf.newaxis]
@@ -216,13 +237,22 @@ class SACDiscrete(RLAlgorithm):
                 print(Q_values)
                 # Q_losses = 0.5 * tf.losses.MSE(y_true=Q_targets, y_pred=Q_values)
                 Q_losses = tf.nn.sigmoid_cross_entropy_with_logits(labels=rewards, logits=Q_values)
-                Q_loss = tf.nn.compute_average_loss(Q_losses)
-
-            gradients = tape.gradient(Q_loss, Q.trainable_variables)
-            optimizer.apply_gradients(zip(gradients, Q.trainable_variables))
-            Qs_losses.append(Q_losses)
-            # Qs_values.append(Q_values)
-            Qs_values.append(tf.math.sigmoid(Q_values))
+                Q_loss_means.append(masked_average_loss(
+                    Q_losses, batch.get('mask')))
+                Qs_losses.append(Q_losses)
+                # Qs_values.append(Q_values)
+                Qs_values.append(tf.math.sigmoid(Q_values))
+
+        for i, (Q_loss, variables, optimizer) in enumerate(zip(
+                Q_loss_means, self._Qs_trainable_variables, self._Q_optimizers)):
+            gradients = compute_gradients(tape, Q_loss, variables, optimizer)
+            if i == 0 and self._Q_shared_variables:
+                variables = variables + self._Q_shared_variables
+                gradients = gradients + compute_gradients(
+                    tape, tf.add_n(Q_loss_means), self._Q_shared_variables,
+                    optimizer)
+            optimizer.apply_gradients(zip(gradients, variables))
+        del tape
 
         return Qs_values, Qs_losses
 
@@ -239,7 +269,7 @@ class SACDiscrete(RLAlgorithm):
         """
         observations = batch['observations']
 
-        with tf.GradientTape() as tape:
+        with tf.GradientTape() as tape, shared_features():
             probs, log_probs = self._policy.probs_and_log_probs(observations)
 
             Qs_targets = tuple(Q.values(observations) for Q in self._Qs)
@@ -248,7 +278,8 @@ class SACDiscrete(RLAlgorithm):
             Q_targets = tf.nn.sigmoid(Q_targets)
 
             policy_losses = tf.reduce_sum(probs * (self._alpha * log_probs - Q_targets), axis=-1, keepdims=True)
-            policy_loss = tf.nn.compute_average_loss(policy_losses)
+            policy_loss = masked_average_loss(
+                policy_losses, batch.get('mask'))
 
         tf.debugging.assert_shapes((
             # (actions, ('B', 'nA')),
@@ -256,9 +287,11 @@ class SACDiscrete(RLAlgorithm):
             (policy_losses, ('B', 1)),
         ))
 
-        policy_gradients = tape.gradient(policy_loss, self._policy.trainable_variables)
+        policy_gradients = compute_gradients(
+            tape, policy_loss, self._policy_trainable_variables,
+            self._policy_optimizer)
 
-        self._policy_optimizer.apply_gradients(zip(policy_gradients, self._policy.trainable_variables))
+        self._policy_optimizer.apply_gradients(zip(policy_gradients, self._policy_trainable_variables))
 
         return policy_losses
 
@@ -275,7 +308,8 @@ class SACDiscrete(RLAlgorithm):
             alpha_losses = self._alpha * tf.stop_gradient(
                 -tf.reduce_sum(probs * log_probs, axis=-1, keepdims=True) - target_entropy)
 
-            alpha_loss = tf.nn.compute_average_loss(alpha_losses)
+            alpha_loss = masked_average_loss(
+                alpha_losses, batch.get('mask'))
 
         alpha_gradients = tape.gradient(alpha_loss, [self._log_alpha])
         self._alpha_optimizer.apply_gradients(zip(alpha_gradients, [self._log_alpha]))
@@ -290,9 +324,34 @@ class SACDiscrete(RLAlgorithm):
                 target_weight.assign(
                     tau * source_weight + (1.0 - tau) * target_weight)
 
-    @tf.function(experimental_relax_shapes=True)
+    @compiled_function
     def _do_updates(self, batch, target_entropy):
         """Runs the update operations for policy, Q, and alpha."""
+        return self._updates(batch, target_entropy)
+
+    @compiled_function
+    def _do_repeated_updates(self, batches, target_entropy, update_target):
+        """Runs `_updates` on each of the stacked `batches` in one loop."""
+        def update_fn(batch):
+            diagnostics = self._updates(batch, target_entropy)
+            if update_target:
+                self._update_target(tau=tf.constant(self._tau))
+            return diagnostics
+
+        return repeat_updates(
+            update_fn, batches, self._update_diagnostic_keys)
+
+    # The keys of the diagnostics returned by `_updates`.
+    _update_diagnostic_keys = (
+        'Q_value-mean',
+        'Q_loss-mean',
+        'policy_loss-mean',
+        'alpha',
+        'alpha_loss-mean',
+        'target_entropy',
+    )
+
+    def _updates(self, batch, target_entropy):
         Qs_values, Qs_losses = self._update_critic(batch)
         policy_losses = self._update_actor(batch)
         alpha_losses = self._update_alpha(batch, target_entropy)
@@ -308,12 +367,14 @@ class SACDiscrete(RLAlgorithm):
 
         return diagnostics
 
-    def _do_training(self, iteration, batch):
-        # updates entropy ratio
+    def _update_entropy_ratio(self, iteration):
         iterations_ratio = min(iteration / self._entropy_timesteps, 1.0)
         ratio_difference = self._entropy_ratio_start - self._entropy_ratio_end
         self._entropy_ratio_current = self._entropy_ratio_start - iterations_ratio * ratio_difference
 
+    def _do_training(self, iteration, batch):
+        self._update_entropy_ratio(iteration)
+
         training_diagnostics = self._do_updates(batch, tf.constant(self._target_entropy, dtype=tf.float32))
 
         if iteration % self._target_update_interval == 0:
@@ -322,6 +383,18 @@ class SACDiscrete(RLAlgorithm):
 
         return training_diagnostics
 
+    def _do_batched_training(self, iteration, batch, num_batches):
+        self._update_entropy_ratio(iteration)
+
+        batches = tree.map_structure(
+            lambda x: np.reshape(x, (num_batches, -1, *x.shape[1:])), batch)
+        training_diagnostics = self._do_repeated_updates(
+            batches,
+            tf.constant(self._target_entropy, dtype=tf.float32),
+            update_target=iteration % self._target_update_interval == 0)
+
+        return training_diagnostics
+
     def get_diagnostics(self,
                         iteration,
                         batch,
@@ -8,12 +8,13 @@ import tree
 
 from .utils import dprint, is_in_rect, Timer
 from .base_envs import RoomEnv
-from .perturbations import get_perturbation, get_perturbation_use_rnd
+from .perturbations import get_perturbation, get_perturbation_use_rnd, PerturbationTrainer
 from .grasping import get_grasp_algorithm, GraspingEval
 
 from softlearning.environments.gym.spaces import DiscreteBox, FrameStack
 
 from softlearning.utils.dict import deep_update
+from softlearning.replay_pools.bonus_cache import BonusCache, bonus_fields
 
 
 IMAGE_SIZE = 100
@@ -42,6 +43,8 @@ class LocobotNavigationGraspingDualPerturbationEnv(RoomEnv):
             use_shared_data=False,
             use_auto_grasp=True,
             add_uncertainty_bonus=False,
+            bonus_refresh_interval=100,
+            bonus_max_staleness=10000,
             no_respawn_eval_len=200,
         )
         defaults["random_robot_yaw"] = False
@@ -60,6 +63,8 @@ class LocobotNavigationGraspingDualPerturbationEnv(RoomEnv):
         self.use_auto_grasp = self.params["use_auto_grasp"]
         self.use_shared_data = self.params["use_shared_data"]
         self.add_uncertainty_bonus = self.params["add_uncertainty_bonus"]
+        self.bonus_refresh_interval = self.params["bonus_refresh_interval"]
+        self.bonus_max_staleness = self.params["bonus_max_staleness"]
 
         # self.action_space = DiscreteBox(
         #     low=-1.0, high=1.0, 
@@ -173,6 +178,38 @@ class LocobotNavigationGraspingDualPerturbationEnv(RoomEnv):
 
         self.grasp_algorithm.finish_init(rnd_trainer=grasp_rnd_trainer)
 
+        self.perturbation_trainer = PerturbationTrainer(
+            [self.grasp_perturbation_env, self.nav_perturbation_env])
+
+        if self.add_uncertainty_bonus:
+            self.uncertainty_bonus_cache = BonusCache(
+                self.replay_pool,
+                'uncertainty_bonuses',
+                lambda next_observations: self.grasp_algorithm.get_uncertainty_for_nav(next_observations["pixels"]),
+                refresh_interval=self.bonus_refresh_interval,
+                max_staleness=self.bonus_max_staleness)
+
+    @property
+    def replay_pool_extra_fields(self):
+        """ Fields the main replay pool stores the cached reward bonuses in. """
+        extra_fields = {}
+        if self.add_uncertainty_bonus:
+            extra_fields.update(bonus_fields('uncertainty_bonuses'))
+        return extra_fields
+
+    def snapshot_models(self):
+        """ Makes this (evaluation) environment grasp with a copy of the current grasp model,
+        so that it can be rolled out while the model trains. """
+        if hasattr(self.grasp_algorithm, 'snapshot_models'):
+            self.grasp_algorithm.snapshot_models()
+
+    def train_perturbations(self):
+        """ Trains the perturbation learners that deferred their training
+        during `step`. Called by the algorithm between env steps. """
+        if self.perturbation_trainer.pending_train_steps == 0:
+            return 0
+        return self.perturbation_trainer.train()
+
     def reset(self):
         dprint("reset")
         
@@ -254,12 +291,13 @@ class LocobotNavigationGraspingDualPerturbationEnv(RoomEnv):
 
         if self.add_uncertainty_bonus:
             # this is between 0 - 0.5
-            uncertainty_bonus = self.grasp_algorithm.get_uncertainty_for_nav(batch["next_observations"]["pixels"])
+            uncertainty_bonus = self.uncertainty_bonus_cache(batch)
             batch["rewards"] = batch["rewards"] + uncertainty_bonus
             diagnostics["uncertainty_bonus-mean"] = np.mean(uncertainty_bonus)
             diagnostics["uncertainty_bonus-min"] = np.min(uncertainty_bonus)
             diagnostics["uncertainty_bonus-max"] = np.max(uncertainty_bonus)
             diagnostics["uncertainty_bonus-std"] = np.std(uncertainty_bonus)
+            diagnostics.update(self.uncertainty_bonus_cache.get_diagnostics())
 
         return diagnostics
 
@@ -581,10 +619,11 @@ class LocobotNavigationGraspingDualPerturbationEnv(RoomEnv):
             dprint("no respawn eval")
             self.reset()
             reward = 0
+            policy = kwargs.get('policy', self.algorithm._policy)
             for i in range(self.no_respawn_eval_len):
                 dprint(i)
                 obs = self.get_observation()
-                action = self.algorithm._policy.action(obs).numpy()
+                action = policy.action(obs).numpy()
                 self.do_move(action)
                 num_grasped, object_ind = self.do_grasp(action, {}, return_grasped_object=True)
                 reward += num_grasped
@@ -16,10 +16,13 @@ from .utils import (
     build_image_discrete_policy,
     build_discrete_Q_model,
     create_train_discrete_Q_sigmoid,
+    create_train_discrete_Q_sigmoid_bootstrap,
+    validate_bootstrap_params,
     GRASP_DATA,
     GRASP_MODEL)
 
 from softlearning.utils.dict import deep_update
+from softlearning.utils.tensorflow import compiled_function, loss_scale_optimizer
 
 
 
@@ -213,6 +216,18 @@ class DQNGrasping:
             self.deterministic_model = DQNGrasping.deterministic_model
             self.logits_model = DQNGrasping.logits_model
 
+    def snapshot_models(self):
+        """ Copies the current weights of the training model into a model of this (evaluation)
+            instance, which it grasps with from then on. """
+        if self.is_training:
+            raise ValueError("Cannot snapshot the models of the training environment")
+        if self.logits_model is DQNGrasping.logits_model:
+            self.logits_model, self.deterministic_model = build_image_discrete_policy(
+                image_size=self.image_size,
+                discrete_dimension=np.prod(self.discrete_dimensions),
+                discrete_hidden_layers=self.discrete_hidden_layers)
+        self.logits_model.set_weights(DQNGrasping.logits_model.get_weights())
+
     def finish_init(self, rnd_trainer=None):
         self.rnd_trainer = rnd_trainer
 
@@ -431,6 +446,8 @@ class SoftQGrasping(Checkpointable):
             min_samples_before_train=500,
             grasp_data_name=None,
             grasp_model_name=None,
+            bootstrap_type=None,
+            bootstrap_bernoulli_p=0.5,
             **kwargs
         ):
         super().__init__()
@@ -443,6 +460,10 @@ class SoftQGrasping(Checkpointable):
         self.batch_size = batch_size
         self.buffer_size = buffer_size
         self.min_samples_before_train = min_samples_before_train
+        self.bootstrap_type = bootstrap_type
+        self.bootstrap_bernoulli_p = bootstrap_bernoulli_p
+        if self.bootstrap_type is not None:
+            validate_bootstrap_params(self.bootstrap_type, self.bootstrap_bernoulli_p)
 
         self.interface = self.env.interface
 
@@ -468,7 +489,7 @@ class SoftQGrasping(Checkpointable):
             SoftQGrasping.logits_models = self.logits_models
 
             self.optimizers = tuple(
-                tf.optimizers.Adam(learning_rate=self.lr, name=f'grasp_optimizer_{i}') 
+                loss_scale_optimizer(tf.optimizers.Adam(learning_rate=self.lr, name=f'grasp_optimizer_{i}'))
                 for i in range(self.num_models)
             )
             tree.map_structure(
@@ -505,10 +526,18 @@ class SoftQGrasping(Checkpointable):
                 print("Loaded grasping model from", model_path)
                 self.loaded_model = True
 
-            self.logits_train_functions = [
-                create_train_discrete_Q_sigmoid(logits_model, optimizer, self.discrete_dimension)
-                for logits_model, optimizer in zip(self.logits_models, self.optimizers)
-            ]
+            if self.bootstrap_type is not None:
+                # one fused step for the whole ensemble, each member on its own bootstrap resample
+                self.logits_train_functions = [
+                    create_train_discrete_Q_sigmoid_bootstrap(
+                        self.logits_models, self.optimizers, self.discrete_dimension,
+                        bootstrap_type=self.bootstrap_type, bernoulli_p=self.bootstrap_bernoulli_p)
+                ]
+            else:
+                self.logits_train_functions = [
+                    create_train_discrete_Q_sigmoid(logits_model, optimizer, self.discrete_dimension)
+                    for logits_model, optimizer in zip(self.logits_models, self.optimizers)
+                ]
 
             self.train_diagnostics = []
         else:
@@ -523,6 +552,24 @@ class SoftQGrasping(Checkpointable):
         self.num_successes = 0
         self.num_graspable_actions = 0
 
+    def snapshot_models(self):
+        """ Copies the current weights of the training models into models of this (evaluation)
+            instance, which it grasps with from then on. The first snapshot must be taken before
+            the instance grasps, since the compiled functions keep the models they're traced with.
+        """
+        if self.is_training:
+            raise ValueError("Cannot snapshot the models of the training environment")
+        if self.logits_models is SoftQGrasping.logits_models:
+            self.logits_models = tuple(
+                build_discrete_Q_model(
+                    image_size=self.image_size, 
+                    discrete_dimension=self.discrete_dimension,
+                    discrete_hidden_layers=[512, 512]
+                ) for _ in range(self.num_models)
+            )
+        for logits_model, training_logits_model in zip(self.logits_models, SoftQGrasping.logits_models):
+            logits_model.set_weights(training_logits_model.get_weights())
+
     def finish_init(self, rnd_trainer=None):
         self.rnd_trainer = rnd_trainer
 
@@ -649,8 +696,11 @@ class SoftQGrasping(Checkpointable):
             infos[key] = np.nan
 
     def calc_probs(self, obs):
-        obs = obs[tf.newaxis, ...]
+        return tf.squeeze(self._calc_batch_probs(obs[tf.newaxis, ...])).numpy()
 
+    @compiled_function
+    def _calc_batch_probs(self, obs):
+        """ Always called with a batch of one, so it's traced once. """
         all_logits = [logits_model(obs) for logits_model in self.logits_models]
         all_Q_values = tf.nn.sigmoid(all_logits)
         # min_Q_values = tf.reduce_min(all_Q_values, axis=0)
@@ -658,9 +708,7 @@ class SoftQGrasping(Checkpointable):
         std_Q_values = tf.math.reduce_std(all_Q_values, axis=0)
 
         # probs = tf.nn.softmax(10.0 * min_Q_values, axis=-1)
-        probs = tf.nn.softmax(10.0 * mean_Q_values + 10.0 * std_Q_values, axis=-1)
-
-        return tf.squeeze(probs).numpy()
+        return tf.nn.softmax(10.0 * mean_Q_values + 10.0 * std_Q_values, axis=-1)
 
     def calc_Q_values(self, obs):
         obs = obs[tf.newaxis, ...]
@@ -671,6 +719,32 @@ class SoftQGrasping(Checkpointable):
 
         return tf.squeeze(mean_Q_values).numpy()
 
+    @compiled_function
+    def sample_action(self, obs, deterministic=False):
+        """ Samples a grasp in-graph from the same distribution as `calc_probs`.
+            Returns `[action_discrete, *action_undiscretized]` packed into a single
+            float32 vector so that one host transfer gives the whole grasp. """
+        obs = obs[tf.newaxis, ...]
+
+        all_logits = [logits_model(obs) for logits_model in self.logits_models]
+        all_Q_values = tf.nn.sigmoid(all_logits)
+        mean_Q_values = tf.reduce_mean(all_Q_values, axis=0)
+        std_Q_values = tf.math.reduce_std(all_Q_values, axis=0)
+
+        logits = tf.cast(10.0 * mean_Q_values + 10.0 * std_Q_values, tf.float32)
+
+        if deterministic:
+            action_discrete = tf.argmax(logits, axis=-1, output_type=tf.int32)
+        else:
+            action_discrete = tf.random.categorical(logits, 1, dtype=tf.int32)[:, 0]
+
+        action_undiscretized = self.discretizer.tf_undiscretize_flat(action_discrete)
+
+        return tf.concat([
+            tf.cast(action_discrete, tf.float32)[:, tf.newaxis],
+            action_undiscretized,
+        ], axis=-1)[0]
+
     def do_grasp_action(self, do_all_grasps=False, num_grasps_overwrite=None, return_grasped_object=False):
         num_grasps = 0
         reward = 0
@@ -685,18 +759,16 @@ class SoftQGrasping(Checkpointable):
             # get the grasping camera image
             obs = self.crop_obs(self.interface.render_camera(size=100, use_aux=False))
 
-            if self.is_training:
-                if self.buffer.num_samples < self.min_samples_before_train and not self.loaded_model:
-                    action_discrete = np.random.randint(0, self.discrete_dimension)
-                else:
-                    probs = self.calc_probs(obs)
-                    action_discrete = np.random.choice(self.discrete_dimension, p=probs)
+            if self.is_training and self.buffer.num_samples < self.min_samples_before_train and not self.loaded_model:
+                action_discrete = np.random.randint(0, self.discrete_dimension)
+                action_undiscretized = self.discretizer.undiscretize_flat(action_discrete)
             else:
-                probs = self.calc_probs(obs)
-                action_discrete = np.argmax(probs)
+                # sampled and converted to local grasp position in-graph
+                sample = self.sample_action(obs, deterministic=not self.is_training).numpy()
+                action_discrete = int(sample[0])
+                action_undiscretized = sample[1:]
 
-            # convert to local grasp position and execute grasp
-            action_undiscretized = self.discretizer.undiscretize(self.discretizer.unflatten(action_discrete))
+            # execute grasp
             if return_grasped_object:
                 reward, object_ind = self.do_grasp(action_undiscretized, return_grasped_object=return_grasped_object)
             else:
@@ -14,6 +14,7 @@ from softlearning.utils.dict import deep_update
 from softlearning.utils.misc import RunningMeanVar
 
 from softlearning.replay_pools import SimpleReplayPool, SharedReplayPool
+from softlearning.replay_pools.bonus_cache import BonusCache, bonus_fields
 
 
 def get_perturbation(perturbation_name, **params):
@@ -66,6 +67,9 @@ class LocobotPerturbationBase:
         self.observation_space = self.params["observation_space"]
         self.env = self.params["env"]
         self.is_training = self.params["is_training"]
+        self.defer_training = False
+        # train steps owed to a `PerturbationTrainer` when training is deferred
+        self.pending_train_steps = 0
     
     def finish_init(self, **kwargs):
         pass
@@ -131,6 +135,12 @@ class LocobotPerturbationBase:
     def train(self, *args, **kwargs):
         return OrderedDict()
 
+    def sample_training_batch(self):
+        raise NotImplementedError
+
+    def record_training_diagnostics(self, sac_diagnostics):
+        pass
+
     def do_move(self, action):
         self.env.do_move(action)
 
@@ -314,8 +324,11 @@ class LocobotRNDPerturbation(LocobotPerturbationBase):
             batch_size=256,
             min_samples_before_train=300,
             num_train_repeat=5,
+            defer_training=False,
             buffer_size=int(1e5),
             reward_scale=1.0,
+            bonus_refresh_interval=100,
+            bonus_max_staleness=10000,
             preprocess_rnd_inputs=None,
             infos_prefix="",
             use_shared_data=True,
@@ -335,15 +348,23 @@ class LocobotRNDPerturbation(LocobotPerturbationBase):
         self.batch_size = self.params["batch_size"]
         self.min_samples_before_train = self.params["min_samples_before_train"]
         self.num_train_repeat = self.params["num_train_repeat"]
+        self.defer_training = self.params["defer_training"]
         self.buffer_size = self.params["buffer_size"]
         self.reward_scale = self.params["reward_scale"]
         self.infos_prefix = self.params["infos_prefix"]
         self.use_shared_data = self.params["use_shared_data"]
+        self.bonus_refresh_interval = self.params["bonus_refresh_interval"]
+        self.bonus_max_staleness = self.params["bonus_max_staleness"]
 
         if self.is_training:
-            self.buffer = SharedReplayPool(self, self.buffer_size)
+            self.buffer = SharedReplayPool(self, self.buffer_size,
+                extra_fields=bonus_fields('intrinsic_rewards'))
             self.training_iteration = 0
 
+        self.intrinsic_reward_means = []
+        self.intrinsic_reward_maxes = []
+        self.intrinsic_reward_mins = []
+
     def finish_init(self, policy, algorithm, rnd_trainer, preprocess_rnd_inputs, main_replay_pool, **kwargs):
         self.policy = policy
         self.algorithm = algorithm
@@ -351,6 +372,16 @@ class LocobotRNDPerturbation(LocobotPerturbationBase):
         self.preprocess_rnd_inputs = preprocess_rnd_inputs
         self.main_replay_pool = main_replay_pool
 
+        if self.is_training:
+            # caches the unnormalized rewards, they're normalized when read
+            self.intrinsic_reward_cache = BonusCache(
+                self.buffer,
+                'intrinsic_rewards',
+                lambda next_observations: self.rnd_trainer.get_intrinsic_rewards(
+                    self.preprocess_rnd_inputs(next_observations), normalize=False),
+                refresh_interval=self.bonus_refresh_interval,
+                max_staleness=self.bonus_max_staleness)
+
     @property
     def has_shared_pool(self):
         return True
@@ -376,10 +407,6 @@ class LocobotRNDPerturbation(LocobotPerturbationBase):
     def do_perturbation_precedure(self, infos, object_ind=None):
         dprint("    " + self.infos_prefix + "rnd_perturb!")
 
-        intrinsic_reward_means = []
-        intrinsic_reward_maxes = []
-        intrinsic_reward_mins = []
-
         base_traj = [self.env.interface.get_base_pos_and_yaw()]
 
         obs = self.get_observation()
@@ -425,22 +452,26 @@ class LocobotRNDPerturbation(LocobotPerturbationBase):
 
             # train
             if self.is_training and self.buffer.size >= self.min_samples_before_train:
-                self.env.timer.end()
-                for _ in range(self.num_train_repeat):
-                    sac_diagnostics = self.train()
-
-                    intrinsic_reward_means.append(sac_diagnostics["intrinsic_reward-mean"])
-                    intrinsic_reward_maxes.append(sac_diagnostics["intrinsic_reward-max"])
-                    intrinsic_reward_mins.append(sac_diagnostics["intrinsic_reward-min"])
-
-                self.env.timer.start()
+                if self.defer_training:
+                    self.pending_train_steps += self.num_train_repeat
+                else:
+                    self.env.timer.end()
+                    for _ in range(self.num_train_repeat):
+                        sac_diagnostics = self.train()
+                        self.record_training_diagnostics(sac_diagnostics)
+                    self.env.timer.start()
 
         # diagnostics
         if self.is_training:
-            if len(intrinsic_reward_means) > 0:
-                infos[self.infos_prefix + "intrinsic_reward-mean"] = np.mean(intrinsic_reward_means)
-                infos[self.infos_prefix + "intrinsic_reward-max"] = np.max(intrinsic_reward_maxes)
-                infos[self.infos_prefix + "intrinsic_reward-min"] = np.min(intrinsic_reward_mins)
+            # With deferred training these are the updates done since the
+            # previous perturbation.
+            if len(self.intrinsic_reward_means) > 0:
+                infos[self.infos_prefix + "intrinsic_reward-mean"] = np.mean(self.intrinsic_reward_means)
+                infos[self.infos_prefix + "intrinsic_reward-max"] = np.max(self.intrinsic_reward_maxes)
+                infos[self.infos_prefix + "intrinsic_reward-min"] = np.min(self.intrinsic_reward_mins)
+                self.intrinsic_reward_means = []
+                self.intrinsic_reward_maxes = []
+                self.intrinsic_reward_mins = []
 
             infos[self.infos_prefix + "buffer_size"] = self.buffer.size
             infos[self.infos_prefix + "buffer_shared_size"] = self.buffer.shared_size
@@ -486,25 +517,32 @@ class LocobotRNDPerturbation(LocobotPerturbationBase):
 
         # rewards doesn't matter since it will be relabeled when SAC training calls process_batch
 
-    def train(self):
+    def sample_training_batch(self):
         if self.use_shared_data:
             batch = self.buffer.random_batch_from_both(self.batch_size, self.main_replay_pool, 
                 lambda batch: self.process_batch_from_main_pool(batch))
         else:
             batch = self.buffer.random_batch(self.batch_size)
+        return self.algorithm._pad_training_batch(batch)
 
+    def train(self):
+        batch = self.sample_training_batch()
         sac_diagnostics = self.algorithm._do_training(self.training_iteration, batch)
         self.training_iteration += 1
         
         return sac_diagnostics
 
+    def record_training_diagnostics(self, sac_diagnostics):
+        self.intrinsic_reward_means.append(sac_diagnostics["intrinsic_reward-mean"])
+        self.intrinsic_reward_maxes.append(sac_diagnostics["intrinsic_reward-max"])
+        self.intrinsic_reward_mins.append(sac_diagnostics["intrinsic_reward-min"])
+
     def process_batch(self, batch):
         """ Process batch for RND reward at every step. """
         dprint("        rnd perturb process batch")
 
-        next_observations = batch["next_observations"]
-        next_observations = self.preprocess_rnd_inputs(next_observations)
-        intrinsic_rewards = self.rnd_trainer.get_intrinsic_rewards(next_observations)
+        unnormalized_intrinsic_rewards = self.intrinsic_reward_cache(batch)
+        intrinsic_rewards = self.rnd_trainer.normalize_rewards(unnormalized_intrinsic_rewards)
         
         batch["rewards"] = intrinsic_rewards * self.reward_scale
 
@@ -513,6 +551,7 @@ class LocobotRNDPerturbation(LocobotPerturbationBase):
             "intrinsic_reward-min": np.min(intrinsic_rewards),
             "intrinsic_reward-max": np.max(intrinsic_rewards),
         })
+        diagnostics.update(self.intrinsic_reward_cache.get_diagnostics())
         return diagnostics
 
     # def process_batch(self, batch):
@@ -566,8 +605,11 @@ class LocobotGraspUncertaintyPerturbation(LocobotPerturbationBase):
             batch_size=128,
             min_samples_before_train=300,
             num_train_repeat=1,
+            defer_training=False,
             buffer_size=int(1e5),
             reward_scale=1.0,
+            bonus_refresh_interval=100,
+            bonus_max_staleness=10000,
             infos_prefix="",
             use_shared_data=False,
         )
@@ -586,13 +628,17 @@ class LocobotGraspUncertaintyPerturbation(LocobotPerturbationBase):
         self.batch_size = self.params["batch_size"]
         self.min_samples_before_train = self.params["min_samples_before_train"]
         self.num_train_repeat = self.params["num_train_repeat"]
+        self.defer_training = self.params["defer_training"]
         self.buffer_size = self.params["buffer_size"]
         self.reward_scale = self.params["reward_scale"]
         self.infos_prefix = self.params["infos_prefix"]
         self.use_shared_data = self.params["use_shared_data"]
+        self.bonus_refresh_interval = self.params["bonus_refresh_interval"]
+        self.bonus_max_staleness = self.params["bonus_max_staleness"]
 
         if self.is_training:
-            self.buffer = SharedReplayPool(self, self.buffer_size)
+            self.buffer = SharedReplayPool(self, self.buffer_size,
+                extra_fields=bonus_fields('uncertainty_rewards'))
             self.training_iteration = 0
             self.running_mean_var = RunningMeanVar(1e-10)
 
@@ -608,6 +654,20 @@ class LocobotGraspUncertaintyPerturbation(LocobotPerturbationBase):
         self.main_replay_pool = main_replay_pool
         self.grasp_algorithm = grasp_algorithm
 
+        if self.is_training:
+            # caches the unnormalized rewards, they're normalized when read
+            self.uncertainty_reward_cache = BonusCache(
+                self.buffer,
+                'uncertainty_rewards',
+                self.compute_unnormalized_uncertainty_rewards,
+                refresh_interval=self.bonus_refresh_interval,
+                max_staleness=self.bonus_max_staleness)
+
+    def compute_unnormalized_uncertainty_rewards(self, next_observations):
+        unnormalized_uncertainty_rewards = self.grasp_algorithm.get_uncertainty_for_nav(next_observations["pixels"])
+        self.running_mean_var.update_batch(unnormalized_uncertainty_rewards)
+        return unnormalized_uncertainty_rewards
+
     @property
     def has_shared_pool(self):
         # return True
@@ -670,15 +730,14 @@ class LocobotGraspUncertaintyPerturbation(LocobotPerturbationBase):
 
             # train
             if self.is_training and self.buffer.size >= self.min_samples_before_train:
-                self.env.timer.end()
-                for _ in range(self.num_train_repeat):
-                    sac_diagnostics = self.train()
-
-                    self.uncertainty_reward_means.append(sac_diagnostics["uncertainty_reward-mean"])
-                    self.uncertainty_reward_maxes.append(sac_diagnostics["uncertainty_reward-max"])
-                    self.uncertainty_reward_mins.append(sac_diagnostics["uncertainty_reward-min"])
-
-                self.env.timer.start()
+                if self.defer_training:
+                    self.pending_train_steps += self.num_train_repeat
+                else:
+                    self.env.timer.end()
+                    for _ in range(self.num_train_repeat):
+                        sac_diagnostics = self.train()
+                        self.record_training_diagnostics(sac_diagnostics)
+                    self.env.timer.start()
 
         # diagnostics
         # if self.is_training:
@@ -732,28 +791,32 @@ class LocobotGraspUncertaintyPerturbation(LocobotPerturbationBase):
 
         # rewards doesn't matter since it will be relabeled when SAC training calls process_batch
 
-    def train(self):
+    def sample_training_batch(self):
         if self.use_shared_data:
             batch = self.buffer.random_batch_from_both(self.batch_size, self.main_replay_pool, 
                 lambda batch: self.process_batch_from_main_pool(batch))
         else:
             batch = self.buffer.random_batch(self.batch_size)
+        return self.algorithm._pad_training_batch(batch)
 
+    def train(self):
+        batch = self.sample_training_batch()
         sac_diagnostics = self.algorithm._do_training(self.training_iteration, batch)
         self.training_iteration += 1
         
         return sac_diagnostics
 
+    def record_training_diagnostics(self, sac_diagnostics):
+        self.uncertainty_reward_means.append(sac_diagnostics["uncertainty_reward-mean"])
+        self.uncertainty_reward_maxes.append(sac_diagnostics["uncertainty_reward-max"])
+        self.uncertainty_reward_mins.append(sac_diagnostics["uncertainty_reward-min"])
+
     def process_batch(self, batch):
         """ Process batch for uncertainty reward at every step. """
         dprint("        uncertainty perturb process batch")
 
-        next_observations = batch["next_observations"]
-
-        unnormalized_uncertainty_rewards = self.grasp_algorithm.get_uncertainty_for_nav(next_observations["pixels"])
+        unnormalized_uncertainty_rewards = self.uncertainty_reward_cache(batch)
         uncertainty_rewards = (unnormalized_uncertainty_rewards - self.running_mean_var.mean) / self.running_mean_var.std
-        
-        self.running_mean_var.update_batch(unnormalized_uncertainty_rewards)
 
         batch["rewards"] = uncertainty_rewards * self.reward_scale
 
@@ -762,6 +825,7 @@ class LocobotGraspUncertaintyPerturbation(LocobotPerturbationBase):
             "uncertainty_reward-min": np.min(uncertainty_rewards),
             "uncertainty_reward-max": np.max(uncertainty_rewards),
         })
+        diagnostics.update(self.uncertainty_reward_cache.get_diagnostics())
         return diagnostics
 
     def finalize_diagnostics(self):
@@ -833,6 +897,7 @@ class LocobotNavQPerturbation(LocobotPerturbationBase):
             batch_size=128,
             min_samples_before_train=1000,
             num_train_repeat=1,
+            defer_training=False,
             buffer_size=int(1e5),
             reward_scale=1.0,
             infos_prefix="",
@@ -853,6 +918,7 @@ class LocobotNavQPerturbation(LocobotPerturbationBase):
         self.batch_size = self.params["batch_size"]
         self.min_samples_before_train = self.params["min_samples_before_train"]
         self.num_train_repeat = self.params["num_train_repeat"]
+        self.defer_training = self.params["defer_training"]
         self.buffer_size = self.params["buffer_size"]
         self.reward_scale = self.params["reward_scale"]
         self.infos_prefix = self.params["infos_prefix"]
@@ -938,15 +1004,14 @@ class LocobotNavQPerturbation(LocobotPerturbationBase):
 
             # train
             if self.is_training and self.buffer.size >= self.min_samples_before_train:
-                self.env.timer.end()
-                for _ in range(self.num_train_repeat):
-                    sac_diagnostics = self.train()
-
-                    self.nav_Q_reward_means.append(sac_diagnostics["nav_Q_reward-mean"])
-                    self.nav_Q_reward_maxes.append(sac_diagnostics["nav_Q_reward-max"])
-                    self.nav_Q_reward_mins.append(sac_diagnostics["nav_Q_reward-min"])
-
-                self.env.timer.start()
+                if self.defer_training:
+                    self.pending_train_steps += self.num_train_repeat
+                else:
+                    self.env.timer.end()
+                    for _ in range(self.num_train_repeat):
+                        sac_diagnostics = self.train()
+                        self.record_training_diagnostics(sac_diagnostics)
+                    self.env.timer.start()
 
         # diagnostics
         # if self.is_training:
@@ -1000,18 +1065,26 @@ class LocobotNavQPerturbation(LocobotPerturbationBase):
 
         # rewards doesn't matter since it will be relabeled when SAC training calls process_batch
 
-    def train(self):
+    def sample_training_batch(self):
         if self.use_shared_data:
             batch = self.buffer.random_batch_from_both(self.batch_size, self.main_replay_pool, 
                 lambda batch: self.process_batch_from_main_pool(batch))
         else:
             batch = self.buffer.random_batch(self.batch_size)
+        return self.algorithm._pad_training_batch(batch)
 
+    def train(self):
+        batch = self.sample_training_batch()
         sac_diagnostics = self.algorithm._do_training(self.training_iteration, batch)
         self.training_iteration += 1
         
         return sac_diagnostics
 
+    def record_training_diagnostics(self, sac_diagnostics):
+        self.nav_Q_reward_means.append(sac_diagnostics["nav_Q_reward-mean"])
+        self.nav_Q_reward_maxes.append(sac_diagnostics["nav_Q_reward-max"])
+        self.nav_Q_reward_mins.append(sac_diagnostics["nav_Q_reward-min"])
+
     def process_batch(self, batch):
         """ Process batch for navQ reward at every step. """
         dprint("        nav_Q perturb process batch")
@@ -1098,6 +1171,50 @@ class LocobotNavQPerturbation(LocobotPerturbationBase):
 
 
 
+class PerturbationTrainer:
+    """ Trains the perturbation learners outside of the env step.
+
+    Perturbations created with `defer_training=True` only count the train
+    steps they are owed while the perturbation is running. `train` pays those
+    steps off through each learner's own `_do_batched_training`: the batches
+    of `num_train_repeat` steps are sampled at once, stacked, and their
+    updates run in one compiled loop, as `num_train_repeat` consecutive
+    `_do_training` calls would. The learners have separate networks and
+    observation specs, so each of them runs its own loop.
+    """
+    def __init__(self, perturbations):
+        self.perturbations = tuple(
+            perturbation for perturbation in perturbations
+            if perturbation.is_training and perturbation.defer_training)
+
+    @property
+    def pending_train_steps(self):
+        return sum(perturbation.pending_train_steps for perturbation in self.perturbations)
+
+    def train(self):
+        """ Runs all pending train steps, returns the number of updates. """
+        num_updates = 0
+        for perturbation in self.perturbations:
+            while perturbation.pending_train_steps > 0:
+                # at most `num_train_repeat` batches are stacked, so that the
+                # loop is traced once and the stacked pixels stay small
+                num_batches = min(perturbation.pending_train_steps, perturbation.num_train_repeat)
+                batches = [perturbation.sample_training_batch() for _ in range(num_batches)]
+                batch = tree.map_structure(lambda *x: np.concatenate(x, axis=0), *batches)
+
+                sac_diagnostics = perturbation.algorithm._do_batched_training(
+                    iteration=perturbation.training_iteration,
+                    batch=batch,
+                    num_batches=num_batches)
+                perturbation.record_training_diagnostics(sac_diagnostics)
+
+                perturbation.training_iteration += num_batches
+                perturbation.pending_train_steps -= num_batches
+                num_updates += num_batches
+
+        return num_updates
+
+
 # class LocobotAdversarialPerturbation(LocobotPerturbationBase):
 #     def __init__(self, **params):
 #         defaults = dict(
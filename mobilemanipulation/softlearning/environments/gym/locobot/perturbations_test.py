@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import unittest
+
+import numpy as np
+
+from softlearning.environments.gym.locobot.perturbations import (
+    LocobotRNDPerturbation, PerturbationTrainer)
+
+
+class RecordingAlgorithm:
+    """Records the `(iteration, batch)` of every update it runs."""
+    def __init__(self):
+        self.updates = []
+
+    def _do_training(self, iteration, batch):
+        self.updates.append((iteration, batch['observations'].copy()))
+        return OrderedDict((('intrinsic_reward-mean', 0.0), ))
+
+    def _do_batched_training(self, iteration, batch, num_batches):
+        batches = np.split(batch['observations'], num_batches, axis=0)
+        for i, observations in enumerate(batches):
+            self._do_training(iteration + i, {'observations': observations})
+        return OrderedDict((('intrinsic_reward-mean', 0.0), ))
+
+
+class StubPerturbation:
+    """The training state of a perturbation learner, without the env."""
+    # Inline training goes through a real perturbation's `train`.
+    train = LocobotRNDPerturbation.train
+
+    def __init__(self, defer_training, num_train_repeat=3, batch_size=4, seed=0):
+        self.is_training = True
+        self.defer_training = defer_training
+        self.pending_train_steps = 0
+        self.num_train_repeat = num_train_repeat
+        self.batch_size = batch_size
+        self.training_iteration = 0
+        self.algorithm = RecordingAlgorithm()
+        self.num_recorded_diagnostics = 0
+        self._random_state = np.random.RandomState(seed)
+
+    def sample_training_batch(self):
+        return {
+            'observations': self._random_state.uniform(
+                size=(self.batch_size, 2)).astype(np.float32),
+        }
+
+    def record_training_diagnostics(self, sac_diagnostics):
+        self.num_recorded_diagnostics += 1
+
+
+class PerturbationTrainerTest(unittest.TestCase):
+    def test_skips_inline_perturbations(self):
+        inline = StubPerturbation(defer_training=False)
+        deferred = StubPerturbation(defer_training=True)
+        trainer = PerturbationTrainer((inline, deferred))
+        self.assertEqual(trainer.perturbations, (deferred, ))
+
+    def test_deferred_matches_inline_updates(self):
+        num_steps = 7
+        inline = StubPerturbation(defer_training=False)
+        deferred = StubPerturbation(defer_training=True)
+
+        for _ in range(num_steps):
+            for _ in range(inline.num_train_repeat):
+                inline.train()
+            deferred.pending_train_steps += deferred.num_train_repeat
+
+        trainer = PerturbationTrainer((deferred, ))
+        self.assertEqual(
+            trainer.pending_train_steps, num_steps * deferred.num_train_repeat)
+        num_updates = trainer.train()
+
+        self.assertEqual(num_updates, num_steps * inline.num_train_repeat)
+        self.assertEqual(trainer.pending_train_steps, 0)
+        self.assertEqual(
+            deferred.training_iteration, inline.training_iteration)
+        self.assertEqual(
+            len(deferred.algorithm.updates), len(inline.algorithm.updates))
+        for (deferred_iteration, deferred_batch), (inline_iteration, inline_batch) in zip(
+                deferred.algorithm.updates, inline.algorithm.updates):
+            self.assertEqual(deferred_iteration, inline_iteration)
+            np.testing.assert_array_equal(deferred_batch, inline_batch)
+
+    def test_stacks_at_most_num_train_repeat_batches(self):
+        deferred = StubPerturbation(defer_training=True, num_train_repeat=3)
+        deferred.pending_train_steps = 7
+        calls = []
+        do_batched_training = deferred.algorithm._do_batched_training
+
+        def recording_do_batched_training(iteration, batch, num_batches):
+            calls.append((iteration, num_batches))
+            return do_batched_training(iteration, batch, num_batches)
+
+        deferred.algorithm._do_batched_training = recording_do_batched_training
+        PerturbationTrainer((deferred, )).train()
+
+        self.assertEqual(calls, [(0, 3), (3, 3), (6, 1)])
+        self.assertEqual(deferred.num_recorded_diagnostics, len(calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,8 +16,7 @@ from softlearning.environments.gym.spaces import DiscreteBox, FrameStack
 
 from softlearning.utils.dict import deep_update
 
-#from locobot_interface.client import LocobotClient
-from locobot.locobot_control_interface.rospy.client import LocobotClient
+from locobot_interface.client import LocobotClient
 
 import moviepy.editor as mpy
 from skimage.transform import resize
@@ -286,7 +285,8 @@ class RealLocobotNavigationGraspingDualPerturbationEnv(gym.Env):
         self.clear_frames()
 
     def render(self, save_frame=False, return_unscaled=False):
-        unscaled_image =  self.interface.get_image()
+        # a frame taken after the last base and arm motions finished
+        unscaled_image =  self.interface.get_image(after=self.interface.get_time())
         image = resize(unscaled_image, (100,100),  anti_aliasing=True, preserve_range=True).astype(np.uint8)
 
         if save_frame:
@@ -378,7 +378,7 @@ class RealLocobotNavigationGraspingDualPerturbationEnv(gym.Env):
 
         # do move
         self.do_move(action)
-        time.sleep(0.55)
+        self.interface.wait_for_base_stopped()
 
         # do grasping
         num_grasped = self.do_grasp(action, infos)
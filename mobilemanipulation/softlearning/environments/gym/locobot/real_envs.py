@@ -10,8 +10,7 @@ import numpy as np
 from skimage.transform import resize
 from skimage.color import rgb2hsv
 
-#from locobot_interface.client import LocobotClient
-from locobot.locobot_control_interface.rospy.client import LocobotClient
+from locobot_interface.client import LocobotClient
 
 
 GRIPPER_POS_EVAL = True
@@ -32,6 +31,13 @@ class RealLocobotBaseEnv(gym.Env):
         self._logs = defaultdict(list)
 
         self._client.set_pan_tilt(.0, .825)
+        # observations only use frames captured after this time (in seconds)
+        self._settled_after = None
+
+    def _wait_for_motion(self):
+        """ Waits for the base to come to rest, later observations only use frames taken after that """
+        self._client.wait_for_base_stopped()
+        self._settled_after = self._client.get_time()
 
     def log_state(self, reward):
         self._logs['pixels'] += [self.render()]
@@ -47,7 +53,7 @@ class RealLocobotBaseEnv(gym.Env):
         self._sample_id += 1
 
     def render(self, mode='rgb_array', masked=False):
-        img = self._client.get_image()
+        img = self._client.get_image(after=self._settled_after)
         img = resize(img, (84,84))
         if masked:
             mask = compute_affordance_mask(img)
@@ -88,13 +94,13 @@ class RealLocobotOdomNavEnv(RealLocobotBaseEnv):
         self._max_steps = 10
         self._num_steps = 0
 
-        time.sleep(.5)
+        self._wait_for_motion()
 
     def reset(self):
         print('Resetting base position to [0,0]')
         self._client.set_base_pos(0, 0, 0, relative=False)
 
-        time.sleep(1.)
+        self._wait_for_motion()
 
         self._num_steps = 0
 
@@ -118,7 +124,7 @@ class RealLocobotOdomNavEnv(RealLocobotBaseEnv):
             self._client.set_base_vel(-.1, 2., 1)
             collided = True
 
-        time.sleep(1.)
+        self._wait_for_motion()
 
         self._num_steps += 1
         done = (self._num_steps >= self._max_steps) or collided
@@ -168,7 +174,7 @@ class RealLocobotRNDNavEnv(RealLocobotBaseEnv):
         self._max_steps = 10
         self._num_steps = 0
 
-        time.sleep(.5)
+        self._wait_for_motion()
 
     def reset(self):
         self._num_steps = 0
@@ -196,7 +202,7 @@ class RealLocobotRNDNavEnv(RealLocobotBaseEnv):
             self._client.set_base_vel(-.1, 0., 1)
             collided = True
 
-        time.sleep(1.)
+        self._wait_for_motion()
 
         self._num_steps += 1
 
@@ -245,7 +251,7 @@ class RealLocobotAffordanceNavEnv(RealLocobotOdomNavEnv):
             self._client.set_base_vel(-.1, 2., 1)
             collided = True
 
-        time.sleep(.25)
+        self._wait_for_motion()
 
         pos, _ = self._client.get_odom()
         pos = np.array(pos)
@@ -295,13 +301,13 @@ class RealLocobotARTagEnv(RealLocobotBaseEnv):
         self._max_steps = 20
         self._num_steps = 0
 
-        time.sleep(.5)
+        self._wait_for_motion()
 
     def reset(self):
         print('Resetting base position to [0,0]')
         self._client.set_base_pos(0, 0, 0, relative=False)
 
-        time.sleep(1.)
+        self._wait_for_motion()
 
         self._num_steps = 0
 
@@ -323,7 +329,7 @@ class RealLocobotARTagEnv(RealLocobotBaseEnv):
             self._client.set_base_vel(-.1, 2., 1)
             collided = True
 
-        time.sleep(1.)
+        self._wait_for_motion()
 
         self._num_steps += 1
         done = (self._num_steps >= self._max_steps) or collided
@@ -336,7 +342,7 @@ class RealLocobotARTagEnv(RealLocobotBaseEnv):
         return obs, reward, done, {}
 
     def get_observation(self, normalize=True):
-        img = self._client.get_image()
+        img = self._client.get_image(after=self._settled_after)
         markers = self.detect_markers(img)
 
         if len(markers) > 0: 
@@ -506,7 +512,6 @@ class RealLocobotGraspingEnv:
         if reward:
             self._interface.set_joint_angles(self.pre_grasp_pose, wait=True)
             self._place(place)
-            time.sleep(0.1)
             self._interface.set_joint_angles(self.arm_out_of_way, wait=True)
         else:
            self._interface.set_end_effector_pose([0.39, 0, self.pregrasp_z], pitch=math.pi/2, roll=0, wait=True)
@@ -547,9 +552,9 @@ class RealLocobotGraspingEnv:
         self._interface.force_close_if_gripper_open(wait=False)
         # self._interface.set_joint_angles(self.pre_grasp_pose, wait=True)
         self._interface.set_joint_angles(photo_pose_1, wait=True)
-        img_1 = self._interface.get_image()[80:240, 310:470, :]  # was img_1 = self._interface.get_image()[110:210, 340:440, :]
+        img_1 = self._interface.get_image(after=self._interface.get_time())[80:240, 310:470, :]  # was img_1 = self._interface.get_image()[110:210, 340:440, :]
         self._interface.set_joint_angles(photo_pose_2, wait=True)
-        img_2 = self._interface.get_image()[80:240, 310:470, :]  # was img_2 = self._interface.get_image()[110:210, 340:440, :]
+        img_2 = self._interface.get_image(after=self._interface.get_time())[80:240, 310:470, :]  # was img_2 = self._interface.get_image()[110:210, 340:440, :]
         if open_gripper_after:
             self._interface.open_gripper(wait=False)
         # self._interface.set_end_effector_pose([0.39, 0, self.grasp_z + 0.05], pitch=math.pi / 2, roll=0, wait=True)
@@ -616,7 +621,7 @@ class RealLocobotGraspingEnv:
         self._interface.set_end_effector_pose(place_pos[:2] +[place_pos[2]+0.08], pitch=math.pi/2, roll=0)
 
     def _get_state(self):
-        image =  self._interface.get_image()
+        image =  self._interface.get_image(after=self._interface.get_time())
         image = resize(image, (100,100),  anti_aliasing=True, preserve_range=True).astype(np.uint8)
         image = image[35:95, 25:85, :]
         return image
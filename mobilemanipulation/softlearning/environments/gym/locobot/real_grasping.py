@@ -20,6 +20,7 @@ from .utils import (
     GRASP_MODEL)
 
 from softlearning.utils.dict import deep_update
+from softlearning.utils.tensorflow import compiled_function
 
 import matplotlib.pyplot as plt
 
@@ -228,12 +229,10 @@ class SoftQGrasping:
         depth_threshold = 0.35
         self.interface.force_close_if_gripper_open(wait=False)
         self.interface.set_joint_angles(photo_pose_1, wait=True)
-        time.sleep(0.15)
-        img_1 = self.interface.get_depth()[50:218, 285:515, :]  # was img_1 = env.interface.get_image()[110:210, 340:440, :]
+        img_1 = self.interface.get_depth(after=self.interface.get_time())[50:218, 285:515, :]  # was img_1 = env.interface.get_image()[110:210, 340:440, :]
         img_1[img_1 > depth_threshold] = 0
         self.interface.set_joint_angles(photo_pose_2, wait=True)
-        time.sleep(0.15)
-        img_2 = self.interface.get_depth()[50:218, 285:515, :]  # was img_2 = env.interface.get_image()[110:210, 340:440, :]
+        img_2 = self.interface.get_depth(after=self.interface.get_time())[50:218, 285:515, :]  # was img_2 = env.interface.get_image()[110:210, 340:440, :]
         img_2[img_2 > depth_threshold] = 0
         if open_gripper_after:
             self.interface.open_gripper(wait=False)
@@ -366,7 +365,7 @@ class SoftQGrasping:
             self.interface.open_gripper(wait=False)
             self.interface.set_joint_angles(self.arm_rest, wait=True)
         
-        time.sleep(0.5)
+        self.interface.wait_for_joint_angles(self.arm_rest)
 
         return reward
 
@@ -448,8 +447,11 @@ class SoftQGrasping:
         return np.mean(lossses)
 
     def calc_probs(self, obs):
-        obs = obs[tf.newaxis, ...]
+        return tf.squeeze(self._calc_batch_probs(obs[tf.newaxis, ...])).numpy()
 
+    @compiled_function
+    def _calc_batch_probs(self, obs):
+        """ Always called with a batch of one, so it's traced once. """
         all_logits = [logits_model(obs) for logits_model in self.logits_models]
         all_Q_values = tf.nn.sigmoid(all_logits)
         # min_Q_values = tf.reduce_min(all_Q_values, axis=0)
@@ -457,9 +459,7 @@ class SoftQGrasping:
         std_Q_values = tf.math.reduce_std(all_Q_values, axis=0)
 
         # probs = tf.nn.softmax(10.0 * min_Q_values, axis=-1)
-        probs = tf.nn.softmax(10.0 * mean_Q_values + 10.0 * std_Q_values, axis=-1)
-
-        return tf.squeeze(probs).numpy()
+        return tf.nn.softmax(10.0 * mean_Q_values + 10.0 * std_Q_values, axis=-1)
 
     def calc_Q_values(self, obs):
         obs = obs[tf.newaxis, ...]
@@ -863,7 +863,7 @@ class SoftQGraspingCurriculum(SoftQGrasping):
             self.interface.open_gripper(wait=False)
             self.interface.set_joint_angles(self.arm_rest, wait=True)
         
-        time.sleep(0.5)
+        self.interface.wait_for_joint_angles(self.arm_rest)
 
         return reward
 
@@ -952,8 +952,11 @@ class SoftQGraspingCurriculum(SoftQGrasping):
         return np.mean(lossses)
 
     def calc_probs(self, obs):
-        obs = obs[tf.newaxis, ...]
+        return tf.squeeze(self._calc_batch_probs(obs[tf.newaxis, ...])).numpy()
 
+    @compiled_function
+    def _calc_batch_probs(self, obs):
+        """ Always called with a batch of one, so it's traced once. """
         all_logits = [logits_model(obs) for logits_model in self.logits_models]
         all_Q_values = tf.nn.sigmoid(all_logits)
         # min_Q_values = tf.reduce_min(all_Q_values, axis=0)
@@ -961,9 +964,7 @@ class SoftQGraspingCurriculum(SoftQGrasping):
         std_Q_values = tf.math.reduce_std(all_Q_values, axis=0)
 
         # probs = tf.nn.softmax(10.0 * min_Q_values, axis=-1)
-        probs = tf.nn.softmax(10.0 * mean_Q_values + 10.0 * std_Q_values, axis=-1)
-
-        return tf.squeeze(probs).numpy()
+        return tf.nn.softmax(10.0 * mean_Q_values + 10.0 * std_Q_values, axis=-1)
 
     def calc_Q_values(self, obs):
         obs = obs[tf.newaxis, ...]
@@ -1387,7 +1388,7 @@ class BaselineGrasping(SoftQGrasping):
             self.interface.open_gripper(wait=False)
             self.interface.set_joint_angles(self.arm_rest, wait=True)
 
-        time.sleep(0.5)
+        self.interface.wait_for_joint_angles(self.arm_rest)
 
         return reward
 
@@ -1,11 +1,10 @@
-import json
-import random
 import traceback
 import threading 
 
 import rospy
 from std_msgs.msg import String, Empty, Int8, Float64
-from sensor_msgs.msg import JointState, Image, CameraInfo
+from sensor_msgs.msg import JointState, Image, CompressedImage, CameraInfo
+from locobot_interface.srv import ArmEECommand, ArmJointCommand, BasePositionCommand, BaseVelocityCommand
 
 import numpy as np
 from skimage.transform import resize
@@ -13,6 +12,14 @@ ROSTOPIC_GRIPPER_OPEN = '/gripper/open'
 ROSTOPIC_GRIPPER_CLOSE = '/gripper/close'
 ROSTOPIC_GRIPPER_STATE = '/gripper/state'
 
+# command services of the locobot_interface server, by name
+COMMAND_SERVICES = {
+    'base_pos_command': BasePositionCommand,
+    'base_vel_command': BaseVelocityCommand,
+    'arm_joint_command': ArmJointCommand,
+    'arm_ee_command': ArmEECommand,
+}
+
 DEFAULT_PAN = 0.00153398083057
 DEFAULT_TILT = 0.809941887856
 MIN_PAN = -2.7
@@ -31,27 +38,49 @@ def is_within_range(value, MIN, MAX):
     return (value <= MAX) and (value >= MIN)
 
 class LocobotInterface:
-    def __init__(self):
+    def __init__(self, compressed_images=False):
+        """
+        Args:
+            compressed_images: read the jpeg compressed color topic published
+                by image_transport, for when the env runs on another host.
+        """
         rospy.init_node('locobot_interface_sac')
 
-        self.action_pub = rospy.Publisher('/locobot_interface/commands', String, queue_size=10)
-        self.error_topic = '/locobot_interface/errors'
+        # base and arm commands are typed service calls that return once the
+        # motion finished, the connections are kept open between calls
         self.error_timeout = 30
-        self.moving = False
+        for name in COMMAND_SERVICES:
+            rospy.wait_for_service('/python3_server/' + name, self.error_timeout)
+        self._action_lock = threading.Lock()
+        self._command_proxies = {name: self._make_command_proxy(name) for name in COMMAND_SERVICES}
 
         self.grasp_pub = rospy.Publisher('/grasper/request', Empty, queue_size=10)
         self.grasp_topic = '/grasper/grasp'
 
         self.image_topic = '/camera/color/image_raw'
+        self.compressed_images = compressed_images
+        if compressed_images:
+            self.image_topic += '/compressed'
+        self._image_msg = None
+        self._image_cond = threading.Condition()
+        rospy.Subscriber(self.image_topic, CompressedImage if compressed_images else Image,
+                         self._callback_image, queue_size=1, buff_size=2 ** 24)
 
         self.gripper_close_pub = rospy.Publisher(
             ROSTOPIC_GRIPPER_CLOSE, Empty, queue_size=10)
         self.gripper_open_pub = rospy.Publisher(
             ROSTOPIC_GRIPPER_OPEN, Empty, queue_size=10)
+        self._gripper_state = -1
+        self._gripper_state_seq = 0
         self._gripper_state_lock = threading.RLock()
+        self._gripper_state_cond = threading.Condition(self._gripper_state_lock)
+        self.gripper_timeout = 5
         rospy.Subscriber('/gripper/state', Int8,
                          self._callback_gripper_state)
         
+        self._camera_pose_cond = threading.Condition()
+        # the joint states are stamped on the robot's clock, like the camera frames
+        self._joint_states_stamp = None
         rospy.Subscriber(
             '/joint_states',
             JointState,
@@ -67,158 +96,55 @@ class LocobotInterface:
         self.pan = None
         self.tilt = None
         self.tol = 0.01
+        self.pan_tilt_timeout = 3
 
         rospy.sleep(1)
 
-    def _publish_action(self, action):
-        self.action_id = random.getrandbits(16)
-        action['action_id'] = self.action_id
-        msg_string = json.dumps(action)
-        self.action_pub.publish(msg_string)
-
-    def _receive_error(self):
-        msg = rospy.wait_for_message(self.error_topic, String, self.error_timeout)
-        error = json.loads(msg.data)
-        if error['action_id'] == self.action_id:
-            return error
-        else:
-            raise Exception('Crossed threads, something is wrong')
-
-    def move_base_rel_pos(self, xyt, close_loop=False, smooth=False):
-        try:
-            if not self.moving:
-                self.moving = True
-
-                base_params = {}
-                base_params['mode'] = 'relative_position'
-
-                base_params['xyt'] = [xyt[0], xyt[1], xyt[2]]
-                base_params['close_loop'] = close_loop
-                base_params['smooth'] = smooth
-                base_params['xyt'] = [xyt[0], xyt[1], xyt[2]]
-                base_params['close_loop'] = close_loop
-                base_params['smooth'] = smooth
-
-                action_msg = {}
-                action_msg['base'] = base_params
-                self._publish_action(action_msg)
-                error = self._receive_error()
-
-                self.moving = False
-                return error['base']
-
-            else:
-                raise Exception('Cannot execute actions concurrently')
-        except Exception as e:
-            traceback.print_exc(e)
-            self.moving = False
-
-    def move_base_abs_pos(self, xyt, close_loop=False, smooth=False):
-        try:
-            if not self.moving:
-                self.moving = True
-
-                base_params = {}
-                base_params['mode'] = 'absolute_position'
-
-                base_params['xyt'] = [xyt[0], xyt[1], xyt[2]]
-                base_params['close_loop'] = close_loop
-                base_params['smooth'] = smooth
-                base_params['xyt'] = [xyt[0], xyt[1], xyt[2]]
-                base_params['close_loop'] = close_loop
-                base_params['smooth'] = smooth
-
-                action_msg = {}
-                action_msg['base'] = base_params
-                self._publish_action(action_msg)
-                error = self._receive_error()
-
-                self.moving = False
-                return error['base']
-
-            else:
-                raise Exception('Cannot execute actions concurrently')
-        except Exception as e:
-            traceback.print_exc(e)
-            self.moving = False
-
-    def move_base_vel(self, fwd_vel, turn_vel):
-        try:
-            if not self.moving:
-                self.moving = True
-
-                base_params = {}
-                base_params['mode'] = 'vel'
+    def _make_command_proxy(self, name):
+        return rospy.ServiceProxy('/python3_server/' + name, COMMAND_SERVICES[name], persistent=True)
 
-                base_params['fwd'] = fwd_vel
-                base_params['turn'] = turn_vel
+    def _call_command(self, name, *args):
+        """ Calls a command service and blocks until the server reports that the command finished
 
-                action_msg = {}
-                action_msg['base'] = base_params
-                self._publish_action(action_msg)
-                error = self._receive_error()
-
-                self.moving = False
-                return error['base']
-
-            else:
-                raise Exception('Cannot execute actions concurrently')
-        except Exception as e:
-            traceback.print_exc(e)
-            self.moving = False
-
-    def move_ee(self, xyz, pitch, roll=None, plan=False, wait=True, numerical=False):
-        try:
-            if not self.moving:
-                self.moving = True
-
-                arm_params = {}
-                arm_params['plan'] = plan
-                arm_params['wait'] = wait
-                arm_params['numerical'] = numerical
-                arm_params['mode'] = 'ee'
-                arm_params['xyz'] = xyz
-                arm_params['pitch'] = pitch
-                arm_params['roll'] = roll
-
-                action_msg = {}
-                action_msg['arm'] = arm_params
-                self._publish_action(action_msg)
-                error = self._receive_error()
-                print("xyz", xyz, "error", error)
-                self.moving = False
-                return error['arm']
-
-            else:
-                raise Exception('Cannot execute actions concurrently')
-        except Exception as e:
-            traceback.print_exc(e)
-            self.moving = False
-
-    def move_joints(self, joints, plan=False, wait=True):
+        :returns: the service response, None on failure
+        """
+        if not self._action_lock.acquire(blocking=False):
+            print('Cannot execute actions concurrently')
+            return None
         try:
-            if not self.moving:
-                self.moving = True
-
-                arm_params = {}
-                arm_params['plan'] = plan
-                arm_params['wait'] = wait
-                arm_params['mode'] = 'joint'
-                arm_params['positions'] = joints
+            return self._command_proxies[name](*args)
+        except (rospy.ServiceException, rospy.ROSException):
+            traceback.print_exc()
+            # reconnect on the next call, the persistent connection may be broken
+            self._command_proxies[name].close()
+            self._command_proxies[name] = self._make_command_proxy(name)
+        finally:
+            self._action_lock.release()
 
-                action_msg = {}
-                action_msg['arm'] = arm_params
-                self._publish_action(action_msg)
-                error = self._receive_error()
-
-                self.moving = False
-                return error['arm']
+    def move_base_rel_pos(self, xyt, close_loop=False, smooth=False):
+        resp = self._call_command('base_pos_command', xyt[0], xyt[1], xyt[2], True, close_loop, smooth)
+        return resp and resp.success
 
-            else:
-                raise Exception('Cannot execute actions concurrently')
-        except Exception as e:
-            traceback.print_exc(e)
-            self.moving = False
+    def move_base_abs_pos(self, xyt, close_loop=False, smooth=False):
+        resp = self._call_command('base_pos_command', xyt[0], xyt[1], xyt[2], False, close_loop, smooth)
+        return resp and resp.success
+
+    def move_base_vel(self, fwd_vel, turn_vel, exe_time=1):
+        resp = self._call_command('base_vel_command', fwd_vel, turn_vel, exe_time, False)
+        return resp and resp.success
+
+    def move_ee(self, xyz, pitch, roll=None, plan=False, wait=True, numerical=False, check_obstruction=False):
+        """ numerical is ignored, the server always solves the IK numerically """
+        roll = np.nan if roll is None else roll
+        resp = self._call_command('arm_ee_command', xyz[0], xyz[1], xyz[2], pitch, roll,
+                                  plan, wait, check_obstruction)
+        result = resp and resp.result
+        print("xyz", xyz, "result", result)
+        return result
+
+    def move_joints(self, joints, plan=False, wait=True, check_obstruction=False):
+        resp = self._call_command('arm_joint_command', *joints, plan, wait, check_obstruction)
+        return resp and resp.result
 
     def compute_grasp(self):
         try:
@@ -234,29 +160,58 @@ class LocobotInterface:
             traceback.print_exc(e)
             return None, -1
 
-    def get_image(self):
-        msg = rospy.wait_for_message(self.image_topic, Image, self.error_timeout)
-        img = np.frombuffer(msg.data, dtype=np.uint8).reshape(480,640,-1)
+    def get_image(self, after=None):
+        """
+        Waits for a camera frame captured after the given time, so that
+        frames taken before a motion finished are never returned.
+
+        :param after: rospy.Time on the robot's clock, defaults to the time of the call
+        """
+        if after is None:
+            after = self._robot_time()
+        with self._image_cond:
+            if not self._image_cond.wait_for(
+                    lambda: self._image_msg is not None and self._image_msg.header.stamp > after,
+                    timeout=self.error_timeout):
+                raise Exception('No camera frame on {}'.format(self.image_topic))
+            msg = self._image_msg
+        if self.compressed_images:
+            import cv2
+            img = cv2.imdecode(np.frombuffer(msg.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        else:
+            img = np.frombuffer(msg.data, dtype=np.uint8).reshape(480,640,-1)
         #img = resize(img, (48,48))
         #import pdb; pdb.set_trace()
         img = (img * 1).astype(np.uint8)#[:,:,::-1]
         
         return img
-    
+
+    def _callback_image(self, msg):
+        with self._image_cond:
+            self._image_msg = msg
+            self._image_cond.notify_all()
+
+    def _wait_for_gripper_state(self, states, seq):
+        """ Waits for a gripper state in states, published after the seq-th state message """
+        with self._gripper_state_cond:
+            return self._gripper_state_cond.wait_for(
+                lambda: self._gripper_state_seq > seq and self._gripper_state in states,
+                timeout=self.gripper_timeout)
+
     def close_gripper(self, wait=False):
+        with self._gripper_state_lock:
+            seq = self._gripper_state_seq
         self.gripper_close_pub.publish()
         if wait:
-            rospy.sleep(0.5)
-            while self.get_gripper_state() not in [2,3]:
-                #print("waiting for close, state is ", self.get_gripper_state() )
-                rospy.sleep(0.1)
+            self._wait_for_gripper_state([2, 3], seq)
             
     def open_gripper(self, wait=False):
+        with self._gripper_state_lock:
+            seq = self._gripper_state_seq
         self.gripper_open_pub.publish()
         if wait:
-            while self.get_gripper_state() not in [0]:
-                #print("waiting for open, state is ", self.get_gripper_state() )
-                rospy.sleep(0.1)
+            self._wait_for_gripper_state([0], seq)
         
     def get_gripper_state(self):
         """
@@ -288,17 +243,39 @@ class LocobotInterface:
         :param msg: Contains message published in topic
         :type msg: std_msgs/Int8
         """
-        self._gripper_state_lock.acquire()
-        self._gripper_state = msg.data
-        self._gripper_state_lock.release()
+        with self._gripper_state_cond:
+            self._gripper_state = msg.data
+            self._gripper_state_seq += 1
+            self._gripper_state_cond.notify_all()
         
+    def _robot_time(self):
+        """ The stamp of the next joint states message, i.e. the current time on the robot's clock,
+        or the local time if none arrives
+        """
+        with self._camera_pose_cond:
+            previous = self._joint_states_stamp
+            if self._camera_pose_cond.wait_for(
+                    lambda: self._joint_states_stamp is not previous, timeout=self.pan_tilt_timeout) \
+                    and not self._joint_states_stamp.is_zero():
+                return self._joint_states_stamp
+        return rospy.Time.now()
+
     def _camera_pose_callback(self, msg):
-        if "head_pan_joint" in msg.name:
-            pan_id = msg.name.index("head_pan_joint")
-            self.pan = msg.position[pan_id]
-        if "head_tilt_joint" in msg.name:
-            tilt_id = msg.name.index("head_tilt_joint")
-            self.tilt = msg.position[tilt_id]
+        with self._camera_pose_cond:
+            self._joint_states_stamp = msg.header.stamp
+            if "head_pan_joint" in msg.name:
+                pan_id = msg.name.index("head_pan_joint")
+                self.pan = msg.position[pan_id]
+            if "head_tilt_joint" in msg.name:
+                tilt_id = msg.name.index("head_tilt_joint")
+                self.tilt = msg.position[tilt_id]
+            self._camera_pose_cond.notify_all()
+
+    def _wait_for_camera_pose(self, get_angle, target):
+        with self._camera_pose_cond:
+            return self._camera_pose_cond.wait_for(
+                lambda: get_angle() is not None and np.fabs(get_angle() - target) < self.tol,
+                timeout=self.pan_tilt_timeout)
             
     def get_pan(self):
         """
@@ -334,10 +311,7 @@ class LocobotInterface:
         )
         self.set_pan_pub.publish(pan)
         if wait:
-            for i in range(30):
-                rospy.sleep(0.1)
-                if np.fabs(self.get_pan() - pan) < self.tol:
-                    break
+            self._wait_for_camera_pose(self.get_pan, pan)
 
     def set_tilt(self, tilt, wait=True):
         """
@@ -355,10 +329,7 @@ class LocobotInterface:
         )
         self.set_tilt_pub.publish(tilt)
         if wait:
-            for i in range(30):
-                rospy.sleep(0.1)
-                if np.fabs(self.get_tilt() - tilt) < self.tol:
-                    break
+            self._wait_for_camera_pose(self.get_tilt, tilt)
 
 if __name__ == '__main__':
     intf = LocobotInterface()
@@ -333,6 +333,7 @@ class RealLocobotGraspUncertaintyPerturbation(RealLocobotPerturbationBase):
                 lambda batch: self.process_batch_from_main_pool(batch))
         else:
             batch = self.buffer.random_batch(self.batch_size)
+        batch = self.algorithm._pad_training_batch(batch)
 
         sac_diagnostics = self.algorithm._do_training(self.training_iteration, batch)
         self.training_iteration += 1
@@ -510,6 +511,7 @@ class RealLocobotNavQPerturbation(RealLocobotPerturbationBase):
                 lambda batch: self.process_batch_from_main_pool(batch))
         else:
             batch = self.buffer.random_batch(self.batch_size)
+        batch = self.algorithm._pad_training_batch(batch)
 
         sac_diagnostics = self.algorithm._do_training(self.training_iteration, batch)
         self.training_iteration += 1
@@ -15,6 +15,8 @@ from softlearning.models.convnet import convnet_model
 from softlearning.models.feedforward import feedforward_model
 
 from softlearning.utils.times import timestamp
+from softlearning.utils.numpy import pad_batch
+from softlearning.utils.tensorflow import compiled_function, compute_gradients, masked_average_loss
 
 CURR_PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -84,32 +86,89 @@ def dprint(*args, **kwargs):
     # return
 
 class Discretizer:
+    """Converts between continuous actions, multi-indices and flat indices.
+
+    All conversions are vectorized over leading batch dimensions: continuous
+    actions and multi-indices have shape `(..., D)` and flat indices have
+    shape `(...)`. The continuous action of every flat index is precomputed
+    into a `(prod(sizes), D)` table, which backs `undiscretize_flat` and the
+    TF-side `tf_*` methods, so that samplers can sample and undiscretize
+    inside a `tf.function`.
+    """
+
     def __init__(self, sizes, mins, maxs):
         self._sizes = np.array(sizes)
         self._mins = np.array(mins) 
 
         self._maxs = np.array(maxs) 
 
+        self._total_dimensions = np.prod(self._sizes)
         self._step_sizes = (self._maxs - self._mins) / self._sizes
+        # Row-major strides, matching `np.ravel_multi_index(..., order='C')`.
+        self._strides = np.cumprod(
+            np.concatenate(([1], self._sizes[:0:-1])))[::-1]
+
+        self._undiscretized_table = self.undiscretize(np.stack(
+            np.unravel_index(np.arange(self._total_dimensions), self._sizes),
+            axis=-1)).astype(np.float32)
 
     @property
     def dimensions(self):
         return self._sizes
 
+    @property
+    def undiscretized_table(self):
+        return self._undiscretized_table
+
     def discretize(self, action):
-        centered = action - self._mins
-        indices = np.floor_divide(centered, self._step_sizes)
-        clipped = np.clip(indices, 0, self._sizes)
+        centered = np.asarray(action) - self._mins
+        indices = np.floor_divide(centered, self._step_sizes).astype(np.int64)
+        clipped = np.clip(indices, 0, self._sizes - 1)
         return clipped
 
     def undiscretize(self, action):
         return action * self._step_sizes + self._mins + self._step_sizes * 0.5
 
+    def undiscretize_flat(self, index):
+        return self._undiscretized_table[index]
+
     def flatten(self, action):
-        return np.ravel_multi_index(action, self._sizes, order='C')
+        return np.sum(
+            np.asarray(action, dtype=np.int64) * self._strides, axis=-1)
 
     def unflatten(self, index):
-        return np.array(np.unravel_index(index, self._sizes, order='C')).squeeze()
+        # Multi-indices are stacked along the last axis, so a batch of `N`
+        # flat indices unflattens into `(N, D)`, the layout `undiscretize`
+        # broadcasts over. This is the transpose of the `(D, N)` that
+        # `np.unravel_index` (and the old `np.array(...)` of it) gives;
+        # single indices, the only thing the samplers and envs unflatten,
+        # give `(D, )` either way. Squeezed so that single-element batches,
+        # e.g. the `(1, )` output of a deterministic model, unflatten into a
+        # single `(D, )` action.
+        return np.stack(
+            np.unravel_index(index, self._sizes, order='C'), axis=-1).squeeze()
+
+    def tf_discretize(self, action):
+        centered = tf.cast(action, tf.float32) - self._mins.astype(np.float32)
+        indices = tf.cast(tf.math.floor(
+            centered / self._step_sizes.astype(np.float32)), tf.int32)
+        clipped = tf.clip_by_value(indices, 0, self._sizes.astype(np.int32) - 1)
+        return clipped
+
+    def tf_flatten(self, action):
+        return tf.reduce_sum(
+            tf.cast(action, tf.int32) * self._strides.astype(np.int32),
+            axis=-1)
+
+    def tf_unflatten(self, index):
+        index = tf.convert_to_tensor(index, dtype=tf.int32)
+        multi_index = tf.transpose(tf.unravel_index(
+            tf.reshape(index, (-1, )), self._sizes.astype(np.int32)))
+        return tf.reshape(
+            multi_index, tf.concat((tf.shape(index), [len(self._sizes)]), 0))
+
+    def tf_undiscretize_flat(self, index):
+        return tf.gather(self._undiscretized_table, index)
 
 
 def build_image_discrete_policy(
@@ -169,7 +228,7 @@ def build_discrete_Q_model(
     return logits_model
 
 def create_train_discrete_Q_sigmoid(logits_model, optimizer, discrete_dimension):
-    @tf.function(experimental_relax_shapes=True)
+    @compiled_function
     def train(data):
         observations = data['observations']
         rewards = tf.cast(data['rewards'], tf.float32)
@@ -180,14 +239,68 @@ def create_train_discrete_Q_sigmoid(logits_model, optimizer, discrete_dimension)
             logits = logits_model(observations)
             taken_logits = tf.reduce_sum(logits * actions_onehot, axis=-1, keepdims=True)
             losses = tf.nn.sigmoid_cross_entropy_with_logits(labels=rewards, logits=taken_logits)
-            loss = tf.nn.compute_average_loss(losses)
+            loss = masked_average_loss(losses, data.get('mask'))
 
-        grads = tape.gradient(loss, logits_model.trainable_variables)
+        grads = compute_gradients(tape, loss, logits_model.trainable_variables, optimizer)
         optimizer.apply_gradients(zip(grads, logits_model.trainable_variables))
 
         return loss
     return train
 
+BOOTSTRAP_TYPES = ("poisson", "bernoulli")
+
+def validate_bootstrap_params(bootstrap_type, bernoulli_p):
+    if bootstrap_type not in BOOTSTRAP_TYPES:
+        raise ValueError(
+            f"{bootstrap_type} is not a valid bootstrap type, use one of {BOOTSTRAP_TYPES}.")
+    if bootstrap_type == "bernoulli" and not 0.0 < bernoulli_p <= 1.0:
+        raise ValueError(f"bernoulli_p must be in (0, 1], got {bernoulli_p}.")
+
+def create_train_discrete_Q_sigmoid_bootstrap(logits_models, optimizers, discrete_dimension, bootstrap_type="poisson", bernoulli_p=0.5):
+    """ Trains all the ensemble members in one step on a single batch.
+        Each member weights the batch with its own bootstrap mask, either Poisson(1) counts
+        or Bernoulli(bernoulli_p) inclusion, so the members see different resamples of the data.
+        The masks of all the members are drawn in one op. The members share the one sampled
+        batch instead of each getting their own `batch_size` samples: reweighting a batch is
+        the online form of the bootstrap, and it keeps a single copy of the images per step.
+    """
+    validate_bootstrap_params(bootstrap_type, bernoulli_p)
+    num_models = len(logits_models)
+
+    def sample_masks(batch_size):
+        shape = (num_models, batch_size, 1)
+        if bootstrap_type == "poisson":
+            return tf.random.poisson(shape, lam=1.0, dtype=tf.float32)
+        return tf.cast(tf.random.uniform(shape) < bernoulli_p, tf.float32)
+
+    @compiled_function
+    def train(data):
+        observations = data['observations']
+        rewards = tf.cast(data['rewards'], tf.float32)
+        actions_discrete = data['actions']
+        actions_onehot = tf.one_hot(actions_discrete[:, 0], depth=discrete_dimension)
+
+        masks = sample_masks(tf.shape(rewards)[0])
+        if 'mask' in data:
+            masks = masks * tf.cast(data['mask'], tf.float32)[tf.newaxis]
+        variables = [logits_model.trainable_variables for logits_model in logits_models]
+
+        with tf.GradientTape(persistent=True) as tape:
+            member_losses = []
+            for i, logits_model in enumerate(logits_models):
+                logits = logits_model(observations)
+                taken_logits = tf.reduce_sum(logits * actions_onehot, axis=-1, keepdims=True)
+                losses = tf.nn.sigmoid_cross_entropy_with_logits(labels=rewards, logits=taken_logits)
+                member_losses.append(tf.reduce_sum(masks[i] * losses) / tf.maximum(tf.reduce_sum(masks[i]), 1.0))
+        # each member loss only depends on its own model, so the gradients can be taken separately
+        for optimizer, member_loss, model_variables in zip(optimizers, member_losses, variables):
+            grads = compute_gradients(tape, member_loss, model_variables, optimizer)
+            optimizer.apply_gradients(zip(grads, model_variables))
+        del tape
+
+        return tf.add_n(member_losses) / num_models
+    return train
+
 GRASP_MODEL = {
     "alpha10min_6Q_stat_stat": os.path.join(CURR_PATH, 'grasp_models/alpha10min_6Q_stat_stat'),
     "alpha10mean_beta10std_stat_rand_color": os.path.join(CURR_PATH, 'grasp_models/alpha10mean_beta10std_stat_rand_color'),
@@ -235,16 +348,15 @@ class ReplayBuffer:
         return data
 
     def get_all_samples_in_batch(self, batch_size):
+        """ Every batch has exactly batch_size samples and a validity mask; the last one is padded. """
         datas = []
-        for i in range(0, (self._num // batch_size) * batch_size, batch_size):
+        for i in range(0, self._num, batch_size):
             data = {
                 'observations': self._observations[i:i+batch_size],
                 'actions': self._actions[i:i+batch_size],
                 'rewards': self._rewards[i:i+batch_size],
             }
-            datas.append(data)
-        if self._num % batch_size != 0:
-            datas.append(self.sample_batch(batch_size))
+            datas.append(pad_batch(data, (batch_size,)))
         return datas
     
     def get_all_samples_in_batch_random(self, batch_size):
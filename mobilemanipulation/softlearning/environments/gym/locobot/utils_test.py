@@ -0,0 +1,178 @@
+import numpy as np
+import tensorflow as tf
+
+from softlearning.environments.gym.locobot.utils import (
+    Discretizer,
+    create_train_discrete_Q_sigmoid,
+    create_train_discrete_Q_sigmoid_bootstrap)
+
+
+DISCRETE_DIMENSION = 4
+
+
+def create_logits_model():
+    return tf.keras.Sequential((
+        tf.keras.layers.Flatten(input_shape=(2, 2, 3)),
+        tf.keras.layers.Dense(DISCRETE_DIMENSION),
+    ))
+
+
+def copy_logits_model(logits_model):
+    copied_logits_model = create_logits_model()
+    copied_logits_model.set_weights(logits_model.get_weights())
+    return copied_logits_model
+
+
+class TrainDiscreteQSigmoidBootstrapTest(tf.test.TestCase):
+    def setUp(self):
+        self.logits_models = tuple(create_logits_model() for _ in range(3))
+        self.optimizers = tuple(
+            tf.optimizers.SGD(learning_rate=0.1) for _ in self.logits_models)
+        self.data = {
+            'observations': np.random.uniform(
+                size=(8, 2, 2, 3)).astype(np.float32),
+            'rewards': np.random.randint(0, 2, size=(8, 1)).astype(np.float32),
+            'actions': np.random.randint(
+                0, DISCRETE_DIMENSION, size=(8, 1)).astype(np.int32),
+        }
+
+    def test_invalid_params_raise_at_creation(self):
+        with self.assertRaisesRegex(ValueError, "bootstrap type"):
+            create_train_discrete_Q_sigmoid_bootstrap(
+                self.logits_models, self.optimizers, DISCRETE_DIMENSION,
+                bootstrap_type="jackknife")
+        with self.assertRaisesRegex(ValueError, "bernoulli_p"):
+            create_train_discrete_Q_sigmoid_bootstrap(
+                self.logits_models, self.optimizers, DISCRETE_DIMENSION,
+                bootstrap_type="bernoulli", bernoulli_p=0.0)
+
+    def test_full_masks_match_per_member_training(self):
+        expected_logits_models = tuple(
+            copy_logits_model(logits_model)
+            for logits_model in self.logits_models)
+        expected_trains = [
+            create_train_discrete_Q_sigmoid(
+                logits_model,
+                tf.optimizers.SGD(learning_rate=0.1),
+                DISCRETE_DIMENSION)
+            for logits_model in expected_logits_models
+        ]
+        train = create_train_discrete_Q_sigmoid_bootstrap(
+            self.logits_models, self.optimizers, DISCRETE_DIMENSION,
+            bootstrap_type="bernoulli", bernoulli_p=1.0)
+
+        loss = train(self.data)
+        expected_losses = [
+            expected_train(self.data) for expected_train in expected_trains]
+
+        self.assertAllClose(loss, np.mean(expected_losses))
+        for logits_model, expected_logits_model in zip(
+                self.logits_models, expected_logits_models):
+            for weights, expected_weights in zip(
+                    logits_model.get_weights(),
+                    expected_logits_model.get_weights()):
+                self.assertAllClose(weights, expected_weights)
+
+    def test_padded_rows_are_ignored(self):
+        expected_logits_models = tuple(
+            copy_logits_model(logits_model)
+            for logits_model in self.logits_models)
+        train = create_train_discrete_Q_sigmoid_bootstrap(
+            self.logits_models, self.optimizers, DISCRETE_DIMENSION,
+            bootstrap_type="bernoulli", bernoulli_p=1.0)
+        expected_train = create_train_discrete_Q_sigmoid_bootstrap(
+            expected_logits_models,
+            tuple(tf.optimizers.SGD(learning_rate=0.1)
+                  for _ in expected_logits_models),
+            DISCRETE_DIMENSION,
+            bootstrap_type="bernoulli", bernoulli_p=1.0)
+
+        padded_data = {
+            key: np.concatenate((value[:5], value[:3]), axis=0)
+            for key, value in self.data.items()
+        }
+        padded_data['mask'] = np.concatenate((
+            np.ones((5, 1), np.float32), np.zeros((3, 1), np.float32)))
+        train(padded_data)
+        expected_train({key: value[:5] for key, value in self.data.items()})
+
+        for logits_model, expected_logits_model in zip(
+                self.logits_models, expected_logits_models):
+            for weights, expected_weights in zip(
+                    logits_model.get_weights(),
+                    expected_logits_model.get_weights()):
+                self.assertAllClose(weights, expected_weights)
+
+    def test_poisson_masks_differ_between_members(self):
+        initial_weights = [
+            logits_model.get_weights() for logits_model in self.logits_models]
+        for logits_model in self.logits_models[1:]:
+            logits_model.set_weights(initial_weights[0])
+        train = create_train_discrete_Q_sigmoid_bootstrap(
+            self.logits_models, self.optimizers, DISCRETE_DIMENSION,
+            bootstrap_type="poisson")
+
+        data = {
+            key: np.tile(value, (16, ) + (1, ) * (value.ndim - 1))
+            for key, value in self.data.items()
+        }
+        train(data)
+
+        # Started from the same weights, so they only differ by their masks.
+        kernels = [
+            logits_model.get_weights()[0]
+            for logits_model in self.logits_models]
+        self.assertNotAllClose(kernels[0], kernels[1])
+        self.assertNotAllClose(kernels[0], kernels[2])
+
+
+class DiscretizerTest(tf.test.TestCase):
+    def setUp(self):
+        self.discretizer = Discretizer((3, 4), (-1.0, 0.0), (1.0, 2.0))
+        self.indices = np.array([0, 5, 7, 11])
+        self.multi_indices = np.array([[0, 0], [1, 1], [1, 3], [2, 3]])
+
+    def test_unflatten_shapes(self):
+        multi_indices = self.discretizer.unflatten(self.indices)
+        self.assertEqual(multi_indices.shape, (4, 2))
+        self.assertAllEqual(multi_indices, self.multi_indices)
+
+        self.assertAllEqual(self.discretizer.unflatten(7), (1, 3))
+        self.assertAllEqual(self.discretizer.unflatten(np.array([7])), (1, 3))
+
+    def test_flatten_round_trip(self):
+        self.assertAllEqual(
+            self.discretizer.flatten(self.multi_indices), self.indices)
+        self.assertAllEqual(
+            self.discretizer.unflatten(
+                self.discretizer.flatten(self.multi_indices)),
+            self.multi_indices)
+
+    def test_undiscretize_flat_matches_undiscretize(self):
+        actions = self.discretizer.undiscretize_flat(self.indices)
+        self.assertEqual(actions.shape, (4, 2))
+        self.assertAllClose(
+            actions,
+            self.discretizer.undiscretize(
+                self.discretizer.unflatten(self.indices)))
+        self.assertAllEqual(
+            self.discretizer.discretize(actions), self.multi_indices)
+
+    def test_tf_methods_match_numpy(self):
+        self.assertAllEqual(
+            self.discretizer.tf_unflatten(self.indices), self.multi_indices)
+        self.assertAllEqual(
+            self.discretizer.tf_unflatten(self.indices.reshape(2, 2)),
+            self.multi_indices.reshape(2, 2, 2))
+        self.assertAllEqual(
+            self.discretizer.tf_flatten(self.multi_indices), self.indices)
+
+        actions = self.discretizer.undiscretize_flat(self.indices)
+        self.assertAllClose(
+            self.discretizer.tf_undiscretize_flat(self.indices), actions)
+        self.assertAllEqual(
+            self.discretizer.tf_discretize(actions), self.multi_indices)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -38,6 +38,13 @@ class FrameStack(Box):
     def process_batch(cls, batch):
         """ 
             batch: [batch_size, 1] array of FrameStack.Stack objects
-            returns: [batch_size, shape] array
+            returns: [batch_size, shape] array, in the dtype of the frames (uint8 for images)
         """
-        return np.concatenate([stack.numpy()[np.newaxis, ...] for stack in batch.squeeze()], axis=0)
\ No newline at end of file
+        stacks = batch.reshape(-1)
+        frames = stacks[0].frames
+        stacked_shape = frames[0].shape[:-1] + (sum(frame.shape[-1] for frame in frames),)
+        # concatenate every stack straight into the batch, without a temporary per stack
+        stacked = np.empty((stacks.shape[0],) + stacked_shape, dtype=frames[0].dtype)
+        for i, stack in enumerate(stacks):
+            np.concatenate(stack.frames, axis=-1, out=stacked[i])
+        return stacked
\ No newline at end of file
@@ -5,6 +5,7 @@ from tensorflow.keras import layers
 import tree
 
 from softlearning.keras.layers import AddCoord2D
+from softlearning.utils.tensorflow import mixed_precision_policy
 
 tfk = tf.keras
 tfkl = tf.keras.layers
@@ -13,6 +14,27 @@ tfd = tfp.distributions
 tfb = tfp.bijectors
 
 
+def normalize_image(image, compute_dtype='float32'):
+    """Map an image to [-1, 1] in `compute_dtype`.
+
+    uint8 images are only cast here, inside the graph, so that they can stay
+    uint8 in the pools, the batches and the host-to-device copies. Float
+    images are assumed to already be in [0, 1].
+    """
+    if image.dtype == tf.uint8:
+        return tf.cast(image, compute_dtype) * (2.0 / 255.0) - 1.0
+    return (tf.cast(image, compute_dtype) - 0.5) * 2.0
+
+
+def preprocess_images(x, compute_dtype='float32'):
+    """Normalize, and concatenate images along last axis."""
+    x = tree.map_structure(
+        lambda image: normalize_image(image, compute_dtype), x)
+    x = tree.flatten(x)
+    x = tf.concat(x, axis=-1)
+    return x
+
+
 def convnet_model(
         conv_filters=(64, 64, 64),
         conv_kernel_sizes=(3, 3, 3),
@@ -35,6 +57,9 @@ def convnet_model(
         None: None,
     }[normalization_type]
 
+    # None keeps the default float32 policy.
+    dtype = mixed_precision_policy()
+
     def conv_block(conv_filter, conv_kernel_size, conv_stride):
         block_parts = []
             
@@ -45,42 +70,44 @@ def convnet_model(
                 strides=(conv_stride if downsampling_type == 'conv' else 1),
                 padding=padding,
                 activation='linear',
+                dtype=dtype,
                 *args,
                 **kwargs)
         ]
 
         if normalization_layer is not None:
-            block_parts += [normalization_layer(**normalization_kwargs)]
+            block_parts += [normalization_layer(
+                **{'dtype': dtype, **normalization_kwargs})]
 
-        block_parts += [(layers.Activation(activation)
+        block_parts += [(layers.Activation(activation, dtype=dtype)
                             if isinstance(activation, str)
-                            else activation())]
+                            else activation(dtype=dtype))]
 
         if downsampling_type == 'pool' and conv_stride > 1:
             block_parts += [getattr(layers, 'AvgPool2D')(
-                pool_size=conv_stride, strides=conv_stride)]
+                pool_size=conv_stride, strides=conv_stride, dtype=dtype)]
 
         block = tfk.Sequential(block_parts) #, name='conv_block')
         return block
 
-    def preprocess(x):
-        """Cast to float, normalize, and concatenate images along last axis."""
-        x = tree.map_structure(
-            lambda image: tf.image.convert_image_dtype(image, tf.float32), x)
-        x = tree.flatten(x)
-        x = tf.concat(x, axis=-1)
-        x = (tf.image.convert_image_dtype(x, tf.float32) - 0.5) * 2.0
-        return x
+    output_layers = (tfkl.Flatten(dtype=dtype), )
+    if dtype is not None:
+        # Heads and losses downstream of the trunk always stay in float32.
+        output_layers += (tfkl.Activation('linear', dtype=tf.float32), )
 
-    
     model = tf.keras.Sequential((
-        tfkl.Lambda(preprocess),
+        tfkl.Lambda(
+            preprocess_images,
+            arguments={
+                'compute_dtype': 'float32' if dtype is None else dtype.compute_dtype,
+            },
+            dtype=dtype),
         *[
             conv_block(conv_filter, conv_kernel_size, conv_stride)
             for (conv_filter, conv_kernel_size, conv_stride) in
             zip(conv_filters, conv_kernel_sizes, conv_strides)
         ],
-        tfkl.Flatten(),
+        *output_layers,
     ), name=name)
 
     return model
@@ -0,0 +1,43 @@
+import numpy as np
+import tensorflow as tf
+
+from softlearning.models.convnet import convnet_model, preprocess_images
+
+
+class ConvnetTest(tf.test.TestCase):
+
+    def test_uint8_and_float_images_match(self):
+        """uint8 images are normalized in-graph like the equivalent floats."""
+        images_uint8 = np.random.randint(
+            0, 256, size=(2, 8, 8, 3), dtype=np.uint8)
+        images_float = images_uint8.astype(np.float32) / 255.0
+
+        self.assertAllClose(
+            preprocess_images(images_uint8),
+            preprocess_images(images_float),
+            atol=1e-6)
+
+        normalized = preprocess_images(images_uint8).numpy()
+        self.assertEqual(normalized.dtype, np.float32)
+        self.assertGreaterEqual(normalized.min(), -1.0)
+        self.assertLessEqual(normalized.max(), 1.0)
+
+    def test_clone_model(self):
+        """Make sure that the preprocessing survives cloning."""
+        images = np.random.randint(0, 256, size=(2, 8, 8, 3), dtype=np.uint8)
+
+        model = convnet_model(
+            conv_filters=(4, ),
+            conv_kernel_sizes=(3, ),
+            conv_strides=(2, ))
+        model(images)
+
+        clone = tf.keras.Sequential.from_config(model.get_config())
+        clone(images)
+        clone.set_weights(model.get_weights())
+
+        self.assertAllClose(model(images), clone(images))
+
+
+if __name__ == '__main__':
+    tf.test.main()
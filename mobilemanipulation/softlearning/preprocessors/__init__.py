@@ -1,13 +1,80 @@
+import contextlib
+import weakref
+
 from softlearning.utils.serialization import (
     serialize_softlearning_object, deserialize_softlearning_object)
+from .shared import SharedPreprocessor, shared_features  # noqa: unused-import
+
+
+_SHARED_PREPROCESSORS = None
+_SHARED_PREPROCESSOR_MODELS = weakref.WeakSet()
+
+
+@contextlib.contextmanager
+def shared_preprocessors(enabled=True):
+    """Share preprocessors by `shared_name` while building models.
+
+    Inside this scope, every preprocessor created with the same
+    `shared_name` is the same model instance, so e.g. the Q functions of an
+    algorithm all use one image encoder. Copies made later on, like the target Q-functions or the
+    evaluation policies built from a serialized config, get their own
+    encoder. `enabled=False` builds unshared preprocessors inside an
+    enclosing scope.
+    """
+    global _SHARED_PREPROCESSORS
+    previous_shared_preprocessors = _SHARED_PREPROCESSORS
+    _SHARED_PREPROCESSORS = {} if enabled else None
+    try:
+        yield
+    finally:
+        _SHARED_PREPROCESSORS = previous_shared_preprocessors
+
 
+def _shared_variable_refs():
+    return {
+        variable.ref()
+        for model in _SHARED_PREPROCESSOR_MODELS
+        for variable in model.variables
+    }
 
-def convnet_preprocessor(name='convnet_preprocessor', **kwargs):
+
+def exclude_shared_variables(variables):
+    """Filter out the variables owned by shared preprocessors.
+
+    A shared encoder is trained by a single optimizer, the first
+    Q-function's, on the sum of the critic losses. The other models that
+    consume its features only train their heads.
+    """
+    shared_variable_refs = _shared_variable_refs()
+    return [
+        variable for variable in variables
+        if variable.ref() not in shared_variable_refs
+    ]
+
+
+def shared_variables(variables):
+    """The variables owned by shared preprocessors, see above."""
+    shared_variable_refs = _shared_variable_refs()
+    return [
+        variable for variable in variables
+        if variable.ref() in shared_variable_refs
+    ]
+
+
+def convnet_preprocessor(name='convnet_preprocessor', shared_name=None, **kwargs):
     from softlearning.models.convnet import convnet_model
 
-    preprocessor = convnet_model(name=name, **kwargs)
+    if shared_name is None or _SHARED_PREPROCESSORS is None:
+        return convnet_model(name=name, **kwargs)
+
+    if shared_name not in _SHARED_PREPROCESSORS:
+        preprocessor = SharedPreprocessor(
+            convnet_model(name=shared_name, **kwargs).layers,
+            name=shared_name)
+        _SHARED_PREPROCESSORS[shared_name] = preprocessor
+        _SHARED_PREPROCESSOR_MODELS.add(preprocessor)
 
-    return preprocessor
+    return _SHARED_PREPROCESSORS[shared_name]
 
 
 def serialize(preprocessor):
@@ -0,0 +1,49 @@
+import contextlib
+
+import tensorflow as tf
+import tree
+
+
+_SHARED_FEATURES = None
+
+
+@contextlib.contextmanager
+def shared_features():
+    """Run every shared preprocessor at most once per input in this scope.
+
+    Inside this scope, a `SharedPreprocessor` called again on the same input
+    tensor returns the features it computed the first time, so the policy
+    and all the Q-functions of one update consume a single encoder pass over
+    the batch. The features are kept only until the scope exits.
+    """
+    global _SHARED_FEATURES
+    previous_shared_features = _SHARED_FEATURES
+    _SHARED_FEATURES = {}
+    try:
+        yield
+    finally:
+        _SHARED_FEATURES = previous_shared_features
+
+
+class SharedPreprocessor(tf.keras.Sequential):
+    """A preprocessor used by several models of one algorithm.
+
+    Outside of a `shared_features` scope this is a plain `Sequential`.
+    """
+
+    def __call__(self, inputs, *args, **kwargs):
+        if _SHARED_FEATURES is None:
+            return super(SharedPreprocessor, self).__call__(
+                inputs, *args, **kwargs)
+
+        key = (id(self), tuple(x.ref() for x in tree.flatten(inputs)))
+        if key not in _SHARED_FEATURES:
+            _SHARED_FEATURES[key] = super(SharedPreprocessor, self).__call__(
+                inputs, *args, **kwargs)
+
+        return _SHARED_FEATURES[key]
+
+
+# Models that contain a shared preprocessor, e.g. the deepcopied target
+# Q-functions, are rebuilt from their config.
+tf.keras.utils.get_custom_objects()['SharedPreprocessor'] = SharedPreprocessor
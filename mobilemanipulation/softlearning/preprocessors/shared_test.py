@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from copy import deepcopy
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from softlearning import preprocessors
+from softlearning.value_functions.vanilla import feedforward_Q_function
+
+
+class SharedPreprocessorTest(tf.test.TestCase):
+    def setUp(self):
+        self.observation_shapes = OrderedDict((
+            ('pixels', tf.TensorShape((8, 8, 3))),
+        ))
+        self.action_shape = tf.TensorShape((2, ))
+        self.convnet_preprocessor = {
+            'class_name': 'convnet_preprocessor',
+            'config': {
+                'conv_filters': (4, ),
+                'conv_kernel_sizes': (3, ),
+                'conv_strides': (2, ),
+                'shared_name': 'pixels_encoder',
+            },
+        }
+
+        with preprocessors.shared_preprocessors():
+            self.Qs = tuple(self._create_Q() for _ in range(2))
+
+        self.observations = OrderedDict((
+            ('pixels', tf.constant(
+                np.random.randint(0, 256, size=(5, 8, 8, 3)),
+                dtype=tf.uint8)),
+        ))
+        self.actions = tf.constant(
+            np.random.uniform(size=(5, 2)).astype(np.float32))
+
+    def _create_Q(self):
+        return feedforward_Q_function(
+            input_shapes=(self.observation_shapes, self.action_shape),
+            output_size=1,
+            hidden_layer_sizes=(8, ),
+            preprocessors=({'pixels': self.convnet_preprocessor}, None))
+
+    def _shared_variables(self):
+        return preprocessors.shared_variables(self.Qs[0].trainable_variables)
+
+    def test_encoder_runs_once(self):
+        @tf.function
+        def values(observations, actions):
+            with preprocessors.shared_features():
+                return tuple(
+                    Q.values(observations, actions) for Q in self.Qs)
+
+        graph = values.get_concrete_function(
+            self.observations, self.actions).graph
+        num_convolutions = sum(
+            operation.type == 'Conv2D'
+            for operation in graph.get_operations())
+        self.assertEqual(num_convolutions, 1)
+
+    def test_gradients_match_unshared(self):
+        shared_variables = self._shared_variables()
+        self.assertTrue(shared_variables)
+
+        with tf.GradientTape() as tape, preprocessors.shared_features():
+            loss = tf.add_n([
+                tf.reduce_mean(Q.values(self.observations, self.actions))
+                for Q in self.Qs
+            ])
+        gradients = tape.gradient(loss, shared_variables)
+
+        expected_gradients = [tf.zeros_like(x) for x in shared_variables]
+        for Q in self.Qs:
+            with tf.GradientTape() as tape:
+                loss = tf.reduce_mean(Q.values(self.observations, self.actions))
+            expected_gradients = [
+                expected_gradient + gradient
+                for expected_gradient, gradient in zip(
+                    expected_gradients, tape.gradient(loss, shared_variables))
+            ]
+
+        for gradient, expected_gradient in zip(gradients, expected_gradients):
+            self.assertAllClose(gradient, expected_gradient)
+
+    def test_checkpoint_round_trip(self):
+        save_paths = [
+            os.path.join(self.get_temp_dir(), f'Q-{i}')
+            for i in range(len(self.Qs))
+        ]
+        for save_path, Q in zip(save_paths, self.Qs):
+            Q.save_weights(save_path, save_format='tf')
+        expected_values = [
+            Q.values(self.observations, self.actions) for Q in self.Qs]
+
+        for variable in self.Qs[0].trainable_variables:
+            variable.assign(tf.zeros_like(variable))
+
+        for save_path, Q in zip(save_paths, self.Qs):
+            Q.load_weights(save_path)
+        for Q, expected in zip(self.Qs, expected_values):
+            self.assertAllClose(
+                Q.values(self.observations, self.actions), expected)
+
+    def test_restores_unshared_checkpoint(self):
+        unshared_Q = self._create_Q()
+        save_path = os.path.join(self.get_temp_dir(), 'unshared-Q')
+        unshared_Q.save_weights(save_path, save_format='tf')
+
+        self.Qs[0].load_weights(save_path)
+        self.assertAllClose(
+            self.Qs[0].values(self.observations, self.actions),
+            unshared_Q.values(self.observations, self.actions))
+
+    def test_weights_match_unshared(self):
+        unshared_Q = self._create_Q()
+        self.assertEqual(
+            [x.shape for x in unshared_Q.get_weights()],
+            [x.shape for x in self.Qs[0].get_weights()])
+
+        unshared_Q.set_weights(self.Qs[0].get_weights())
+        self.assertAllClose(
+            unshared_Q.values(self.observations, self.actions),
+            self.Qs[0].values(self.observations, self.actions))
+
+    def test_deepcopy_gets_own_encoder(self):
+        Q_target = deepcopy(self.Qs[0])
+        self.assertAllClose(
+            Q_target.values(self.observations, self.actions),
+            self.Qs[0].values(self.observations, self.actions))
+
+        target_variable_refs = {
+            x.ref() for x in Q_target.trainable_variables}
+        self.assertFalse(any(
+            x.ref() in target_variable_refs
+            for x in self._shared_variables()))
+
+
+if __name__ == '__main__':
+    tf.test.main()
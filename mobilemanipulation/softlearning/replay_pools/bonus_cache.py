@@ -0,0 +1,135 @@
+import numpy as np
+
+from .flexible_replay_pool import Field, SAMPLE_INDEX_FIELDS
+
+
+def bonus_field(name):
+    """Optional pool field for a cached per-sample bonus.
+
+    Samples are added without it, which marks them as not yet computed.
+    """
+    return Field(
+        name=name,
+        dtype='float32',
+        shape=(1, ),
+        default_value=np.nan,
+        optional=True)
+
+
+def bonus_fields(name):
+    """Pool fields for a bonus read through a `BonusCache`.
+
+    Besides the bonus itself, the pool stores the sample indices that the
+    cache writes the bonuses computed on read back to.
+    """
+    return {name: bonus_field(name), **SAMPLE_INDEX_FIELDS}
+
+
+class BonusCache:
+    """Reads per-sample bonuses, e.g. intrinsic rewards, from a pool field.
+
+    Instead of recomputing `bonus_fn` for every sampled training batch, the
+    bonuses are stored in `pool.data[field_name]` and read back with the
+    batch. Rows that have not been computed yet (the `bonus_field` default,
+    or batches sampled from another pool without the field) are computed on
+    read, and written back to the pool if the batch carries their
+    `sample_indices`. Every `refresh_interval` reads, the next samples of
+    the pool are recomputed in chunks of `sweep_batch_size`, round robin,
+    so that the stored bonuses track the learner they are computed from.
+    Each sweep covers `refresh_interval / max_staleness` of the pool, so
+    that once the pool stops growing, every stored bonus is at most
+    `max_staleness` reads old. The sweeps then cost
+    `pool.size / max_staleness` samples per read, e.g. 10 samples for a
+    pool of 1e5 with the defaults, instead of a whole batch.
+
+    `bonus_fn` takes the `observations_key` entry of a batch and returns the
+    unnormalized bonuses with shape [batch_size, 1].
+    """
+
+    def __init__(self,
+                 pool,
+                 field_name,
+                 bonus_fn,
+                 observations_key='next_observations',
+                 refresh_interval=100,
+                 max_staleness=10000,
+                 sweep_batch_size=1024):
+        self.pool = pool
+        self.field_name = field_name
+        self.bonus_fn = bonus_fn
+        self.observations_key = observations_key
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.sweep_batch_size = sweep_batch_size
+
+        self._num_reads = 0
+        self._sweep_pointer = 0
+        self._num_computed_on_read = 0
+        self._num_swept = 0
+
+    def _compute(self, observations):
+        return np.reshape(
+            self.bonus_fn(observations), (-1, 1)).astype(np.float32)
+
+    def __call__(self, batch):
+        """Returns the bonuses for `batch`, computing the missing ones."""
+        observations = batch[self.observations_key]
+
+        self._num_reads += 1
+        if self._num_reads % self.refresh_interval == 0:
+            self.sweep()
+
+        if self.field_name not in batch:
+            bonuses = self._compute(observations)
+            self._num_computed_on_read += bonuses.shape[0]
+            return bonuses
+
+        bonuses = np.array(batch[self.field_name], dtype=np.float32)
+        missing = np.isnan(bonuses[:, 0])
+        if np.any(missing):
+            missing_observations = {
+                key: value[missing] for key, value in observations.items()
+            } if isinstance(observations, dict) else observations[missing]
+            bonuses[missing] = self._compute(missing_observations)
+            self._num_computed_on_read += int(np.sum(missing))
+
+            if 'sample_indices' in batch:
+                sample_indices = batch['sample_indices'][:, 0]
+                # Rows sampled from another pool have no index in this one.
+                write_back = missing & (0 <= sample_indices)
+                self.pool.data[self.field_name][
+                    sample_indices[write_back]] = bonuses[write_back]
+
+        return bonuses
+
+    @property
+    def sweep_size(self):
+        return min(
+            int(np.ceil(
+                self.pool.size * self.refresh_interval / self.max_staleness)),
+            self.pool.size)
+
+    def sweep(self):
+        """Recomputes the stored bonuses of the next `sweep_size` samples."""
+        if self.pool.size == 0:
+            return
+
+        sweep_size = self.sweep_size
+        indices = (
+            self._sweep_pointer + np.arange(sweep_size)) % self.pool.size
+        self._sweep_pointer = (
+            self._sweep_pointer + sweep_size) % self.pool.size
+
+        for start in range(0, sweep_size, self.sweep_batch_size):
+            chunk_indices = indices[start:start + self.sweep_batch_size]
+            chunk = self.pool.batch_by_indices(chunk_indices)
+            self.pool.data[self.field_name][chunk_indices] = self._compute(
+                chunk[self.observations_key])
+
+        self._num_swept += sweep_size
+
+    def get_diagnostics(self):
+        return {
+            f'{self.field_name}-computed_on_read': self._num_computed_on_read,
+            f'{self.field_name}-swept': self._num_swept,
+        }
@@ -0,0 +1,145 @@
+import unittest
+import numpy as np
+
+from softlearning.replay_pools.flexible_replay_pool import (
+    FlexibleReplayPool, Field)
+from softlearning.replay_pools.bonus_cache import BonusCache, bonus_fields
+
+
+def create_pool(max_size=100):
+    return FlexibleReplayPool(
+        max_size=max_size,
+        fields={
+            'next_observations': Field(
+                name='next_observations',
+                shape=(1, ),
+                dtype='float32'),
+            **bonus_fields('bonuses'),
+        }
+    )
+
+
+class BonusCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = create_pool(100)
+        self.num_calls = 0
+        self.scale = 1.0
+
+    def bonus_fn(self, next_observations):
+        self.num_calls += 1
+        return next_observations * self.scale
+
+    def add_samples(self, num_samples):
+        self.pool.add_samples({
+            'next_observations': np.random.uniform(
+                0, 1, (num_samples, 1)).astype(np.float32),
+        })
+
+    def test_optional_field_default(self):
+        self.add_samples(10)
+        self.assertTrue(np.all(np.isnan(self.pool.data['bonuses'][:10])))
+
+    def test_computes_missing_bonuses_on_read(self):
+        cache = BonusCache(
+            self.pool, 'bonuses', self.bonus_fn, refresh_interval=1000)
+        self.add_samples(10)
+
+        batch = self.pool.random_batch(5)
+        bonuses = cache(batch)
+        np.testing.assert_allclose(bonuses, batch['next_observations'])
+        self.assertEqual(self.num_calls, 1)
+
+        batch = self.pool.conform_batch({
+            'next_observations': np.ones((3, 1), dtype=np.float32),
+            'other_field': np.ones((3, 1)),
+        })
+        self.assertNotIn('other_field', batch)
+        np.testing.assert_allclose(cache(batch), np.ones((3, 1)))
+
+    def test_writes_back_bonuses_computed_on_read(self):
+        cache = BonusCache(
+            self.pool, 'bonuses', self.bonus_fn, refresh_interval=1000)
+        self.add_samples(10)
+        np.testing.assert_array_equal(
+            self.pool.data['sample_indices'][:10, 0], np.arange(10))
+
+        batch = self.pool.batch_by_indices(np.array([2, 5]))
+        cache(batch)
+        np.testing.assert_allclose(
+            self.pool.data['bonuses'][[2, 5]],
+            self.pool.data['next_observations'][[2, 5]])
+        self.assertEqual(
+            np.sum(np.isnan(self.pool.data['bonuses'][:10])), 8)
+
+        # Rows conformed from another pool are not written back.
+        other_batch = self.pool.conform_batch(
+            self.pool.batch_by_indices(np.array([3])))
+        np.testing.assert_array_equal(other_batch['sample_indices'], [[-1]])
+        cache(other_batch)
+        self.assertTrue(np.isnan(self.pool.data['bonuses'][3, 0]))
+
+    def test_sweeps_amortize_bonus_calls(self):
+        num_samples_computed = []
+
+        def bonus_fn(next_observations):
+            num_samples_computed.append(next_observations.shape[0])
+            return next_observations * self.scale
+
+        cache = BonusCache(
+            self.pool,
+            'bonuses',
+            bonus_fn,
+            refresh_interval=10,
+            max_staleness=100)
+        self.add_samples(100)
+        self.pool.data['bonuses'][:] = self.pool.data['next_observations']
+        self.assertEqual(cache.sweep_size, 10)
+
+        num_batches, batch_size = 100, 32
+        self.scale = 2.0
+        for _ in range(num_batches):
+            cache(self.pool.random_batch(batch_size))
+
+        # One call per sweep, a single sample per sampled batch.
+        self.assertEqual(len(num_samples_computed), num_batches // 10)
+        self.assertEqual(sum(num_samples_computed) / num_batches, 1)
+
+        # Within `max_staleness` reads, every bonus was recomputed.
+        np.testing.assert_allclose(
+            self.pool.data['bonuses'],
+            2.0 * self.pool.data['next_observations'])
+
+    def test_sweep_refreshes_stale_bonuses(self):
+        cache = BonusCache(
+            self.pool,
+            'bonuses',
+            self.bonus_fn,
+            refresh_interval=2,
+            max_staleness=4,
+            sweep_batch_size=16)
+        self.add_samples(100)
+
+        cache.sweep()
+        cache.sweep()
+        np.testing.assert_allclose(
+            self.pool.data['bonuses'], self.pool.data['next_observations'])
+
+        # Cached bonuses are read without calling `bonus_fn`.
+        self.scale = 2.0
+        num_calls = self.num_calls
+        batch = self.pool.random_batch(32)
+        np.testing.assert_allclose(cache(batch), batch['next_observations'])
+        self.assertEqual(self.num_calls, num_calls)
+
+        # The second read sweeps the first half of the pool.
+        cache(self.pool.random_batch(32))
+        np.testing.assert_allclose(
+            self.pool.data['bonuses'][:50],
+            2.0 * self.pool.data['next_observations'][:50])
+        np.testing.assert_allclose(
+            self.pool.data['bonuses'][50:],
+            self.pool.data['next_observations'][50:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,7 @@ class Field:
     initializer: Callable = np.zeros
     default_value: Number = 0.0
     postprocess_fn: Callable = None  # called on [batch_size, *shape] array after being sampled
+    optional: bool = False  # samples may leave it out, it's then filled with default_value
 
 def field_from_gym_space(name, space):
     if isinstance(space, FrameStack):
@@ -56,6 +57,18 @@ INDEX_FIELDS = {
     ),
 }
 
+# Optional field that pools can include to store the index of every sample,
+# so that values computed from a sampled batch can be written back.
+SAMPLE_INDEX_FIELDS = {
+    'sample_indices': Field(
+        name='sample_indices',
+        dtype='int64',
+        shape=(1, ),
+        default_value=-1,
+        optional=True,
+    ),
+}
+
 
 class FlexibleReplayPool(ReplayPool):
     def __init__(self, max_size, fields):
@@ -110,8 +123,37 @@ class FlexibleReplayPool(ReplayPool):
         samples = tree.map_structure(lambda x: x[np.newaxis, ...], sample)
         self.add_samples(samples)
 
+    def _fill_optional_fields(self, samples, num_samples):
+        for field_name, field in self.fields.items():
+            if (isinstance(field, Field)
+                and field.optional
+                and field_name not in samples):
+                samples[field_name] = np.full(
+                    (num_samples, *field.shape),
+                    field.default_value,
+                    dtype=field.dtype)
+        return samples
+
+    def conform_batch(self, batch):
+        """Conform a batch sampled from another pool to the fields of this one.
+
+        Optional fields that the batch is missing are filled with their
+        default value and fields that this pool doesn't have are dropped, so
+        that the batch can be concatenated with batches from this pool.
+        Sample indices refer to the other pool, so they are reset to their
+        default.
+        """
+        num_samples = tree.flatten(batch)[0].shape[0]
+        batch = {
+            field_name: values
+            for field_name, values in batch.items()
+            if field_name in self.fields and field_name != 'sample_indices'
+        }
+        return self._fill_optional_fields(batch, num_samples)
+
     def add_samples(self, samples):
         num_samples = tree.flatten(samples)[0].shape[0]
+        samples = self._fill_optional_fields(dict(samples), num_samples)
 
         assert (('episode_index_forwards' in samples.keys())
                 is ('episode_index_backwards' in samples.keys()))
@@ -127,6 +169,8 @@ class FlexibleReplayPool(ReplayPool):
 
         index = np.arange(
             self._pointer, self._pointer + num_samples) % self._max_size
+        if 'sample_indices' in self.fields:
+            samples['sample_indices'] = index[:, np.newaxis]
 
         def add_sample(path, data, new_values, field):
             assert new_values.shape[0] == num_samples, (
@@ -45,6 +45,7 @@ class SharedReplayPool(FlexibleReplayPool):
 
     def add_samples(self, samples):
         num_samples = tree.flatten(samples)[0].shape[0]
+        samples = self._fill_optional_fields(dict(samples), num_samples)
 
         assert (('episode_index_forwards' in samples.keys())
                 is ('episode_index_backwards' in samples.keys()))
@@ -60,6 +61,8 @@ class SharedReplayPool(FlexibleReplayPool):
 
         index = np.arange(
             self._pointer, self._pointer + num_samples) % self._max_size
+        if 'sample_indices' in self.fields:
+            samples['sample_indices'] = index[:, np.newaxis]
 
         def add_sample(path, data, new_values, field):
             assert new_values.shape[0] == num_samples, (
@@ -95,6 +98,7 @@ class SharedReplayPool(FlexibleReplayPool):
         other_batch = other_pool.random_batch_from_shared(other_batch_size)
         if process_other_batch:
             process_other_batch(other_batch)
+        other_batch = self.conform_batch(other_batch)
         if other_batch_size == batch_size:
             return other_batch
         self_batch = self.random_batch(batch_size - other_batch_size)
@@ -116,7 +120,7 @@ class SharedReplayPool(FlexibleReplayPool):
                 other_batch = other_pools[i].random_batch_from_shared(batch_sizes[i])
                 if other_process_batches and other_process_batches[i]:
                     other_process_batches[i](other_batch)
-                batches.append(other_batch)
+                batches.append(self.conform_batch(other_batch))
 
         if len(batches) == 1:
             return batches[0]
@@ -174,11 +174,16 @@ class RandomNetwork:
 
 
 def rnd_predictor_and_target(*args, **kwargs):
-    """ Returns a tuple containing the predictor and target random network for RND """
+    """ Returns a tuple containing the predictor and target random network for RND.
+        The predictor may consume the features of a shared preprocessor, the target always
+        builds its own so that it stays a fixed random function of the observations.
+    """
     predictor = RandomNetwork(*args, name='rnd_predictor', **kwargs)
-    target = RandomNetwork(*args, name='rnd_target', **kwargs)
+    with preprocessors_lib.shared_preprocessors(enabled=False):
+        target = RandomNetwork(*args, name='rnd_target', **kwargs)
     
-    predictor.set_weights([np.random.normal(0, 0.1, size=weights.shape) for weights in predictor.get_weights()])
+    for variable in preprocessors_lib.exclude_shared_variables(predictor.variables):
+        variable.assign(np.random.normal(0, 0.1, size=variable.shape))
     target.set_weights([np.random.normal(0, 0.1, size=weights.shape) for weights in target.get_weights()])
     
     return predictor, target
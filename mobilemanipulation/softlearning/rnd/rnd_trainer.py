@@ -5,16 +5,36 @@ import tree
 from collections import OrderedDict
 
 from softlearning.utils.misc import RunningMeanVar
+from softlearning.utils.tensorflow import (
+    compiled_function, compute_gradients, loss_scale_optimizer)
+from softlearning.preprocessors import exclude_shared_variables
 from . import rnd_predictor_and_target
 
+
+def _as_words(x):
+    """ Views each row of `x` as 64 bit words, zero padded. """
+    x = np.ascontiguousarray(x)
+    x = x.reshape(x.shape[0], -1).view(np.uint8)
+    num_padding = -x.shape[1] % 8
+    if num_padding:
+        x = np.pad(x, ((0, 0), (0, num_padding)))
+    return x.view(np.uint64)
+
+
 class RNDTrainer:
     """ Trainer class for RND """
     def __init__(
             self, 
             lr=3e-4,
             predictor=None, target=None, 
+            target_cache_size=0,
             **rnd_kwargs
         ):
+        """ target_cache_size: number of target network embeddings to keep, keyed by observation
+            content. The target network is never trained, so its embedding of an observation that
+            was already seen (e.g. sampled again from the pool) can be reused. The target network is
+            skipped for batches whose observations are all cached. 0 disables the cache.
+        """
         assert (predictor is None) == (target is None), "either provide both network or provide kwargs to create them"
 
         if predictor is None:
@@ -22,12 +42,19 @@ class RNDTrainer:
 
         self.predictor = predictor
         self.target = target
+        # Only the predictor head is trained when it sits on a shared encoder.
+        self.predictor_trainable_variables = exclude_shared_variables(predictor.trainable_variables)
 
         self.lr = lr
-        self.optimizer = tf.optimizers.Adam(learning_rate=lr, name="rnd_predictor_optimizer")
+        self.optimizer = loss_scale_optimizer(
+            tf.optimizers.Adam(learning_rate=lr, name="rnd_predictor_optimizer"))
 
         self.running_mean_var = RunningMeanVar(1e-10)
 
+        self.target_cache_size = target_cache_size
+        self._target_cache = OrderedDict()
+        self._target_cache_multipliers = {}
+
     def get_intrinsic_reward(self, observation, normalize=True):
         observations = tree.map_structure(lambda x: x[np.newaxis, ...], observation)
         return self.get_intrinsic_rewards(observations, normalize=normalize).squeeze()
@@ -49,7 +76,7 @@ class RNDTrainer:
     def normalize_rewards(self, rewards):
         return (rewards - self.running_mean_var.mean) / self.running_mean_var.std
 
-    @tf.function(experimental_relax_shapes=True)
+    @compiled_function
     def update_predictor(self, observations):
         """Update the RND predictor network. """
         target_values = self.target.values(observations)
@@ -60,23 +87,107 @@ class RNDTrainer:
             predictor_losses = tf.losses.MSE(y_true=tf.stop_gradient(target_values), y_pred=predictor_values)
             predictor_loss = tf.nn.compute_average_loss(predictor_losses)
 
-        predictor_gradients = tape.gradient(predictor_loss, self.predictor.trainable_variables)
-        self.optimizer.apply_gradients(zip(predictor_gradients, self.predictor.trainable_variables))
+        predictor_gradients = compute_gradients(
+            tape, predictor_loss, self.predictor_trainable_variables, self.optimizer)
+        self.optimizer.apply_gradients(zip(predictor_gradients, self.predictor_trainable_variables))
 
         return predictor_losses
 
+    @compiled_function
+    def train_step(self, observations, cached_target_values, is_cached):
+        """ Update the RND predictor network and return the predictor losses, the post-update
+            (unnormalized) intrinsic rewards, and the target values, all from one call.
+            The cached target values are used for the observations that are `is_cached`. All the
+            shapes are fixed by the batch, so the target network runs on the whole batch unless
+            every observation is cached.
+        """
+        def compute_target_values():
+            target_values = tf.cast(self.target.values(observations), cached_target_values.dtype)
+            return tf.where(is_cached[:, tf.newaxis], cached_target_values, target_values)
+
+        target_values = tf.cond(
+            tf.reduce_all(is_cached),
+            lambda: cached_target_values,
+            compute_target_values)
+        target_values = tf.stop_gradient(target_values)
+
+        with tf.GradientTape() as tape:
+            predictor_values = self.predictor.values(observations)
+
+            predictor_losses = tf.losses.MSE(y_true=target_values, y_pred=predictor_values)
+            predictor_loss = tf.nn.compute_average_loss(predictor_losses)
+
+        predictor_gradients = compute_gradients(
+            tape, predictor_loss, self.predictor_trainable_variables, self.optimizer)
+        self.optimizer.apply_gradients(zip(predictor_gradients, self.predictor_trainable_variables))
+
+        intrinsic_rewards = tf.losses.MSE(y_true=target_values, y_pred=self.predictor.values(observations))
+
+        return predictor_losses, intrinsic_rewards[:, tf.newaxis], target_values
+
+    def _target_cache_keys(self, observations):
+        """ Hashes each observation to a 128 bit key, vectorized over the batch. The bytes of an
+            observation are read as 64 bit words and multiplied with fixed random odd words,
+            modulo 2 ** 64.
+        """
+        hashes = np.zeros((tree.flatten(observations)[0].shape[0], 2), np.uint64)
+        leaves = tree.flatten(self.target._filter_observations(observations))
+        for i, leaf in enumerate(leaves):
+            words = _as_words(leaf)
+            hashes += words.dot(self._hash_multipliers(i, words.shape[1]))
+        return [key.tobytes() for key in hashes]
+
+    def _hash_multipliers(self, leaf_index, num_words):
+        key = (leaf_index, num_words)
+        if key not in self._target_cache_multipliers:
+            random_state = np.random.RandomState(leaf_index)
+            self._target_cache_multipliers[key] = random_state.randint(
+                np.iinfo(np.uint64).max, size=(num_words, 2), dtype=np.uint64) | np.uint64(1)
+        return self._target_cache_multipliers[key]
+
+    def _lookup_target_cache(self, keys):
+        cached_target_values = np.zeros((len(keys), self.target.model.output_shape[-1]), np.float32)
+        is_cached = np.zeros((len(keys), ), bool)
+        for i, key in enumerate(keys):
+            target_value = self._target_cache.get(key)
+            if target_value is not None:
+                self._target_cache.move_to_end(key)
+                cached_target_values[i] = target_value
+                is_cached[i] = True
+        return cached_target_values, is_cached
+
+    def _update_target_cache(self, keys, target_values, is_cached):
+        for key, target_value, cached in zip(keys, target_values, is_cached):
+            if not cached:
+                self._target_cache[key] = target_value
+        while len(self._target_cache) > self.target_cache_size:
+            self._target_cache.popitem(last=False)
+
     def train(self, observations):
-        # update predictor network
-        predictor_losses = self.update_predictor(observations)
-        
+        if self.target_cache_size > 0:
+            keys = self._target_cache_keys(observations)
+            cached_target_values, is_cached = self._lookup_target_cache(keys)
+        else:
+            batch_size = tree.flatten(observations)[0].shape[0]
+            cached_target_values = np.zeros((batch_size, self.target.model.output_shape[-1]), np.float32)
+            is_cached = np.zeros((batch_size, ), bool)
+
+        # update predictor network, reusing the same target values for the post-update rewards
+        predictor_losses, unnormalized_intrinsic_rewards, target_values = self.train_step(
+            observations, cached_target_values, is_cached)
+        unnormalized_intrinsic_rewards = unnormalized_intrinsic_rewards.numpy()
+
+        if self.target_cache_size > 0:
+            self._update_target_cache(keys, target_values.numpy(), is_cached)
+
         # update running mean var
-        unnormalized_intrinsic_rewards = self.get_intrinsic_rewards(observations, normalize=False)
         self.running_mean_var.update_batch(unnormalized_intrinsic_rewards)
         intrinsic_rewards = self.normalize_rewards(unnormalized_intrinsic_rewards)
 
         # diagnostics
         diagnostics = OrderedDict({
             "rnd_predictor_loss-mean": tf.reduce_mean(predictor_losses),
+            "rnd_target_cache_hit_rate": np.mean(is_cached),
             "rnd_running_mean": self.running_mean_var.mean,
             "rnd_running_std": self.running_mean_var.std,
             "intrinsic_reward-mean": np.mean(intrinsic_rewards),
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from softlearning.rnd import RNDTrainer
+from softlearning.utils.tensorflow import get_trace_counts
+
+
+class RNDTrainerTest(tf.test.TestCase):
+    def setUp(self):
+        self.trainer = RNDTrainer(
+            input_shapes=OrderedDict((
+                ('pixels', tf.TensorShape((12, ))),
+                ('state', tf.TensorShape((3, ))),
+            )),
+            output_shape=(5, ),
+            hidden_layer_sizes=(8, ),
+            target_cache_size=100)
+        self.observations = self._observations(6)
+
+    def _observations(self, batch_size):
+        return OrderedDict((
+            ('pixels', np.random.randint(
+                0, 256, size=(batch_size, 12)).astype(np.uint8)),
+            ('state', np.random.uniform(
+                size=(batch_size, 3)).astype(np.float32)),
+        ))
+
+    def test_cache_keys_follow_observation_content(self):
+        keys = self.trainer._target_cache_keys(self.observations)
+        self.assertEqual(len(set(keys)), 6)
+        self.assertEqual(
+            keys,
+            self.trainer._target_cache_keys(
+                OrderedDict((key, value.copy())
+                            for key, value in self.observations.items())))
+
+        for key in self.observations:
+            changed_observations = OrderedDict(
+                (key, value.copy())
+                for key, value in self.observations.items())
+            changed_observations[key][2, 0] += 1
+            changed_keys = self.trainer._target_cache_keys(
+                changed_observations)
+            self.assertEqual(changed_keys[:2], keys[:2])
+            self.assertNotEqual(changed_keys[2], keys[2])
+            self.assertEqual(changed_keys[3:], keys[3:])
+
+    def test_train_step_uses_cached_rows(self):
+        target_values = self.trainer.target.values(self.observations)
+        cached_target_values = np.full(
+            target_values.shape, 7.0, dtype=np.float32)
+        is_cached = np.array([True, False, True, False, False, True])
+
+        _, _, step_target_values = self.trainer.train_step(
+            self.observations, cached_target_values, is_cached)
+
+        self.assertAllClose(
+            step_target_values,
+            np.where(is_cached[:, None], cached_target_values, target_values))
+
+    def test_cached_train_matches_uncached(self):
+        self.trainer.train(self.observations)
+        keys = self.trainer._target_cache_keys(self.observations)
+        cached_target_values, is_cached = self.trainer._lookup_target_cache(
+            keys)
+        self.assertTrue(np.all(is_cached))
+        self.assertAllClose(
+            cached_target_values,
+            self.trainer.target.values(self.observations))
+
+        diagnostics = self.trainer.train(self.observations)
+        self.assertEqual(diagnostics['rnd_target_cache_hit_rate'], 1.0)
+
+    def test_traced_once_per_batch_size(self):
+        self.trainer.train(self.observations)
+        self.trainer.train(self.observations)
+        self.trainer.train(self._observations(6))
+        self.assertEqual(
+            get_trace_counts()[self.trainer.train_step.name], 1)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -2,123 +2,350 @@ import pickle
 from collections import OrderedDict
 
 import ray
-import tensorflow as tf
 import numpy as np
+import tree
 
+from softlearning import policies
+from softlearning.environments.utils import get_environment_from_params
+from softlearning.policies import utils as policy_utils
+from softlearning.policies.uniform_policy import UniformPolicyMixin
+from softlearning.replay_pools import SharedReplayPool
+from softlearning.utils.misc import set_seed
 
 from .base_sampler import BaseSampler
-from .utils import rollout
+from .simple_sampler import SimpleSampler
 
 
 class RemoteSampler(BaseSampler):
-    def __init__(self, **kwargs):
-        raise NotImplementedError(
-            "TODO(hartikainen): There's a bug here that causes tf to end up in"
-            " a RecursionError. This should be fixed/refactored before usage.")
+    """Samples with `num_workers` environment copies in separate processes.
+
+    Every worker steps its own environment copy with a local copy of the
+    policy for `steps_per_sync` steps at a time, then returns all the
+    transitions of that window, including those of unfinished episodes. The
+    sampler adds them to the pool in one batch and immediately reschedules
+    the worker with the current policy weights, so the weights are synced
+    only once per `steps_per_sync` steps of each worker. Returning unfinished
+    episodes keeps the pool growing for reset-free environments with long
+    paths. The steps of an episode that were added before it ended keep an
+    `episode_index_backwards` of 0.
+
+    `sample` keeps the `SimpleSampler` contract of one environment step per
+    call: it only blocks on the workers once every step received so far has
+    been handed out, which keeps the per-timestep training schedule of
+    `RLAlgorithm` unchanged while the environments step in the background.
+
+    Environments that cannot be pickled (e.g. the PyBullet environments)
+    should pass `environment_params`, which each worker uses to build its own
+    copy with `get_environment_from_params`.
+
+    Environments that need `finish_init` are not supported: they train
+    learners of their own (e.g. the grasping and perturbation algorithms)
+    while stepping, which the workers would train on unsynced copies.
+    """
+
+    def __init__(self,
+                 num_workers=2,
+                 steps_per_sync=100,
+                 environment_params=None,
+                 seed=None,
+                 **kwargs):
         super(RemoteSampler, self).__init__(**kwargs)
 
-        self._remote_environment = None
-        self._remote_path = None
+        self._num_workers = num_workers
+        self._steps_per_sync = steps_per_sync
+        self._environment_params = environment_params
+        self._seed = seed
+
+        self._workers = None
+        self._pending_samples = {}
+        self._partial_paths = {}
+        self._remote_policy = None
+        self._num_unclaimed_samples = 0
+        self._num_policy_syncs = 0
+
         self._n_episodes = 0
         self._total_samples = 0
         self._last_path_return = 0
         self._max_path_return = -np.inf
 
-    def _create_remote_environment(self, env, policy):
-        env_pkl = pickle.dumps(env)
-        policy_pkl = pickle.dumps(policy)
+    def initialize(self, environment, policy, pool):
+        if hasattr(environment, 'finish_init'):
+            raise ValueError(
+                "RemoteSampler can't sample {}: environments that need"
+                " `finish_init` train their own learners while stepping,"
+                " which would run on unsynced worker copies. Use"
+                " SimpleSampler instead.".format(environment))
+        super(RemoteSampler, self).initialize(environment, policy, pool)
 
+    def _create_workers(self):
         if not ray.is_initialized():
             ray.init()
 
-        self._remote_environment = _RemoteEnv.remote(env_pkl, policy_pkl)
+        if self._environment_params is not None:
+            environment_pkl = None
+        else:
+            environment_pkl = pickle.dumps(self.environment)
 
-        # Block until the env and policy is ready
-        initialized = ray.get(self._remote_environment.initialized.remote())
-        assert initialized, initialized
+        self._workers = [
+            _RemoteWorker.remote(
+                environment_params=self._environment_params,
+                environment_pkl=environment_pkl,
+                max_path_length=self._max_path_length,
+                store_shared=isinstance(self.pool, SharedReplayPool),
+                seed=None if self._seed is None else self._seed + i)
+            for i in range(self._num_workers)
+        ]
+        self._pending_samples = {}
+        self._partial_paths = {}
 
-    def initialize(self, environment, policy, pool):
-        super(RemoteSampler, self).initialize(environment, policy, pool)
-        self._create_remote_environment(environment, policy)
+    def _policy_config(self):
+        if isinstance(self.policy, UniformPolicyMixin):
+            return 'uniform'
+        return policies.serialize(self.policy)
+
+    def _schedule_worker(self, worker, policy_weights, policy_config):
+        self._pending_samples[worker.sample.remote(
+            self._steps_per_sync, policy_weights, policy_config)] = worker
+
+    def _schedule_idle_workers(self):
+        busy_workers = set(self._pending_samples.values())
+        idle_workers = [
+            worker for worker in self._workers if worker not in busy_workers
+        ]
+        if not idle_workers:
+            return
 
-    def wait_for_path(self, timeout=1):
-        if self._remote_path is None:
-            return [True]
+        # Only send the policy config when the policy object itself changes,
+        # e.g. to the uniform policy used for the warmup samples.
+        if self.policy is not self._remote_policy:
+            policy_config = self._policy_config()
+            self._remote_policy = self.policy
+        else:
+            policy_config = None
 
-        path_ready, _ = ray.wait([self._remote_path], timeout=timeout)
-        return path_ready
+        policy_weights = ray.put(self.policy.get_weights())
+        self._num_policy_syncs += 1
 
-    def sample(self, timeout=0):
-        if self._remote_path is None:
-            policy_params = self.policy.get_weights()
-            self._remote_path = self._remote_environment.rollout.remote(
-                policy_params, self._max_path_length)
+        for worker in idle_workers:
+            self._schedule_worker(worker, policy_weights, policy_config)
 
-        path_ready = self.wait_for_path(timeout=timeout)
+    def _add_segments(self, worker, segments):
+        """Adds a worker's transitions to the pool.
 
-        if len(path_ready) or not self.batch_ready():
-            path_samples = ray.get(self._remote_path)
-            self._last_n_paths.appendleft(path_samples)
+        Each segment continues the worker's current episode. Segments are
+        joined into a path once the episode ends.
+        """
+        for segment, ends_episode in segments:
+            partial_path = self._partial_paths.setdefault(worker, [])
+            episode_offset = sum(
+                previous['rewards'].shape[0] for previous in partial_path)
+            segment_length = segment['rewards'].shape[0]
 
-            self.pool.add_samples({
+            samples = {
                 key: value
-                for key, value in path_samples.items()
+                for key, value in segment.items()
                 if key != 'infos'
-            })
+            }
+            index_dtype = self.pool.fields['episode_index_forwards'].dtype
+            samples['episode_index_forwards'] = np.arange(
+                episode_offset, episode_offset + segment_length,
+                dtype=index_dtype)[..., np.newaxis]
+            samples['episode_index_backwards'] = (
+                np.arange(segment_length, dtype=index_dtype)[::-1, np.newaxis]
+                if ends_episode
+                else np.zeros((segment_length, 1), dtype=index_dtype))
+            self.pool.add_samples(samples)
+
+            partial_path.append(segment)
+            if ends_episode:
+                self._add_path(tree.map_structure(
+                    lambda *x: np.concatenate(x, axis=0), *partial_path))
+                del self._partial_paths[worker]
+
+    def _add_path(self, path):
+        self.pool.terminate_episode()
+
+        self._last_n_paths.appendleft(path)
+
+        path_return = np.sum(path['rewards'])
+        self._max_path_return = max(self._max_path_return, path_return)
+        self._last_path_return = path_return
+        self._n_episodes += 1
+
+    def _collect_samples(self):
+        pending_samples = list(self._pending_samples)
+        # Block until at least one worker is done, then take all that are.
+        ray.wait(pending_samples, num_returns=1)
+        ready_samples, _ = ray.wait(
+            pending_samples, num_returns=len(pending_samples), timeout=0)
+
+        for ready_sample in ready_samples:
+            worker = self._pending_samples.pop(ready_sample)
+            segments, num_samples = ray.get(ready_sample)
+            self._add_segments(worker, segments)
+            self._num_unclaimed_samples += num_samples
 
-            self._remote_path = None
-            self._total_samples += path_samples['rewards'].shape[0]
-            self._last_path_return = np.sum(path_samples['rewards'])
-            self._max_path_return = max(self._max_path_return,
-                                        self._last_path_return)
-            self._n_episodes += 1
+    def sample(self):
+        if self._workers is None:
+            self._create_workers()
+
+        self._schedule_idle_workers()
+
+        while self._num_unclaimed_samples < 1:
+            self._collect_samples()
+            self._schedule_idle_workers()
+
+        self._num_unclaimed_samples -= 1
+        self._total_samples += 1
+
+    def terminate(self):
+        for worker in self._workers or ():
+            ray.kill(worker)
+        self._workers = None
+        self._pending_samples = {}
+        self._partial_paths = {}
+        super(RemoteSampler, self).terminate()
 
     def get_diagnostics(self):
-        diagnostics = OrderedDict({
+        diagnostics = super(RemoteSampler, self).get_diagnostics()
+        diagnostics.update({
             'max-path-return': self._max_path_return,
             'last-path-return': self._last_path_return,
-            'pool-size': self.pool.size,
             'episodes': self._n_episodes,
             'total-samples': self._total_samples,
+            'num-workers': self._num_workers,
+            'num-policy-syncs': self._num_policy_syncs,
         })
 
+        if isinstance(self.pool, SharedReplayPool):
+            diagnostics['pool-shared_size'] = self.pool.shared_size
+
         return diagnostics
 
     def __getstate__(self):
         super_state = super(RemoteSampler, self).__getstate__()
         state = {
             key: value for key, value in super_state.items()
-            if key not in ('_remote_environment', '_remote_path')
+            if key not in (
+                    '_workers',
+                    '_pending_samples',
+                    '_partial_paths',
+                    '_remote_policy',
+                    '_num_unclaimed_samples',
+            )
         }
 
         return state
 
     def __setstate__(self, state):
         super(RemoteSampler, self).__setstate__(state)
-        self._remote_path = None
+        self._workers = None
+        self._pending_samples = {}
+        self._partial_paths = {}
+        self._remote_policy = None
+        self._num_unclaimed_samples = 0
+
+
+class _PathBuffer:
+    """Minimal pool for the worker sampler that only counts the samples.
+
+    The completed paths are taken from the sampler's last paths instead,
+    which keep their infos.
+    """
+
+    def __init__(self):
+        self.size = 0
+
+    def add_path(self, path):
+        self.size += path['rewards'].shape[0]
+
+    def terminate_episode(self):
+        pass
+
+
+class _WorkerSampler(SimpleSampler):
+    def __init__(self, store_shared=False, **kwargs):
+        super(_WorkerSampler, self).__init__(**kwargs)
+        self._store_shared = store_shared
+
+    def _process_sample(self, *args, info, **kwargs):
+        processed_sample = super(_WorkerSampler, self)._process_sample(
+            *args, info=info, **kwargs)
+        if self._store_shared:
+            processed_sample['shared'] = np.atleast_1d(info['shared'])
+        return processed_sample
+
+
+@ray.remote(num_cpus=1, num_gpus=0)
+class _RemoteWorker(object):
+    def __init__(self,
+                 environment_params,
+                 environment_pkl,
+                 max_path_length,
+                 store_shared,
+                 seed):
+        if seed is not None:
+            set_seed(seed)
+
+        if environment_params is not None:
+            self._environment = get_environment_from_params(environment_params)
+        else:
+            self._environment = pickle.loads(environment_pkl)
+
+        self._paths = _PathBuffer()
+        # steps of the current episode that were already returned
+        self._num_returned_steps = 0
+        self._sampler = _WorkerSampler(
+            store_shared=store_shared,
+            environment=self._environment,
+            pool=self._paths,
+            max_path_length=max_path_length)
+
+    def _set_policy(self, policy_config):
+        if policy_config == 'uniform':
+            policy = policy_utils.get_uniform_policy(self._environment)
+        else:
+            policy = policies.get(policy_config)
+        self._sampler.set_policy(policy)
 
+    def sample(self, num_steps, policy_weights, policy_config=None):
+        if policy_config is not None:
+            self._set_policy(policy_config)
+        self._sampler.policy.set_weights(policy_weights)
 
-@ray.remote
-class _RemoteEnv(object):
-    def __init__(self, env_pkl, policy_pkl):
-        gpu_options = tf.GPUOptions(allow_growth=True)
-        self._session = tf.Session(
-            config=tf.ConfigProto(gpu_options=gpu_options))
-        tf.compat.v1.keras.backend.set_session(self._session)
+        for _ in range(num_steps):
+            self._sampler.sample()
 
-        self._env = pickle.loads(env_pkl)
-        self._policy = pickle.loads(policy_pkl)
+        return self._pop_segments(), num_steps
 
-        if hasattr(self._env, 'initialize'):
-            self._env.initialize()
+    def _pop_segments(self):
+        """Returns the transitions stepped since the last call.
 
-        self._initialized = True
+        Returns:
+            A list of `(segment, ends_episode)` pairs in stepping order, where
+            `segment` holds the not yet returned steps of one episode.
+        """
+        # `_last_n_paths` holds the completed paths, newest first.
+        completed_paths = reversed(self._sampler.get_last_n_paths())
+        self._sampler.clear_last_n_paths()
 
-    def initialized(self):
-        return self._initialized
+        segments = []
+        for path in completed_paths:
+            segments.append((
+                tree.map_structure(
+                    lambda x: x[self._num_returned_steps:], path),
+                True))
+            self._num_returned_steps = 0
 
-    def rollout(self, policy_weights, path_length):
-        self._policy.set_weights(policy_weights)
-        path = rollout(self._env, self._policy, path_length)
+        # `_is_first_step` is set when the last step ended the episode.
+        if not self._sampler._is_first_step:
+            current_path = self._sampler._current_path[
+                self._num_returned_steps:]
+            if current_path:
+                segments.append((
+                    tree.map_structure(
+                        lambda *x: np.stack(x, axis=0), *current_path),
+                    False))
+                self._num_returned_steps += len(current_path)
 
-        return path
+        return segments
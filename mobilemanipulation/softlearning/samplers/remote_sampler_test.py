@@ -1,6 +1,5 @@
 import pickle
 import unittest
-import pytest
 
 from softlearning.environments.utils import get_environment
 from softlearning.samplers.remote_sampler import RemoteSampler
@@ -8,7 +7,6 @@ from softlearning.replay_pools.simple_replay_pool import SimpleReplayPool
 from softlearning import policies
 
 
-@pytest.mark.skip(reason="RemoteSampler is currently broken.")
 class RemoteSamplerTest(unittest.TestCase):
     def setUp(self):
         self.env = get_environment('gym', 'Swimmer', 'v3', {})
@@ -21,57 +19,113 @@ class RemoteSamplerTest(unittest.TestCase):
             output_shape=self.env.action_shape,
             observation_keys=self.env.observation_keys)
         self.pool = SimpleReplayPool(max_size=100, environment=self.env)
-        self.remote_sampler = RemoteSampler(max_path_length=10)
+        self.remote_sampler = RemoteSampler(
+            num_workers=2,
+            steps_per_sync=10,
+            environment_params={
+                'universe': 'gym',
+                'domain': 'Swimmer',
+                'task': 'v3',
+                'kwargs': {'reset_free': True},
+            },
+            max_path_length=10)
+
+    def tearDown(self):
+        self.remote_sampler.terminate()
 
     def test_initialization(self):
         self.assertEqual(self.pool.size, 0)
         self.remote_sampler.initialize(self.env, self.policy, self.pool)
-        self.remote_sampler.sample(timeout=10)
-        self.assertEqual(self.pool.size, 10)
-
-    def test_serialize_deserialize(self):
-        self.assertEqual(self.pool.size, 0)
-
-        self.remote_sampler.initialize(self.env, self.policy, self.pool)
-
         self.remote_sampler.sample()
+        self.assertEqual(self.remote_sampler._total_samples, 1)
+        self.assertGreaterEqual(self.pool.size, 10)
+        self.assertEqual(self.pool.size % 10, 0)
 
-        deserialized = pickle.loads(pickle.dumps(self.remote_sampler))
-        deserialized.initialize(self.env, self.policy, self.pool)
-
-        self.assertEqual(self.pool.size, 10)
+    def test_samples_are_claimed_one_step_at_a_time(self):
+        self.remote_sampler.initialize(self.env, self.policy, self.pool)
+        for _ in range(30):
+            self.remote_sampler.sample()
+
+        self.assertEqual(self.remote_sampler._total_samples, 30)
+        self.assertGreaterEqual(self.pool.size, 30)
+        self.assertGreaterEqual(self.remote_sampler._n_episodes, 3)
+
+    def test_unfinished_paths_reach_the_pool(self):
+        """Reset-free paths longer than a sync window still fill the pool."""
+        remote_sampler = RemoteSampler(
+            num_workers=1,
+            steps_per_sync=10,
+            environment_params={
+                'universe': 'gym',
+                'domain': 'Swimmer',
+                'task': 'v3',
+                'kwargs': {'reset_free': True},
+            },
+            max_path_length=1000)
+        remote_sampler.initialize(self.env, self.policy, self.pool)
+        try:
+            for _ in range(30):
+                remote_sampler.sample()
+
+            self.assertEqual(remote_sampler._n_episodes, 0)
+            self.assertGreaterEqual(self.pool.size, 30)
+            self.assertEqual(
+                self.pool.data['episode_index_forwards'][:30, 0].tolist(),
+                list(range(30)))
+        finally:
+            remote_sampler.terminate()
 
-        self.remote_sampler.sample(timeout=10)
-        self.assertEqual(self.pool.size, 20)
+    def test_serialize_deserialize(self):
+        self.remote_sampler.initialize(self.env, self.policy, self.pool)
+        for _ in range(10):
+            self.remote_sampler.sample()
 
         deserialized = pickle.loads(pickle.dumps(self.remote_sampler))
         deserialized.initialize(self.env, self.policy, self.pool)
 
-        self.assertTrue(isinstance(
-            deserialized.environment, type(self.remote_sampler.environment)))
+        self.assertEqual(
+            self.remote_sampler._total_samples, deserialized._total_samples)
         self.assertEqual(
             self.remote_sampler._n_episodes, deserialized._n_episodes)
         self.assertEqual(
             self.remote_sampler._max_path_return,
             deserialized._max_path_return)
-        self.assertEqual(
-            self.remote_sampler._last_path_return,
-            deserialized._last_path_return)
-        self.assertEqual(
-            len(self.remote_sampler._last_n_paths),
-            len(deserialized._last_n_paths))
-
-        self.remote_sampler.sample(timeout=10)
-        deserialized.sample(timeout=10)
+        self.assertIsNone(deserialized._workers)
 
+        deserialized.sample()
         self.assertEqual(
-            self.remote_sampler._n_episodes, deserialized._n_episodes)
-        self.assertNotEqual(
-            self.remote_sampler._last_path_return,
-            deserialized._last_path_return)
-        self.assertEqual(
-            len(self.remote_sampler._last_n_paths),
-            len(deserialized._last_n_paths))
+            deserialized._total_samples,
+            self.remote_sampler._total_samples + 1)
+        deserialized.terminate()
+
+
+class RemoteSamplerDualPerturbationTest(unittest.TestCase):
+    def test_rejects_environments_with_learners(self):
+        """The dual perturbation env trains its own learners while stepping."""
+        env = get_environment(
+            'gym', 'Locobot', 'NavigationGraspingDualPerturbation-v0', {
+                'observation_keys': ('pixels', ),
+                'room_name': 'single',
+                'room_params': {'num_objects': 1},
+                'max_ep_len': 10,
+            })
+        pool = SimpleReplayPool(max_size=100, environment=env)
+        remote_sampler = RemoteSampler(
+            num_workers=1,
+            steps_per_sync=10,
+            environment_params={
+                'universe': 'gym',
+                'domain': 'Locobot',
+                'task': 'NavigationGraspingDualPerturbation-v0',
+            },
+            max_path_length=10)
+
+        with self.assertRaises(ValueError):
+            remote_sampler.initialize(env, None, pool)
+
+        self.assertIsNone(remote_sampler._workers)
+        self.assertEqual(pool.size, 0)
+        env.close()
 
 
 if __name__ == '__main__':
@@ -1,7 +1,46 @@
 import numpy as np
+import tree
 
 
 def softmax(x):
     max_x = np.max(x)
     exp_x = np.exp(x - max_x)
     return exp_x / np.sum(exp_x)
+
+
+def bucket_size(size, bucket_sizes):
+    """Returns the smallest bucket that fits `size`.
+
+    Sizes larger than the largest bucket are rounded up to a multiple of it.
+    """
+    bucket_sizes = sorted(bucket_sizes)
+    for bucket in bucket_sizes:
+        if size <= bucket:
+            return bucket
+    largest = bucket_sizes[-1]
+    return int(np.ceil(size / largest)) * largest
+
+
+def pad_batch(batch, bucket_sizes, mask_key='mask'):
+    """Pads every array in `batch` to a fixed bucket size along axis 0.
+
+    Padding repeats the first sample so that padded rows stay valid inputs.
+    A float32 `(bucket, 1)` validity mask is added under `mask_key`, so losses
+    can ignore the padded rows.
+    """
+    size = tree.flatten(batch)[0].shape[0]
+    padded_size = bucket_size(size, bucket_sizes)
+    num_padding = padded_size - size
+
+    def pad(x):
+        if num_padding == 0:
+            return x
+        return np.concatenate(
+            (x, np.repeat(x[:1], num_padding, axis=0)), axis=0)
+
+    padded_batch = tree.map_structure(pad, batch)
+    mask = np.zeros((padded_size, 1), dtype=np.float32)
+    mask[:size] = 1.0
+    padded_batch[mask_key] = mask
+
+    return padded_batch
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from softlearning.utils.numpy import bucket_size, pad_batch
+
+
+class BucketSizeTest(unittest.TestCase):
+    def test_smallest_fitting_bucket(self):
+        self.assertEqual(bucket_size(1, (64, 16, 32)), 16)
+        self.assertEqual(bucket_size(16, (64, 16, 32)), 16)
+        self.assertEqual(bucket_size(17, (64, 16, 32)), 32)
+        self.assertEqual(bucket_size(64, (64, 16, 32)), 64)
+
+    def test_rounds_up_to_multiple_of_largest_bucket(self):
+        self.assertEqual(bucket_size(65, (16, 64)), 128)
+        self.assertEqual(bucket_size(128, (16, 64)), 128)
+        self.assertEqual(bucket_size(129, (16, 64)), 192)
+
+
+class PadBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.batch = {
+            'observations': {
+                'pixels': np.arange(5 * 2 * 3).reshape(5, 2, 3),
+            },
+            'rewards': np.arange(5, dtype=np.float32)[:, None],
+        }
+
+    def test_pads_to_bucket_with_first_sample(self):
+        padded_batch = pad_batch(self.batch, (4, 8))
+
+        pixels = padded_batch['observations']['pixels']
+        self.assertEqual(pixels.shape, (8, 2, 3))
+        np.testing.assert_array_equal(
+            pixels[:5], self.batch['observations']['pixels'])
+        np.testing.assert_array_equal(
+            pixels[5:],
+            np.repeat(self.batch['observations']['pixels'][:1], 3, axis=0))
+        self.assertEqual(padded_batch['rewards'].shape, (8, 1))
+        self.assertEqual(
+            padded_batch['rewards'].dtype, self.batch['rewards'].dtype)
+
+    def test_mask_marks_valid_rows(self):
+        padded_batch = pad_batch(self.batch, (8, ))
+
+        mask = padded_batch['mask']
+        self.assertEqual(mask.shape, (8, 1))
+        self.assertEqual(mask.dtype, np.float32)
+        np.testing.assert_array_equal(mask[:, 0], [1, 1, 1, 1, 1, 0, 0, 0])
+
+    def test_full_batch_is_not_padded(self):
+        padded_batch = pad_batch(self.batch, (5, ))
+
+        self.assertIs(
+            padded_batch['observations']['pixels'],
+            self.batch['observations']['pixels'])
+        np.testing.assert_array_equal(padded_batch['mask'], np.ones((5, 1)))
+        self.assertNotIn('mask', self.batch)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,199 @@
+from collections import OrderedDict
+from distutils.version import LooseVersion
+import functools
+import weakref
+
 import tensorflow as tf
 import tree
 
 
+_COMPUTE_POLICY = {
+    'jit_compile': False,
+    'mixed_precision': False,
+}
+
+
+def set_compute_policy(jit_compile=False, mixed_precision=False):
+    """Set the project-wide compute policy.
+
+    `mixed_precision` must be set before models are built, since the model
+    dtypes are fixed at build time. `jit_compile` is read on every call of a
+    `compiled_function`, which keeps one `tf.function` per setting, so it can
+    be switched between runs in the same process.
+
+    Args:
+        jit_compile: If True, `compiled_function`s are compiled with XLA.
+        mixed_precision: If True, conv trunks compute in float16 and the
+            optimizers wrapped with `loss_scale_optimizer` use dynamic loss
+            scaling.
+    """
+    _COMPUTE_POLICY['jit_compile'] = bool(jit_compile)
+    _COMPUTE_POLICY['mixed_precision'] = bool(mixed_precision)
+
+
+def get_compute_policy():
+    return dict(_COMPUTE_POLICY)
+
+
+_TRACE_COUNTS = weakref.WeakKeyDictionary()
+
+
+def get_trace_counts():
+    """Returns the number of times each `compiled_function` has been traced.
+
+    Methods are counted per instance, so the counts of e.g. two `SAC`
+    instances show up under `SAC._do_updates` and `SAC._do_updates[1]`.
+    """
+    return {
+        compiled_function.name: count
+        for compiled_function, count in list(_TRACE_COUNTS.items())
+    }
+
+
+class CompiledFunction:
+    """A `tf.function` that is created on first use.
+
+    Deferring the `tf.function` creation lets module-level and method
+    decorators pick up the compute policy set at experiment setup time.
+    One `tf.function` is kept per `jit_compile` setting, so that changing
+    the policy never reuses a function traced under the other setting.
+    Every trace is counted in `get_trace_counts`, so that retracing in the
+    middle of a run shows up in the diagnostics. When used as a method
+    decorator, every instance gets its own `CompiledFunction`, with its own
+    functions and trace count.
+    """
+
+    def __init__(self, python_function, name=None, **function_kwargs):
+        self._python_function = python_function
+        self._function_kwargs = function_kwargs
+        self._functions = {}
+        self._bound_functions = weakref.WeakKeyDictionary()
+        self._num_bound_functions = 0
+        self.__doc__ = python_function.__doc__
+        self.__name__ = python_function.__name__
+        self.name = name or python_function.__qualname__
+
+    def _get_function(self):
+        jit_compile = _COMPUTE_POLICY['jit_compile']
+        if jit_compile not in self._functions:
+            function_kwargs = {
+                'experimental_relax_shapes': True,
+                **self._function_kwargs,
+            }
+            if jit_compile:
+                if LooseVersion(tf.__version__) >= LooseVersion("2.5"):
+                    function_kwargs['jit_compile'] = True
+                else:
+                    function_kwargs['experimental_compile'] = True
+            python_function = self._python_function
+            compiled_function_ref = weakref.ref(self)
+            _TRACE_COUNTS.setdefault(self, 0)
+
+            @functools.wraps(python_function)
+            def traced_function(*args, **kwargs):
+                # Python side effects only run while tracing.
+                _TRACE_COUNTS[compiled_function_ref()] += 1
+                return python_function(*args, **kwargs)
+
+            self._functions[jit_compile] = tf.function(
+                traced_function, **function_kwargs)
+        return self._functions[jit_compile]
+
+    def __call__(self, *args, **kwargs):
+        return self._get_function()(*args, **kwargs)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if instance not in self._bound_functions:
+            python_function = self._python_function
+            # The bound function must not keep its instance alive.
+            instance_ref = weakref.ref(instance)
+
+            @functools.wraps(python_function)
+            def bound_function(*args, **kwargs):
+                return python_function(instance_ref(), *args, **kwargs)
+
+            index = self._num_bound_functions
+            self._num_bound_functions += 1
+            self._bound_functions[instance] = CompiledFunction(
+                bound_function,
+                name=f'{self.name}[{index}]' if index else self.name,
+                **self._function_kwargs)
+        return self._bound_functions[instance]
+
+
+def compiled_function(python_function=None, **function_kwargs):
+    """Drop-in for `tf.function(experimental_relax_shapes=True)` that
+    follows the compute policy."""
+    if python_function is None:
+        return lambda python_function: CompiledFunction(
+            python_function, **function_kwargs)
+    return CompiledFunction(python_function, **function_kwargs)
+
+
+def mixed_precision_policy():
+    """Returns the keras dtype policy for conv trunks, or None for float32."""
+    if not _COMPUTE_POLICY['mixed_precision']:
+        return None
+    return tf.keras.mixed_precision.Policy('mixed_float16')
+
+
+def loss_scale_optimizer(optimizer):
+    if not _COMPUTE_POLICY['mixed_precision']:
+        return optimizer
+    return tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+
+def compute_gradients(tape, loss, variables, optimizer):
+    """Compute `loss` gradients, applying loss scaling if `optimizer` uses it.
+
+    The scale is fed as the output gradient so that the loss does not have to
+    be scaled inside the tape.
+    """
+    if not isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+        return tape.gradient(loss, variables)
+
+    loss_scale = tf.cast(optimizer.loss_scale, loss.dtype)
+    scaled_gradients = tape.gradient(
+        loss, variables, output_gradients=tf.ones_like(loss) * loss_scale)
+    return optimizer.get_unscaled_gradients(scaled_gradients)
+
+
+def repeat_updates(update_fn, batches, diagnostic_keys):
+    """Runs `update_fn` on each batch of `batches` in one `tf.while_loop`.
+
+    Must be called inside a `tf.function`. The batches are stacked along the
+    leading axis and the updates run sequentially, in order. `update_fn` must
+    return an `OrderedDict` of scalars with the keys `diagnostic_keys`, so
+    that the loop body is the only trace of it. Their mean over the updates
+    is reduced in-graph.
+    """
+    num_updates = tf.shape(tree.flatten(batches)[0])[0]
+
+    def get_batch(i):
+        return tree.map_structure(lambda x: x[i], batches)
+
+    def body(i, diagnostics_sums):
+        step_diagnostics = update_fn(get_batch(i))
+        diagnostics_sums = tree.map_structure(
+            lambda total, x: total + tf.cast(x, tf.float32),
+            diagnostics_sums,
+            step_diagnostics)
+        return i + 1, diagnostics_sums
+
+    _, diagnostics_sums = tf.while_loop(
+        lambda i, _: i < num_updates,
+        body,
+        (tf.constant(0), OrderedDict(
+            (key, tf.zeros((), tf.float32)) for key in diagnostic_keys)),
+        parallel_iterations=1)
+
+    return tree.map_structure(
+        lambda total: total / tf.cast(num_updates, tf.float32),
+        diagnostics_sums)
+
+
 def set_gpu_memory_growth(growth):
     gpus = tf.config.experimental.list_physical_devices('GPU')
     if gpus:
@@ -35,3 +227,14 @@ def cast_and_concat(x):
     x = tree.flatten(x)
     x = tf.concat(x, axis=-1)
     return x
+
+
+def masked_average_loss(losses, mask=None):
+    """Average `losses` over the valid (mask == 1) rows of a padded batch."""
+    if mask is None:
+        return tf.nn.compute_average_loss(losses)
+
+    mask = tf.reshape(tf.cast(mask, losses.dtype), tf.shape(losses))
+    return tf.reduce_sum(losses * mask) / tf.maximum(
+        tf.reduce_sum(mask), 1.0)
+
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from softlearning.utils.tensorflow import (
+    compiled_function,
+    get_compute_policy,
+    get_trace_counts,
+    repeat_updates,
+    set_compute_policy)
+
+
+class RepeatUpdatesTest(tf.test.TestCase):
+
+    def test_updates_run_in_order(self):
+        """Every batch is applied once, in order, and diagnostics averaged."""
+        total = tf.Variable(0.0)
+        history = tf.Variable(tf.zeros(4))
+
+        def update_fn(batch):
+            total.assign_add(tf.reduce_sum(batch['x']))
+            index = tf.cast(batch['index'][0], tf.int32)
+            history.scatter_nd_update([[index]], [total.read_value()])
+            return OrderedDict((
+                ('total', total.read_value()),
+                ('x-mean', tf.reduce_mean(batch['x'])),
+            ))
+
+        @tf.function
+        def run(batches):
+            return repeat_updates(update_fn, batches, ('total', 'x-mean'))
+
+        batches = {
+            'x': np.arange(8, dtype=np.float32).reshape(4, 2),
+            'index': np.arange(4, dtype=np.float32).reshape(4, 1),
+        }
+        diagnostics = run(batches)
+
+        expected_totals = np.cumsum(batches['x'].sum(axis=1))
+        self.assertAllClose(history, expected_totals)
+        self.assertAllClose(total, expected_totals[-1])
+        self.assertAllClose(diagnostics['total'], np.mean(expected_totals))
+        self.assertAllClose(diagnostics['x-mean'], np.mean(batches['x']))
+
+
+class CompiledFunctionTest(tf.test.TestCase):
+
+    def tearDown(self):
+        set_compute_policy()
+        super().tearDown()
+
+    def test_function_follows_jit_compile_policy(self):
+        """Changing `jit_compile` builds a new function, switching back reuses it."""
+        @compiled_function
+        def square(x):
+            return x * x
+
+        set_compute_policy(jit_compile=False)
+        self.assertAllClose(square(tf.constant(3.0)), 9.0)
+        function = square._get_function()
+
+        set_compute_policy(jit_compile=True)
+        self.assertTrue(get_compute_policy()['jit_compile'])
+        self.assertIsNot(square._get_function(), function)
+
+        set_compute_policy(jit_compile=False)
+        self.assertIs(square._get_function(), function)
+
+    def test_counts_traces(self):
+        @compiled_function
+        def double(x):
+            return 2 * x
+
+        double(tf.constant(1.0))
+        double(tf.constant(2.0))
+        self.assertEqual(get_trace_counts()[double.name], 1)
+
+        double(tf.constant(1))
+        self.assertEqual(get_trace_counts()[double.name], 2)
+
+    def test_counts_method_traces_per_instance(self):
+        class Scale:
+            def __init__(self, scale):
+                self.scale = scale
+
+            @compiled_function
+            def apply(self, x):
+                return self.scale * x
+
+        first, second = Scale(2.0), Scale(3.0)
+        self.assertAllClose(first.apply(tf.constant(1.0)), 2.0)
+        self.assertAllClose(second.apply(tf.constant(1.0)), 3.0)
+        self.assertAllClose(second.apply(tf.constant(2.0)), 6.0)
+
+        self.assertIs(first.apply, first.apply)
+        self.assertIsNot(first.apply, second.apply)
+        trace_counts = get_trace_counts()
+        self.assertEqual(trace_counts[first.apply.name], 1)
+        self.assertEqual(trace_counts[second.apply.name], 1)
+        self.assertNotEqual(first.apply.name, second.apply.name)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -1,5 +1,6 @@
 from .vanilla import feedforward_Q_function  # noqa: unused-import
 from .vanilla import double_feedforward_Q_function  # noqa: unused-import
+from .ensemble import ValueFunctionEnsemble  # noqa: unused-import
 
 from softlearning.utils.serialization import (
     serialize_softlearning_object, deserialize_softlearning_object)
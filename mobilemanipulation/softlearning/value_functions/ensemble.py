@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+import tensorflow as tf
+
+
+class ValueFunctionEnsemble:
+    """Evaluates a tuple of feedforward value functions as one batched model.
+
+    The members must be built by `feedforward_Q_function` with the same
+    hidden layer sizes. Each member preprocesses the inputs with its own
+    preprocessors, or with a shared one that runs once inside a
+    `shared_features` scope. The dense heads of all the members are then
+    evaluated together: at every layer, the member kernels and biases are
+    stacked along a leading ensemble axis and applied with one batched
+    matmul. The ensemble owns no variables of its own: the stacks are read
+    from the members' variables, so training the ensemble trains the
+    members.
+    """
+
+    def __init__(self, value_functions, name='value_function_ensemble'):
+        self._value_functions = tuple(value_functions)
+        self._name = name
+
+        self._features_models = []
+        self._heads = []
+        for value_function in self._value_functions:
+            model = value_function.model
+            head = model.layers[-1]
+            dense_layers = (
+                head.layers[1:] if isinstance(head, tf.keras.Sequential)
+                else [])
+            if not (dense_layers
+                    and all(isinstance(layer, tf.keras.layers.Dense)
+                            for layer in dense_layers)):
+                raise ValueError(
+                    f"Can't stack the head of {value_function.name}, the"
+                    " members must be built by `feedforward_Q_function`.")
+            self._features_models.append(tf.keras.Model(
+                model.inputs, model.get_layer('features').output))
+            self._heads.append(dense_layers)
+
+        def head_signature(dense_layers):
+            return [
+                (tuple(layer.kernel.shape), layer.get_config()['activation'])
+                for layer in dense_layers
+            ]
+
+        if any(head_signature(dense_layers) != head_signature(self._heads[0])
+               for dense_layers in self._heads):
+            raise ValueError(
+                "The members of an ensemble must have the same head layers.")
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def value_functions(self):
+        return self._value_functions
+
+    @property
+    def trainable_variables(self):
+        # Members built with a shared preprocessor list its variables more
+        # than once.
+        variables = OrderedDict(
+            (variable.ref(), variable)
+            for value_function in self._value_functions
+            for variable in value_function.trainable_variables)
+        return list(variables.values())
+
+    def values(self, observations, *args):
+        """Compute the values of all members, stacked along axis 0."""
+        observations = self._value_functions[0]._filter_observations(
+            observations)
+        inputs = (observations, *args) if args else observations
+
+        out = tf.stack([
+            features_model(inputs) for features_model in self._features_models
+        ], axis=0)
+        for layers in zip(*self._heads):
+            dtype = layers[0].compute_dtype
+            kernel = tf.cast(
+                tf.stack([layer.kernel for layer in layers], axis=0), dtype)
+            bias = tf.cast(
+                tf.stack([layer.bias for layer in layers], axis=0), dtype)
+            out = tf.einsum('ebi,eio->ebo', tf.cast(out, dtype), kernel)
+            out = layers[0].activation(out + bias[:, tf.newaxis, :])
+
+        return out
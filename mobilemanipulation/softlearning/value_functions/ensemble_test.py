@@ -0,0 +1,153 @@
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+from softlearning import preprocessors
+from softlearning.value_functions.ensemble import ValueFunctionEnsemble
+from softlearning.value_functions.vanilla import feedforward_Q_function
+
+
+class ValueFunctionEnsembleTest(tf.test.TestCase):
+    def setUp(self):
+        self.hidden_layer_sizes = (8, 8)
+        self.num_members = 3
+
+        observation_shapes = OrderedDict((
+            ('observation', tf.TensorShape((4, ))),
+        ))
+        action_shape = tf.TensorShape((2, ))
+        self.value_functions = tuple(
+            feedforward_Q_function(
+                input_shapes=(observation_shapes, action_shape),
+                output_size=1,
+                hidden_layer_sizes=self.hidden_layer_sizes)
+            for _ in range(self.num_members))
+        self.ensemble = ValueFunctionEnsemble(self.value_functions)
+
+        self.observations = OrderedDict((
+            ('observation', np.random.uniform(size=(5, 4)).astype(np.float32)),
+        ))
+        self.actions = np.random.uniform(size=(5, 2)).astype(np.float32)
+
+    def test_values_match_members(self):
+        values = self.ensemble.values(self.observations, self.actions)
+        tf.debugging.assert_shapes(((values, (self.num_members, 5, 1)), ))
+
+        for member_values, value_function in zip(
+                values, self.value_functions):
+            self.assertAllClose(
+                member_values,
+                value_function.values(self.observations, self.actions))
+
+    def test_heads_run_as_one_batched_matmul_per_layer(self):
+        @tf.function
+        def values(observations, actions):
+            return self.ensemble.values(observations, actions)
+
+        graph = values.get_concrete_function(
+            self.observations, self.actions).graph
+        operation_types = [
+            operation.type for operation in graph.get_operations()]
+        num_batched_matmuls = sum(
+            operation_type in ('Einsum', 'BatchMatMulV2', 'BatchMatMulV3')
+            for operation_type in operation_types)
+        self.assertEqual(
+            num_batched_matmuls, len(self.hidden_layer_sizes) + 1)
+        self.assertNotIn('MatMul', operation_types)
+
+    def test_gradients_match_members(self):
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_sum(
+                self.ensemble.values(self.observations, self.actions))
+        gradients = tape.gradient(loss, self.ensemble.trainable_variables)
+
+        expected_gradients = []
+        for value_function in self.value_functions:
+            with tf.GradientTape() as tape:
+                loss = tf.reduce_sum(
+                    value_function.values(self.observations, self.actions))
+            expected_gradients += tape.gradient(
+                loss, value_function.trainable_variables)
+
+        for gradient, expected_gradient in zip(gradients, expected_gradients):
+            self.assertAllClose(gradient, expected_gradient)
+
+    def test_members_must_match(self):
+        observation_shapes = OrderedDict((
+            ('observation', tf.TensorShape((4, ))),
+        ))
+        value_functions = (
+            self.value_functions[0],
+            feedforward_Q_function(
+                input_shapes=(observation_shapes, tf.TensorShape((2, ))),
+                output_size=1,
+                hidden_layer_sizes=(16, 8)),
+        )
+        with self.assertRaises(ValueError):
+            ValueFunctionEnsemble(value_functions)
+
+    def test_trainable_variables(self):
+        self.assertEqual(
+            len(self.ensemble.trainable_variables),
+            self.num_members * 2 * (len(self.hidden_layer_sizes) + 1))
+
+    def test_shared_preprocessor(self):
+        observation_shapes = OrderedDict((
+            ('pixels', tf.TensorShape((8, 8, 3))),
+        ))
+        action_shape = tf.TensorShape((2, ))
+        convnet_preprocessor = {
+            'class_name': 'convnet_preprocessor',
+            'config': {
+                'conv_filters': (4, ),
+                'conv_kernel_sizes': (3, ),
+                'conv_strides': (2, ),
+                'shared_name': 'pixels_encoder',
+            },
+        }
+
+        with preprocessors.shared_preprocessors():
+            value_functions = tuple(
+                feedforward_Q_function(
+                    input_shapes=(observation_shapes, action_shape),
+                    output_size=1,
+                    hidden_layer_sizes=self.hidden_layer_sizes,
+                    preprocessors=({'pixels': convnet_preprocessor}, None))
+                for _ in range(self.num_members))
+        ensemble = ValueFunctionEnsemble(value_functions)
+
+        num_encoder_variables = 2
+        num_head_variables = 2 * (len(self.hidden_layer_sizes) + 1)
+        self.assertEqual(
+            len(ensemble.trainable_variables),
+            num_encoder_variables + self.num_members * num_head_variables)
+        self.assertEqual(
+            len(preprocessors.exclude_shared_variables(
+                value_functions[0].trainable_variables)),
+            num_head_variables)
+
+        # Inside `shared_features`, the encoder runs once per input.
+        encoder, = (
+            layer for layer in value_functions[0].model.layers
+            if isinstance(layer, preprocessors.SharedPreprocessor))
+        pixels = tf.constant(
+            np.random.randint(0, 256, size=(5, 8, 8, 3)), dtype=tf.uint8)
+        with preprocessors.shared_features():
+            self.assertIs(encoder(pixels), encoder(pixels))
+        self.assertIsNot(encoder(pixels), encoder(pixels))
+
+        # Models built outside of the scope get their own encoder.
+        unshared_value_function = feedforward_Q_function(
+            input_shapes=(observation_shapes, action_shape),
+            output_size=1,
+            hidden_layer_sizes=self.hidden_layer_sizes,
+            preprocessors=({'pixels': convnet_preprocessor}, None))
+        self.assertEqual(
+            len(preprocessors.exclude_shared_variables(
+                unshared_value_function.trainable_variables)),
+            num_encoder_variables + num_head_variables)
+
+
+if __name__ == '__main__':
+    tf.test.main()
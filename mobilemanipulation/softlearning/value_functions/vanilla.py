@@ -77,7 +77,8 @@ def feedforward_Q_function(input_shapes,
     # NOTE(hartikainen): `feedforward_model` would do the `cast_and_concat`
     # step for us, but tf2.2 broke the sequential multi-input handling: See:
     # https://github.com/tensorflow/tensorflow/issues/37061.
-    out = tf.keras.layers.Lambda(cast_and_concat)(preprocessed_inputs)
+    out = tf.keras.layers.Lambda(
+        cast_and_concat, name='features')(preprocessed_inputs)
     Q_model_body = feedforward_model(
         *args,
         output_shape=[output_size],